@@ -0,0 +1,108 @@
+from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from starlette.concurrency import run_in_threadpool
+import os
+
+from database import DATABASE_URL, engine_options, reads_from_primary, replica_router
+from monitoring import instrument_connection_pool, record_db_route
+
+# Activer les endpoints asynchrones (AsyncSession) à la place des endpoints synchrones
+ASYNC_DB_ENABLED = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# Pilotes asynchrones correspondant aux pilotes synchrones
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Convertir une URL de base de données vers son pilote asynchrone"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return parsed.set(
+        drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"
+    ).render_as_string(hide_password=False)
+
+
+# URL asynchrone (dérivée de DATABASE_URL si elle n'est pas fournie)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    """Créer le moteur asynchrone à la première utilisation"""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            **engine_options(ASYNC_DATABASE_URL, "primary-async", is_async=True),
+        )
+        instrument_connection_pool(_async_engine.sync_engine, "primary-async")
+        _async_sessionmaker = async_sessionmaker(
+            _async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    """Ouvrir une nouvelle session asynchrone"""
+    get_async_engine()
+    return _async_sessionmaker()
+
+
+# Dependency to get async database session
+async def get_async_db():
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+_replica_sessionmakers = {}
+
+
+def _replica_sessionmaker(replica) -> async_sessionmaker:
+    """Moteur asynchrone d'un réplica, créé à la première lecture"""
+    if replica.name not in _replica_sessionmakers:
+        url = to_async_url(replica.url)
+        name = f"{replica.name}-async"
+        replica_engine = create_async_engine(
+            url, **engine_options(url, name, is_async=True)
+        )
+        instrument_connection_pool(replica_engine.sync_engine, name)
+        _replica_sessionmakers[replica.name] = async_sessionmaker(
+            replica_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+    return _replica_sessionmakers[replica.name]
+
+
+# Dependency to get a read-only async session (replica when available)
+async def get_async_read_db(
+    request: Request, primary: AsyncSession = Depends(get_async_db)
+):
+    replica = None
+    if replica_router.replicas and not reads_from_primary(request):
+        # La vérification de santé est synchrone : hors de la boucle d'événements
+        replica = await run_in_threadpool(replica_router.choose)
+    if replica is None:
+        record_db_route("primary")
+        yield primary
+        return
+
+    record_db_route("replica")
+    db = _replica_sessionmaker(replica)()
+    try:
+        yield db
+    except OperationalError:
+        replica_router.mark_down(replica)
+        raise
+    finally:
+        await db.close()
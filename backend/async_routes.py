@@ -0,0 +1,552 @@
+from datetime import datetime, timedelta
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import Float, cast, false, func, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from async_database import get_async_db, get_async_read_db
+from auth import get_current_user_async
+from http_cache import (
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+    set_cache_headers,
+)
+from loans import checkout_book, process_loan_batch, return_loan
+from logging_config import logger
+from overdue import open_overdue_filter
+from models import (
+    BOOK_SEARCH_CONFIG,
+    BOOK_SORT_COLUMNS,
+    Book,
+    BookModel,
+    BookPage,
+    LoanBatchRequest,
+    LoanBatchResponse,
+    LoanCreate,
+    LoanArchiveModel,
+    LoanModel,
+    LoanPage,
+    LoanResponse,
+    LoanReturnRequest,
+    UserModel,
+)
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, keyset_seek
+from stats import (
+    get_catalog_version,
+    get_library_stats,
+    record_book_created,
+    record_book_deleted,
+    record_book_updated,
+)
+from suggest import suggestion_index
+
+# Versions asynchrones (AsyncSession) des endpoints livres et emprunts.
+# Les requêtes en attente de la base ne mobilisent pas de thread du pool
+# anyio ; les utilitaires synchrones (statistiques) passent par run_sync.
+router = APIRouter()
+
+BOOK_COLUMNS = (
+    BookModel.id,
+    BookModel.title,
+    BookModel.author,
+    BookModel.isbn,
+    BookModel.quantity,
+)
+
+
+async def _get_book_by_isbn(db: AsyncSession, isbn: str) -> Optional[BookModel]:
+    """Récupérer un livre par son ISBN"""
+    result = await db.execute(select(BookModel).where(BookModel.isbn == isbn))
+    return result.scalars().first()
+
+
+def _page_response(
+    request: Request, rows, limit: int, sort: str, next_cursor: Optional[str]
+):
+    """Construire l'enveloppe d'une page de livres"""
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
+    return {
+        "items": [dict(row._mapping) for row in rows],
+        "limit": limit,
+        "sort": sort,
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+
+@router.post("/books")
+async def create_book_async(
+    book: Book,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Créer un nouveau livre (nécessite authentification)"""
+    logger.info(f"Attempting to create book: {book.title} by {book.author}")
+
+    if await _get_book_by_isbn(db, book.isbn):
+        logger.warning(f"Attempt to create duplicate book with ISBN: {book.isbn}")
+        raise HTTPException(
+            status_code=400, detail="Book with this ISBN already exists"
+        )
+
+    db_book = BookModel(
+        title=book.title, author=book.author, isbn=book.isbn, quantity=book.quantity
+    )
+    db.add(db_book)
+    await db.run_sync(record_book_created, book.author, book.quantity)
+    await db.commit()
+    await db.refresh(db_book)
+    suggestion_index.add(db_book)
+
+    logger.info(f"Book created successfully: {book.title}")
+    return book
+
+
+@router.get("/books", response_model=BookPage)
+async def list_books_async(
+    request: Request,
+    response: Response,
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Nombre de livres par page",
+    ),
+    cursor: Optional[str] = Query(
+        None, description="Curseur opaque renvoyé par la page précédente"
+    ),
+    sort: Literal["id", "title", "author"] = Query("id", description="Champ de tri"),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Lister les livres page par page (nécessite authentification)"""
+    logger.info(f"Retrieving list of books (sort={sort}, limit={limit})")
+
+    catalog_version, last_modified = await db.run_sync(get_catalog_version)
+    etag = make_etag("books", catalog_version)
+    if is_not_modified(request, etag):
+        logger.info("Book list not modified")
+        return not_modified_response(etag, last_modified)
+
+    statement = keyset_seek(
+        select(*BOOK_COLUMNS),
+        sort,
+        BOOK_SORT_COLUMNS[sort],
+        BookModel.id,
+        cursor,
+        limit,
+    )
+    rows = (await db.execute(statement)).all()
+    rows, next_cursor = keyset_page(
+        rows, sort, BOOK_SORT_COLUMNS[sort], BookModel.id, limit
+    )
+
+    set_cache_headers(response, etag, last_modified)
+    logger.info(f"Retrieved {len(rows)} books")
+    return _page_response(request, rows, limit, sort, next_cursor)
+
+
+@router.get("/books/search", response_model=BookPage)
+async def search_books_async(
+    request: Request,
+    query: Optional[str] = Query(
+        None, description="Terme de recherche (titre, auteur ou ISBN)"
+    ),
+    min_quantity: Optional[int] = Query(
+        None, ge=0, description="Quantité minimale de livres"
+    ),
+    max_quantity: Optional[int] = Query(
+        None, ge=0, description="Quantité maximale de livres"
+    ),
+    mode: Literal["fulltext", "substring"] = Query(
+        "substring", description="Mode de recherche"
+    ),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Nombre de résultats par page",
+    ),
+    cursor: Optional[str] = Query(
+        None, description="Curseur opaque renvoyé par la page précédente"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Rechercher des livres avec des filtres optionnels (voir search_books)"""
+    logger.info(
+        f"Recherche de livres - Terme: {query}, Mode: {mode}, "
+        f"Quantité min: {min_quantity}, Quantité max: {max_quantity}"
+    )
+
+    sort_key, sort_column, descending = "id", BookModel.id, False
+    fulltext = (
+        bool(query)
+        and mode == "fulltext"
+        and db.get_bind().dialect.name == "postgresql"
+    )
+
+    if fulltext:
+        ts_query = func.websearch_to_tsquery(BOOK_SEARCH_CONFIG, query)
+        search_vector = literal_column("books.search_vector")
+        rank = cast(func.ts_rank(search_vector, ts_query), Float).label("rank")
+        statement = select(*BOOK_COLUMNS, rank).where(search_vector.op("@@")(ts_query))
+        sort_key, sort_column, descending = "rank", rank, True
+    else:
+        statement = select(*BOOK_COLUMNS)
+        if query:
+            statement = statement.where(
+                or_(
+                    BookModel.title.ilike(f"%{query}%"),
+                    BookModel.author.ilike(f"%{query}%"),
+                    BookModel.isbn.ilike(f"%{query}%"),
+                )
+            )
+
+    if min_quantity is not None:
+        statement = statement.where(BookModel.quantity >= min_quantity)
+
+    if max_quantity is not None:
+        statement = statement.where(BookModel.quantity <= max_quantity)
+
+    statement = keyset_seek(
+        statement,
+        sort_key,
+        sort_column,
+        BookModel.id,
+        cursor,
+        limit,
+        descending=descending,
+    )
+    rows = (await db.execute(statement)).all()
+    rows, next_cursor = keyset_page(rows, sort_key, sort_column, BookModel.id, limit)
+
+    logger.info(f"Recherche terminée - {len(rows)} résultats trouvés")
+    return _page_response(request, rows, limit, sort_key, next_cursor)
+
+
+@router.get("/books/stats")
+async def get_book_statistics_async(
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Obtenir des statistiques sur la collection de livres"""
+    logger.info("Récupération des statistiques de la bibliothèque")
+    stats = await db.run_sync(get_library_stats)
+    logger.info("Statistiques récupérées avec succès")
+    return stats
+
+
+@router.get("/books/{isbn}")
+async def get_book_async(
+    isbn: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Obtenir un livre par son ISBN (nécessite authentification)"""
+    logger.info(f"Attempting to retrieve book with ISBN: {isbn}")
+    book = await _get_book_by_isbn(db, isbn)
+    if not book:
+        logger.warning(f"Book not found with ISBN: {isbn}")
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    etag = make_etag(
+        "book", book.id, book.updated_at, book.title, book.author, book.quantity
+    )
+    if is_not_modified(request, etag):
+        logger.info(f"Book not modified: {isbn}")
+        return not_modified_response(etag, book.updated_at)
+
+    set_cache_headers(response, etag, book.updated_at)
+    logger.info(f"Book retrieved successfully: {book.title}")
+    return book
+
+
+@router.put("/books/{isbn}")
+async def update_book_async(
+    isbn: str,
+    book: Book,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Mettre à jour un livre (nécessite authentification)"""
+    if isbn != book.isbn:
+        logger.warning(f"ISBN mismatch: path {isbn}, book {book.isbn}")
+        raise HTTPException(
+            status_code=400, detail="ISBN in path must match book's ISBN"
+        )
+
+    logger.info(f"Attempting to update book with ISBN: {isbn}")
+
+    db_book = await _get_book_by_isbn(db, isbn)
+    if not db_book:
+        logger.warning(f"Book not found for update with ISBN: {isbn}")
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    await db.run_sync(
+        record_book_updated,
+        db_book.author,
+        db_book.quantity,
+        book.author,
+        book.quantity,
+    )
+    db_book.title = book.title
+    db_book.author = book.author
+    db_book.quantity = book.quantity
+
+    await db.commit()
+    await db.refresh(db_book)
+    suggestion_index.add(db_book)
+
+    logger.info(f"Book updated successfully: {book.title}")
+    return book
+
+
+@router.delete("/books/{isbn}")
+async def delete_book_async(
+    isbn: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Supprimer un livre (nécessite authentification)"""
+    logger.info(f"Attempting to delete book with ISBN: {isbn}")
+
+    db_book = await _get_book_by_isbn(db, isbn)
+    if not db_book:
+        logger.warning(f"Book not found for deletion with ISBN: {isbn}")
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    book_id = db_book.id
+    await db.run_sync(record_book_deleted, db_book.author, db_book.quantity)
+    await db.delete(db_book)
+    await db.commit()
+    suggestion_index.remove(book_id)
+
+    logger.info(f"Book deleted successfully: {isbn}")
+    return {"message": "Book deleted successfully"}
+
+
+@router.post("/loans", response_model=LoanResponse)
+async def create_loan_async(
+    loan: LoanCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Créer un nouvel emprunt de livre (requête conditionnelle, sans survente)"""
+    logger.info(f"Tentative d'emprunt de livre par {current_user.username}")
+
+    due_date = datetime.utcnow() + timedelta(days=loan.loan_duration_days)
+    new_loan = await db.run_sync(
+        checkout_book, loan.book_isbn, current_user.id, due_date
+    )
+
+    logger.info(f"Emprunt créé pour {current_user.username} - Livre : {loan.book_isbn}")
+    return new_loan
+
+
+@router.post("/loans/return", response_model=LoanResponse)
+async def return_book_async(
+    return_request: LoanReturnRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Retourner un livre emprunté"""
+    logger.info(f"Tentative de retour de livre par {current_user.username}")
+
+    loan = await db.run_sync(return_loan, return_request.loan_id, current_user.id)
+
+    if loan.due_date < datetime.utcnow():
+        logger.warning(f"Retard de retour pour l'emprunt : {loan.id}")
+
+    logger.info(f"Livre retourné par {current_user.username}")
+    return loan
+
+
+@router.post("/loans/batch", response_model=LoanBatchResponse)
+async def process_loans_batch_async(
+    batch: LoanBatchRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Traiter en une fois les emprunts et retours scannés à une banque de prêt"""
+    logger.info(
+        f"Lot de circulation par {current_user.username} : "
+        f"{len(batch.checkouts)} emprunts, {len(batch.returns)} retours"
+    )
+
+    borrower_id = current_user.id
+    if batch.user_id is not None and batch.user_id != current_user.id:
+        if not current_user.is_admin:
+            logger.warning(
+                "Tentative d'emprunt pour un autre utilisateur par un non-admin : "
+                f"{current_user.username}"
+            )
+            raise HTTPException(
+                status_code=403, detail="Accès réservé aux administrateurs"
+            )
+        if await db.get(UserModel, batch.user_id) is None:
+            raise HTTPException(status_code=404, detail="Utilisateur introuvable")
+        borrower_id = batch.user_id
+
+    due_date = datetime.utcnow() + timedelta(days=batch.loan_duration_days)
+    return await db.run_sync(
+        process_loan_batch,
+        borrower_id,
+        batch.checkouts,
+        batch.returns,
+        due_date,
+        None if current_user.is_admin else current_user.id,
+    )
+
+
+@router.get("/loans/user", response_model=LoanPage)
+async def get_user_loans_async(
+    request: Request,
+    show_returned: bool = False,
+    expand: Optional[Literal["book"]] = Query(
+        None, description="Inclure le livre de chaque emprunt"
+    ),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Nombre d'emprunts par page",
+    ),
+    cursor: Optional[str] = Query(
+        None, description="Curseur opaque renvoyé par la page précédente"
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """Récupérer les emprunts de l'utilisateur courant, du plus récent au plus ancien"""
+    logger.info(f"Récupération des emprunts pour {current_user.username}")
+
+    statement = select(LoanModel).where(LoanModel.user_id == current_user.id)
+    if not show_returned:
+        statement = statement.where(LoanModel.is_returned == false())
+    if expand == "book":
+        statement = statement.options(joinedload(LoanModel.book))
+
+    statement = keyset_seek(
+        statement, "-id", LoanModel.id, LoanModel.id, cursor, limit, descending=True
+    )
+    rows = list((await db.execute(statement)).scalars().all())
+
+    # Historique complet : emprunts archivés inclus (ids uniques entre les deux tables)
+    if show_returned:
+        archived = select(LoanArchiveModel).where(
+            LoanArchiveModel.user_id == current_user.id
+        )
+        if expand == "book":
+            archived = archived.options(joinedload(LoanArchiveModel.book))
+        archived = keyset_seek(
+            archived,
+            "-id",
+            LoanArchiveModel.id,
+            LoanArchiveModel.id,
+            cursor,
+            limit,
+            descending=True,
+        )
+        rows += (await db.execute(archived)).scalars().all()
+        rows.sort(key=lambda loan: loan.id, reverse=True)
+    loans, next_cursor = keyset_page(rows, "-id", LoanModel.id, LoanModel.id, limit)
+
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
+
+    logger.info(f"Récupéré {len(loans)} emprunts")
+    return {
+        "items": loans,
+        "limit": limit,
+        "sort": "-id",
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+
+@router.get("/loans/overdue", response_model=LoanPage)
+async def get_overdue_loans_async(
+    request: Request,
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Nombre d'emprunts par page",
+    ),
+    cursor: Optional[str] = Query(
+        None, description="Curseur opaque renvoyé par la page précédente"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserModel = Depends(get_current_user_async),
+):
+    """
+    Récupérer les emprunts en retard, du plus ancien au plus récent
+
+    Nécessite des droits d'administrateur
+    """
+    if not current_user.is_admin:
+        logger.warning(
+            "Tentative d'accès aux emprunts en retard par un non-admin : "
+            f"{current_user.username}"
+        )
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+
+    logger.info("Récupération des emprunts en retard")
+
+    statement = keyset_seek(
+        select(LoanModel).where(*open_overdue_filter(datetime.utcnow())),
+        "due_date",
+        LoanModel.due_date,
+        LoanModel.id,
+        cursor,
+        limit,
+    )
+    rows = (await db.execute(statement)).scalars().all()
+    overdue_loans, next_cursor = keyset_page(
+        rows, "due_date", LoanModel.due_date, LoanModel.id, limit
+    )
+
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
+
+    logger.info(f"Récupéré {len(overdue_loans)} emprunts en retard")
+    return {
+        "items": overdue_loans,
+        "limit": limit,
+        "sort": "due_date",
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+
+def use_async_routes(app: FastAPI) -> None:
+    """
+    Remplacer les endpoints synchrones par leurs versions asynchrones
+
+    Les routes synchrones ayant le même chemin et la même méthode sont
+    retirées, les autres (export, import, suggestions...) sont conservées.
+    """
+    replaced = {
+        (route.path, method) for route in router.routes for method in route.methods
+    }
+    app.router.routes = [
+        route
+        for route in app.router.routes
+        if not (
+            isinstance(route, APIRoute)
+            and any((route.path, method) in replaced for method in route.methods)
+        )
+    ]
+    app.include_router(router)
+    logger.info(f"Async database endpoints enabled ({len(router.routes)} routes)")
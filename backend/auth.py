@@ -1,41 +1,71 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
 from jose import jwt, JWTError
-import hashlib
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from database import get_db
+from async_database import get_async_db
+from database import SessionLocal, get_db
 from logging_config import logger
 from models import UserModel, TokenData, UserCreate, UserLogin
+from passwords import hash_password_async, password_context, verify_password_async
 
 # Configuration de la sécurité
 SECRET_KEY = os.getenv("SECRET_KEY", "votre-clé-secrète-temporaire-à-remplacer")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Configuration de hachage SHA256
+# Cache des utilisateurs authentifiés : durée de vie (secondes) et taille maximale.
+# La durée de vie est la fenêtre pendant laquelle un autre worker peut encore
+# accepter un token révoqué ou un compte désactivé (0 : toujours relire la base).
+# Les administrateurs sont toujours relus en base.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Hachage avec l'algorithme configuré (PASSWORD_HASHER)
 def hash_password(password: str) -> str:
-    """Hacher un mot de passe avec SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hacher un mot de passe"""
+    return password_context.hash(password)
 
 # Schéma OAuth2 pour l'authentification
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Vérifier un mot de passe en clair contre un hash"""
-    return hash_password(plain_password) == hashed_password
+    """Vérifier un mot de passe en clair contre un hash (tous algorithmes connus)"""
+    return password_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hacher un mot de passe"""
     return hash_password(password)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    """Créer un token d'accès JWT"""
+def create_access_token(
+    data: dict,
+    expires_delta: Optional[timedelta] = None,
+    user: Optional[UserModel] = None
+) -> str:
+    """
+    Créer un token d'accès JWT
+
+    Si l'utilisateur est fourni, son identifiant et sa version de token
+    sont ajoutés aux claims. Les droits (administrateur, compte actif) n'y
+    figurent pas : ils sont lus depuis l'utilisateur, après vérification
+    de la version du token.
+    """
     to_encode = data.copy()
+    if user is not None:
+        to_encode.update({
+            "user_id": user.id,
+            "token_version": user.token_version or 0,
+        })
     
     # Définir la durée d'expiration du token
     if expires_delta:
@@ -49,10 +79,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class UserCache:
+    """
+    Instantanés des utilisateurs authentifiés, bornés en taille et en durée de vie
+
+    Les instantanés sont des copies détachées de toute session (sans le hash
+    du mot de passe) : ils peuvent être partagés entre requêtes et threads.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[UserModel]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return user
+
+    def put(self, user: UserModel) -> UserModel:
+        snapshot = UserModel(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+            is_admin=user.is_admin,
+            token_version=user.token_version or 0
+        )
+        with self._lock:
+            self._entries[user.username] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()
+
 def get_user_by_username(db: Session, username: str) -> Optional[UserModel]:
     """Récupérer un utilisateur par son nom d'utilisateur"""
     return db.query(UserModel).filter(UserModel.username == username).first()
 
+def _upgrade_password_hash(db: Session, user: UserModel, new_hash: Optional[str]) -> None:
+    """Remplacer un hash obsolète (SHA-256 historique, ancien coût) après une connexion réussie"""
+    if new_hash is None:
+        return
+    user.hashed_password = new_hash
+    db.commit()
+    logger.info(f"Hash du mot de passe mis à jour pour {user.username}")
+
 def authenticate_user(db: Session, username: str, password: str) -> Optional[UserModel]:
     """Authentifier un utilisateur"""
     user = get_user_by_username(db, username)
@@ -60,41 +150,172 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     if not user:
         return None
     
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = password_context.verify_and_update(password, user.hashed_password)
+    if not verified:
         return None
     
+    _upgrade_password_hash(db, user, new_hash)
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserModel:
-    """Récupérer l'utilisateur courant à partir du token"""
-    credentials_exception = HTTPException(
+async def authenticate_user_async(db: Session, username: str, password: str) -> Optional[UserModel]:
+    """
+    Authentifier un utilisateur sans bloquer la boucle d'événements
+
+    La vérification du mot de passe s'exécute sur le pool de hachage, les
+    accès à la base sur le pool de threads de l'application.
+    """
+    user = await run_in_threadpool(get_user_by_username, db, username)
+    
+    if not user:
+        return None
+    
+    verified, new_hash = await verify_password_async(password, user.hashed_password)
+    if not verified:
+        return None
+    
+    await run_in_threadpool(_upgrade_password_hash, db, user, new_hash)
+    return user
+
+def _credentials_exception() -> HTTPException:
+    """Erreur 401 renvoyée pour un token invalide"""
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Impossible de valider les identifiants",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def decode_access_token(token: str) -> TokenData:
+    """Décoder un token d'accès JWT (401 s'il est invalide)"""
     try:
         # Décoder le token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         
         if username is None:
-            raise credentials_exception
+            raise _credentials_exception()
         
-        token_data = TokenData(username=username)
+        return TokenData(
+            username=username,
+            user_id=payload.get("user_id"),
+            token_version=payload.get("token_version", 0)
+        )
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+
+def _cached_user(token_data: TokenData) -> Optional[UserModel]:
+    """
+    Instantané du cache utilisable pour ce token, ou None pour relire la base
+
+    Les administrateurs sont toujours relus : une révocation de leurs droits
+    faite par un autre worker s'applique dès la requête suivante. Un
+    instantané d'un autre utilisateur du même nom (compte supprimé puis
+    recréé) est ignoré.
+    """
+    user = user_cache.get(token_data.username)
+    if user is None or user.is_admin or user.id != token_data.user_id:
+        return None
+    return user
+
+def _check_token_user(user: Optional[UserModel], token_data: TokenData) -> UserModel:
+    """Vérifier que le token n'a pas été révoqué et que le compte est actif"""
+    if user is None:
+        raise _credentials_exception()
+    
+    if token_data.user_id != user.id or token_data.token_version != user.token_version:
+        logger.warning(f"Token révoqué présenté pour {user.username}")
+        raise _credentials_exception()
+    
+    if not user.is_active:
+        logger.warning(f"Accès refusé à un compte désactivé : {user.username}")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Compte désactivé")
+    
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserModel:
+    """
+    Récupérer l'utilisateur courant à partir du token
+
+    Servi depuis le cache des utilisateurs : la base n'est interrogée
+    qu'à l'expiration de l'instantané, ou pour un administrateur.
+    """
+    token_data = decode_access_token(token)
+    
+    user = _cached_user(token_data)
+    if user is None:
+        db_user = get_user_by_username(db, username=token_data.username)
+        if db_user is not None:
+            user = user_cache.put(db_user)
+    
+    return _check_token_user(user, token_data)
+
+def authenticate_token(token: str, session_factory=SessionLocal) -> UserModel:
+    """
+    Utilisateur d'un token, avec les mêmes vérifications que get_current_user
+
+    Pour les middlewares, hors des dépendances FastAPI : une session n'est
+    ouverte qu'en l'absence d'instantané dans le cache.
+    """
+    token_data = decode_access_token(token)
+    
+    user = _cached_user(token_data)
+    if user is None:
+        with session_factory() as db:
+            db_user = get_user_by_username(db, username=token_data.username)
+            if db_user is not None:
+                user = user_cache.put(db_user)
     
-    # Récupérer l'utilisateur
-    user = get_user_by_username(db, username=token_data.username)
+    return _check_token_user(user, token_data)
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserModel:
+    """Récupérer l'utilisateur courant à partir du token (session asynchrone)"""
+    token_data = decode_access_token(token)
     
+    user = _cached_user(token_data)
     if user is None:
-        raise credentials_exception
+        result = await db.execute(select(UserModel).where(UserModel.username == token_data.username))
+        db_user = result.scalars().first()
+        if db_user is not None:
+            user = user_cache.put(db_user)
+    
+    return _check_token_user(user, token_data)
+
+def revoke_user_tokens(user: UserModel) -> None:
+    """
+    Révoquer les tokens émis pour un utilisateur
+
+    Incrémente sa version de token (à committer par l'appelant) et retire
+    son instantané du cache local.
+    """
+    user.token_version = (user.token_version or 0) + 1
+    user_cache.invalidate(user.username)
+
+def update_user_access(
+    db: Session,
+    user: UserModel,
+    is_active: Optional[bool] = None,
+    is_admin: Optional[bool] = None
+) -> UserModel:
+    """Activer / désactiver un compte ou modifier ses droits, en révoquant ses tokens"""
+    if is_active is not None:
+        user.is_active = is_active
+    if is_admin is not None:
+        user.is_admin = is_admin
+    revoke_user_tokens(user)
+    db.commit()
+    db.refresh(user)
+    # Un instantané relu entre-temps par une autre requête serait périmé
+    user_cache.invalidate(user.username)
     
+    logger.info(
+        f"Droits modifiés pour {user.username} : actif={user.is_active}, admin={user.is_admin}"
+    )
     return user
 
-def create_user(db: Session, user: UserCreate) -> UserModel:
-    """Créer un nouvel utilisateur"""
+def create_user(db: Session, user: UserCreate, hashed_password: Optional[str] = None) -> UserModel:
+    """Créer un nouvel utilisateur (le hash peut être calculé à l'avance)"""
     # Vérifier si le nom d'utilisateur existe déjà
     existing_user = get_user_by_username(db, user.username)
     if existing_user:
@@ -105,7 +326,8 @@ def create_user(db: Session, user: UserCreate) -> UserModel:
         )
     
     # Hacher le mot de passe
-    hashed_password = get_password_hash(user.password)
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     
     # Créer le modèle utilisateur
     db_user = UserModel(
@@ -123,3 +345,15 @@ def create_user(db: Session, user: UserCreate) -> UserModel:
     
     logger.info(f"Utilisateur créé : {user.username}")
     return db_user
+
+async def create_user_async(db: Session, user: UserCreate) -> UserModel:
+    """Créer un nouvel utilisateur, le mot de passe étant haché sur le pool de hachage"""
+    if await run_in_threadpool(get_user_by_username, db, user.username):
+        logger.warning(f"Tentative de création d'un utilisateur avec un nom déjà existant : {user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Ce nom d'utilisateur est déjà utilisé"
+        )
+    
+    hashed_password = await hash_password_async(user.password)
+    return await run_in_threadpool(create_user, db, user, hashed_password)
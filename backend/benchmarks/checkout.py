@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark des emprunts concurrents d'un même livre
+
+200 emprunteurs tentent simultanément d'emprunter le même ISBN, dont le
+stock est inférieur au nombre d'emprunteurs. Le benchmark vérifie que le
+nombre d'emprunts créés est exactement égal au stock initial (ni survente
+ni stock négatif) et mesure le débit.
+
+Usage (depuis backend/, sur la base de DATABASE_URL) :
+    python -m benchmarks.checkout --borrowers 200 --stock 50
+    python -m benchmarks.checkout --naive   # ancienne lecture-vérification-écriture
+"""
+
+import argparse
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from database import SessionLocal, get_engine
+from loans import checkout_book
+from migrations import upgrade
+from models import BookModel, LoanModel, UserModel
+from stats import record_stock_change
+
+
+def naive_checkout(db, isbn: str, user_id: int, due_date: datetime):
+    """Emprunt historique : lecture du stock, vérification en Python, écriture"""
+    book = db.query(BookModel).filter(BookModel.isbn == isbn).first()
+    if book.quantity < 1:
+        db.rollback()
+        raise HTTPException(
+            status_code=400, detail="Aucun exemplaire de ce livre n'est disponible"
+        )
+    loan = LoanModel(book_id=book.id, user_id=user_id, due_date=due_date)
+    book.quantity -= 1
+    record_stock_change(db, stock_delta=-1)
+    db.add(loan)
+    db.commit()
+    return loan
+
+
+def setup(borrowers: int, stock: int):
+    """Créer le livre et les emprunteurs du benchmark"""
+    run_id = uuid.uuid4().hex[:10]
+    isbn = f"bench-{run_id}"
+    with SessionLocal() as db:
+        db.add(
+            BookModel(
+                title="Checkout benchmark",
+                author="Benchmark",
+                isbn=isbn,
+                quantity=stock,
+            )
+        )
+        db.add_all(
+            UserModel(
+                username=f"bench-{run_id}-{index}",
+                email=f"bench-{run_id}-{index}@example.com",
+                hashed_password="-",
+            )
+            for index in range(borrowers)
+        )
+        db.commit()
+        user_ids = [
+            user_id
+            for (user_id,) in db.query(UserModel.id).filter(
+                UserModel.username.like(f"bench-{run_id}-%")
+            )
+        ]
+    return isbn, user_ids
+
+
+def run(borrowers: int, stock: int, naive: bool) -> bool:
+    isbn, user_ids = setup(borrowers, stock)
+    checkout = naive_checkout if naive else checkout_book
+    due_date = datetime.utcnow() + timedelta(days=14)
+    start = threading.Barrier(borrowers)
+    outcomes = {"created": 0, "unavailable": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def borrow(user_id: int):
+        start.wait()
+        with SessionLocal() as db:
+            try:
+                checkout(db, isbn, user_id, due_date)
+                outcome = "created"
+            except HTTPException:
+                outcome = "unavailable"
+            except Exception:
+                db.rollback()
+                outcome = "errors"
+        with lock:
+            outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=borrowers) as executor:
+        list(executor.map(borrow, user_ids))
+    elapsed = time.perf_counter() - started
+
+    with SessionLocal() as db:
+        book = db.query(BookModel).filter(BookModel.isbn == isbn).one()
+        loans = (
+            db.query(func.count(LoanModel.id))
+            .filter(LoanModel.book_id == book.id)
+            .scalar()
+        )
+
+    correct = loans == stock and book.quantity == 0 and outcomes["created"] == stock
+    engine = get_engine()
+    print(
+        f"Database          : {engine.url.get_backend_name()} "
+        f"(pool size {engine.pool.size()})"
+    )
+    print(
+        "Mode              : "
+        f"{'naive read-check-write' if naive else 'atomic conditional UPDATE'}"
+    )
+    print(f"Borrowers / stock : {borrowers} / {stock}")
+    print(f"Outcomes          : {outcomes}")
+    print(f"Loans in database : {loans}, remaining quantity: {book.quantity}")
+    print(f"Elapsed           : {elapsed:.3f}s ({borrowers / elapsed:.0f} checkouts/s)")
+    print(f"Result            : {'OK' if correct else 'INCORRECT COUNTS'}")
+    return correct
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--borrowers", type=int, default=200, help="Nombre d'emprunteurs simultanés"
+    )
+    parser.add_argument("--stock", type=int, default=50, help="Exemplaires disponibles")
+    parser.add_argument(
+        "--naive",
+        action="store_true",
+        help="Utiliser l'emprunt historique (non atomique)",
+    )
+    args = parser.parse_args()
+    upgrade(get_engine())
+    raise SystemExit(0 if run(args.borrowers, args.stock, args.naive) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Latence d'un passage en banque de prêt : requêtes unitaires contre un lot
+
+Emprunte puis retourne N exemplaires, d'abord avec N appels à /loans et
+/loans/return, puis avec deux appels à /loans/batch, et compare les durées.
+
+Usage (depuis backend/, sur la base de DATABASE_URL) :
+    python -m benchmarks.loan_batch --items 50
+"""
+
+import argparse
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+from auth import create_access_token
+from database import SessionLocal, get_engine
+from main import app
+from migrations import upgrade
+from models import BookModel, UserModel
+
+
+def setup(items: int):
+    """Créer un utilisateur et un livre par exemplaire scanné"""
+    run_id = uuid.uuid4().hex[:10]
+    with SessionLocal() as db:
+        user = UserModel(
+            username=f"desk-{run_id}",
+            email=f"desk-{run_id}@example.com",
+            hashed_password="-",
+        )
+        db.add(user)
+        db.add_all(
+            BookModel(
+                title=f"Desk {index}",
+                author="Benchmark",
+                isbn=f"desk-{run_id}-{index}",
+                quantity=2,
+            )
+            for index in range(items)
+        )
+        db.commit()
+        token = create_access_token({"sub": user.username}, user=user)
+    headers = {"Authorization": f"Bearer {token}"}
+    return headers, [f"desk-{run_id}-{index}" for index in range(items)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--items", type=int, default=50, help="Nombre d'exemplaires scannés"
+    )
+    args = parser.parse_args()
+
+    upgrade(get_engine())
+    client = TestClient(app)
+    headers, isbns = setup(args.items)
+
+    started = time.perf_counter()
+    loan_ids = [
+        client.post("/loans", json={"book_isbn": isbn}, headers=headers).json()["id"]
+        for isbn in isbns
+    ]
+    for loan_id in loan_ids:
+        client.post("/loans/return", json={"loan_id": loan_id}, headers=headers)
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    checkouts = client.post(
+        "/loans/batch", json={"checkouts": isbns}, headers=headers
+    ).json()["checkouts"]
+    returns = [item["loan_id"] for item in checkouts if item["status"] == "created"]
+    client.post("/loans/batch", json={"returns": returns}, headers=headers)
+    batch = time.perf_counter() - started
+
+    print(f"Items             : {args.items} checkouts + {args.items} returns")
+    print(f"Single requests   : {single * 1000:.1f} ms ({2 * args.items} requests)")
+    print(f"Batch requests    : {batch * 1000:.1f} ms (2 requests)")
+    print(f"Speed-up          : x{single / batch:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Surcoût par requête du middleware de métriques HTTP
+
+Appelle directement une application FastAPI minimale (sans serveur ni
+réseau) sur une route /books/{isbn}, sans middleware, avec l'ancien
+middleware BaseHTTPMiddleware (étiquette = URL) et avec MetricsMiddleware
+(ASGI pur, étiquette = modèle de route), puis affiche le temps moyen par
+requête (meilleure passe) et le nombre de séries créées.
+
+Usage (depuis backend/) :
+    python -m benchmarks.metrics_middleware --requests 20000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI, Request
+from prometheus_client import REGISTRY
+
+from monitoring import (
+    ACTIVE_CONNECTIONS,
+    REQUEST_COUNT,
+    REQUEST_DURATION,
+    MetricsMiddleware,
+)
+
+
+def build_app(middleware: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/books/{isbn}")
+    async def read_book(isbn: str):
+        return {"isbn": isbn}
+
+    if middleware == "asgi":
+        app.add_middleware(MetricsMiddleware)
+    elif middleware == "base-http":
+
+        @app.middleware("http")
+        async def legacy_metrics(request: Request, call_next):
+            # Ancien middleware : BaseHTTPMiddleware, étiquette = URL brute
+            ACTIVE_CONNECTIONS.inc()
+            start_time = time.time()
+            try:
+                response = await call_next(request)
+                REQUEST_COUNT.labels(
+                    method=request.method,
+                    endpoint=request.url.path,
+                    status_code=str(response.status_code),
+                ).inc()
+                REQUEST_DURATION.labels(
+                    method=request.method, endpoint=request.url.path
+                ).observe(time.time() - start_time)
+                return response
+            finally:
+                ACTIVE_CONNECTIONS.dec()
+
+    return app
+
+
+async def call(app: FastAPI, path: str) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+
+    received = asyncio.Event()
+
+    async def receive():
+        if received.is_set():
+            # Pas de déconnexion : attendre jusqu'à l'annulation
+            await asyncio.Event().wait()
+        received.set()
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(middlewares, requests: int, rounds: int) -> dict:
+    """Meilleur temps moyen par requête, configurations alternées à chaque passe"""
+    apps = {middleware: build_app(middleware) for middleware in middlewares}
+    best = {middleware: float("inf") for middleware in middlewares}
+    for middleware, app in apps.items():
+        for index in range(200):
+            await call(app, f"/books/warmup-{index}")
+    for round_index in range(rounds):
+        for middleware, app in apps.items():
+            started = time.perf_counter()
+            for index in range(requests):
+                await call(app, f"/books/{middleware}-{round_index}-{index:013d}")
+            best[middleware] = min(
+                best[middleware], (time.perf_counter() - started) / requests
+            )
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--requests", type=int, default=20000, help="Requêtes par passe"
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="Passes par configuration (meilleure retenue)",
+    )
+    args = parser.parse_args()
+
+    middlewares = ("none", "base-http", "asgi")
+    results = asyncio.run(measure(middlewares, args.requests, args.rounds))
+    for middleware in middlewares:
+        print(f"{middleware:<10}: {results[middleware] * 1e6:7.1f} us/request")
+    endpoints = {
+        sample.labels["endpoint"]
+        for metric in REGISTRY.collect()
+        if metric.name == "http_requests"
+        for sample in metric.samples
+    }
+    per_url = [
+        endpoint
+        for endpoint in endpoints
+        if endpoint.startswith("/books/") and endpoint != "/books/{isbn}"
+    ]
+    print(
+        f"Endpoint labels : {len(per_url)} per URL (base-http), "
+        f"{int('/books/{isbn}' in endpoints)} per route (asgi)"
+    )
+    print(
+        "BaseHTTPMiddleware overhead : "
+        f"{(results['base-http'] - results['none']) * 1e6:.1f} us/request"
+    )
+    print(
+        "MetricsMiddleware overhead  : "
+        f"{(results['asgi'] - results['none']) * 1e6:.1f} us/request"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Surcoût de l'échantillonnage continu des piles (STACK_SAMPLER_INTERVAL_MS)
+
+Sert une application FastAPI minimale sous MetricsMiddleware, dont la route
+/books/{isbn} travaille dans le pool de threads, avec --concurrency requêtes
+en vol, appelée directement (sans serveur ni réseau). Les passes alternent
+sans échantillonnage et avec chaque intervalle demandé ; pour chacun sont
+affichés le temps moyen par requête (meilleure passe), le surcoût par
+rapport à la passe sans échantillonnage, le coût moyen d'un échantillon et
+la part du temps (sous le GIL) qu'il représente à cet intervalle.
+
+Usage (depuis backend/) :
+    python -m benchmarks.stack_sampler --intervals 10,50,100 --requests 500
+"""
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from benchmarks.metrics_middleware import call
+from jobs import PeriodicJob
+from monitoring import MetricsMiddleware
+from profiling import StackSampler
+
+
+def build_app(work: int) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/books/{isbn}")
+    def read_book(isbn: str):
+        # Route synchrone : exécutée dans le pool de threads, comme l'API
+        return {"isbn": isbn, "total": sum(range(work))}
+
+    return app
+
+
+class TimedSampler:
+    """StackSampler dont chaque échantillon est chronométré"""
+
+    def __init__(self):
+        self.sampler = StackSampler()
+        self.calls = 0
+        self.seconds = 0.0
+
+    def sample(self) -> int:
+        started = time.perf_counter()
+        stacks = self.sampler.sample()
+        self.seconds += time.perf_counter() - started
+        self.calls += 1
+        return stacks
+
+
+async def run_load(app: FastAPI, requests: int, concurrency: int) -> float:
+    """Temps moyen par requête avec concurrency requêtes en vol"""
+    queue = iter(range(requests))
+
+    async def client():
+        for index in queue:
+            await call(app, f"/books/{index:010d}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return (time.perf_counter() - started) / requests
+
+
+async def measure(intervals, requests: int, concurrency: int, rounds: int, work: int):
+    app = build_app(work)
+    await run_load(app, 200, concurrency)
+
+    best = {interval: float("inf") for interval in (0,) + intervals}
+    samplers = {interval: TimedSampler() for interval in intervals}
+    for _ in range(rounds):
+        for interval in best:
+            job = None
+            if interval:
+                job = PeriodicJob(
+                    "stack-sampler-bench", interval / 1000, samplers[interval].sample
+                )
+                job.start()
+            try:
+                per_request = await run_load(app, requests, concurrency)
+            finally:
+                if job is not None:
+                    job.stop()
+            best[interval] = min(best[interval], per_request)
+    return best, samplers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--intervals",
+        default="10,50,100",
+        help="Intervalles d'échantillonnage comparés (millisecondes)",
+    )
+    parser.add_argument("--requests", type=int, default=500, help="Requêtes par passe")
+    parser.add_argument(
+        "--concurrency", type=int, default=20, help="Requêtes simultanées"
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="Passes par configuration (meilleure retenue)",
+    )
+    parser.add_argument(
+        "--work", type=int, default=200000, help="Itérations de calcul par requête"
+    )
+    args = parser.parse_args()
+
+    intervals = tuple(float(value) for value in args.intervals.split(","))
+    best, samplers = asyncio.run(
+        measure(intervals, args.requests, args.concurrency, args.rounds, args.work)
+    )
+
+    print(f"Sampler off       : {best[0] * 1e6:8.1f} us/request")
+    for interval in intervals:
+        sampler = samplers[interval]
+        per_sample = sampler.seconds / sampler.calls if sampler.calls else 0.0
+        overhead = (best[interval] - best[0]) / best[0] * 100
+        print(
+            f"Sampler {interval:>5g} ms  : {best[interval] * 1e6:8.1f} us/request "
+            f"({overhead:+.1f} %), {per_sample * 1e6:.0f} us/sample "
+            f"({per_sample / interval * 1e5:.2f} % of the time), "
+            f"{sampler.sampler.samples} stacks in {sampler.calls} samples"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Temps d'import et de démarrage de l'application
+
+Chaque mesure est faite dans un nouveau processus, comme au lancement d'un
+worker : durée de `import main`, nombre de connexions ouvertes pendant
+l'import (attendu : 0), puis durée du démarrage (lifespan : création du
+moteur, migrations, index d'autocomplétion...). Le premier démarrage sur
+une base vide applique toutes les migrations.
+
+Usage (depuis backend/, sur la base de DATABASE_URL) :
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MEASURE = """
+import asyncio, json, time
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+connections = []
+event.listen(Pool, "connect", lambda *args: connections.append(1))
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import_connections = len(connections)
+
+async def start_and_stop():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(start_and_stop())
+
+print(json.dumps({
+    "import": imported - started,
+    "import_connections": import_connections,
+    "startup": ready - imported,
+}))
+"""
+
+
+def measure() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Nombre de processus lancés"
+    )
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    for index, run in enumerate(runs, 1):
+        print(
+            f"Run {index}             : import {run['import'] * 1000:.1f} ms "
+            f"({run['import_connections']} connections), "
+            f"startup {run['startup'] * 1000:.1f} ms"
+        )
+    print(
+        "Median import     : "
+        f"{statistics.median(run['import'] for run in runs) * 1000:.1f} ms"
+    )
+    print(
+        "Median startup    : "
+        f"{statistics.median(run['startup'] for run in runs) * 1000:.1f} ms"
+    )
+    raise SystemExit(0 if all(run["import_connections"] == 0 for run in runs) else 1)
+
+
+if __name__ == "__main__":
+    main()
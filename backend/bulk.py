@@ -0,0 +1,318 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from database import dialect_insert
+from logging_config import logger
+from models import Book, BookModel
+from stats import record_author_changes, record_stock_change
+from suggest import suggestion_index
+
+# Nombre de lignes validées et insérées par transaction
+BULK_BATCH_SIZE = 1000
+# Taille maximale d'un import, corps ou fichier multipart (413 au-delà)
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Formats acceptés, par type de contenu et par extension de fichier
+BULK_CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+BULK_EXTENSIONS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".csv": "csv",
+}
+
+# Une ligne lue : (numéro de ligne, données ou None, erreur de lecture)
+RawRow = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def _format_for(
+    content_type: Optional[str], filename: Optional[str] = None
+) -> Optional[str]:
+    """Déterminer le format d'un import à partir de son type ou de son nom"""
+    if filename:
+        for extension, bulk_format in BULK_EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return bulk_format
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return BULK_CONTENT_TYPES.get(media_type)
+
+
+def _upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Bulk upload too large (max {BULK_UPLOAD_MAX_BYTES} bytes)",
+    )
+
+
+async def _read_body(request: Request) -> bytes:
+    """Lire le corps de la requête en s'arrêtant dès que la limite est dépassée"""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BULK_UPLOAD_MAX_BYTES:
+            raise _upload_too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_bulk_upload(request: Request) -> Tuple[str, bytes]:
+    """
+    Lire le contenu d'un import en masse
+
+    Accepte un corps JSON (tableau), NDJSON ou CSV, ou un fichier envoyé en
+    multipart/form-data dans le champ "file". Un Content-Length annoncé
+    au-delà de BULK_UPLOAD_MAX_BYTES est refusé avant toute lecture.
+    """
+    content_length = request.headers.get("content-length")
+    if (
+        content_length
+        and content_length.isdigit()
+        and int(content_length) > BULK_UPLOAD_MAX_BYTES
+    ):
+        raise _upload_too_large()
+
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    if media_type == "multipart/form-data":
+        # Sans Content-Length, le fichier est mis en tampon sur disque par Starlette
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=400, detail="Missing upload file field 'file'"
+            )
+        if upload.size is not None and upload.size > BULK_UPLOAD_MAX_BYTES:
+            raise _upload_too_large()
+        bulk_format = _format_for(upload.content_type, upload.filename)
+        data = await upload.read()
+    else:
+        bulk_format = _format_for(media_type)
+        data = await _read_body(request)
+
+    if bulk_format is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Unsupported bulk format, expected JSON array, NDJSON or CSV",
+        )
+    return bulk_format, data
+
+
+def iter_bulk_rows(bulk_format: str, data: bytes) -> Iterator[RawRow]:
+    """Lire les lignes d'un import une par une"""
+    if bulk_format == "json":
+        try:
+            rows = json.loads(data)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(rows, list):
+            raise HTTPException(
+                status_code=400, detail="JSON body must be an array of books"
+            )
+        for number, row in enumerate(rows, start=1):
+            if isinstance(row, dict):
+                yield number, row, None
+            else:
+                yield number, None, "Row is not an object"
+        return
+
+    # Décodé en entier avant la première ligne : rien n'est inséré si l'import
+    # n'est pas en UTF-8
+    try:
+        text = io.StringIO(data.decode("utf-8-sig"), newline="")
+    except UnicodeDecodeError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bulk upload is not valid UTF-8 (invalid byte at offset {e.start})",
+        )
+
+    if bulk_format == "ndjson":
+        number = 0
+        for line in text:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, None, "Invalid JSON line"
+                continue
+            if isinstance(row, dict):
+                yield number, row, None
+            else:
+                yield number, None, "Row is not an object"
+        return
+
+    for number, row in enumerate(csv.DictReader(text), start=1):
+        # Les cellules vides prennent la valeur par défaut du modèle
+        yield number, {
+            key: value for key, value in row.items() if key and value != ""
+        }, None
+
+
+def _batches(rows: Iterable[RawRow], size: int) -> Iterator[List[RawRow]]:
+    """Regrouper les lignes par lots"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _validation_errors(error: ValidationError) -> List[str]:
+    """Résumer les erreurs de validation d'une ligne"""
+    return [
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}"
+        for detail in error.errors()
+    ]
+
+
+def _insert_books_statement(db: Session):
+    """INSERT des livres ignorant les ISBN déjà présents, avec les lignes créées"""
+    books = BookModel.__table__
+    return (
+        dialect_insert(db, books)
+        .on_conflict_do_nothing(index_elements=[books.c.isbn])
+        .returning(books.c.id, books.c.title, books.c.author, books.c.isbn)
+    )
+
+
+def ingest_books(
+    db: Session,
+    rows: Iterable[RawRow],
+    batch_size: int = BULK_BATCH_SIZE,
+    include_created: bool = True,
+) -> Dict[str, Any]:
+    """
+    Valider et insérer des livres par lots
+
+    Chaque lot est validé contre le modèle Book puis écrit en une seule
+    requête INSERT ... ON CONFLICT (isbn) DO NOTHING, dans la même
+    transaction que la mise à jour des statistiques. Les ISBN déjà présents
+    en base ou dans l'import sont signalés comme doublons.
+    """
+    started = time.perf_counter()
+    report_rows = []
+    counts = Counter()
+    seen_isbns = set()
+    created_rows = []
+
+    for batch in _batches(rows, batch_size):
+        valid = []
+        for number, data, error in batch:
+            if error:
+                report_rows.append(
+                    {
+                        "row": number,
+                        "isbn": None,
+                        "status": "invalid",
+                        "errors": [error],
+                    }
+                )
+                counts["invalid"] += 1
+                continue
+            try:
+                book = Book.model_validate(data)
+            except ValidationError as exc:
+                report_rows.append(
+                    {
+                        "row": number,
+                        "isbn": data.get("isbn"),
+                        "status": "invalid",
+                        "errors": _validation_errors(exc),
+                    }
+                )
+                counts["invalid"] += 1
+                continue
+            if book.isbn in seen_isbns:
+                report_rows.append(
+                    {"row": number, "isbn": book.isbn, "status": "duplicate"}
+                )
+                counts["duplicate"] += 1
+                continue
+            seen_isbns.add(book.isbn)
+            valid.append((number, book))
+
+        if not valid:
+            continue
+
+        # executemany sur une instruction compilée une seule fois (insertmanyvalues)
+        inserted = {
+            row.isbn: row
+            for row in db.execute(
+                _insert_books_statement(db),
+                [
+                    {
+                        "title": book.title,
+                        "author": book.author,
+                        "isbn": book.isbn,
+                        "quantity": book.quantity,
+                    }
+                    for _, book in valid
+                ],
+            )
+        }
+
+        created_books = [book for _, book in valid if book.isbn in inserted]
+        if created_books:
+            record_stock_change(
+                db,
+                stock_delta=sum(book.quantity for book in created_books),
+                books_delta=len(created_books),
+                titles_changed=True,
+            )
+            record_author_changes(db, Counter(book.author for book in created_books))
+        db.commit()
+
+        for number, book in valid:
+            if book.isbn in inserted:
+                created_rows.append(inserted[book.isbn])
+                counts["created"] += 1
+                if include_created:
+                    report_rows.append(
+                        {"row": number, "isbn": book.isbn, "status": "created"}
+                    )
+            else:
+                report_rows.append(
+                    {"row": number, "isbn": book.isbn, "status": "duplicate"}
+                )
+                counts["duplicate"] += 1
+
+    # Une seule fusion dans l'index d'autocomplétion pour tout l'import
+    suggestion_index.add_many(created_rows)
+
+    elapsed = time.perf_counter() - started
+    total = counts["created"] + counts["duplicate"] + counts["invalid"]
+    report_rows.sort(key=lambda item: item["row"])
+
+    logger.info(
+        f"Bulk import: {counts['created']} created, {counts['duplicate']} duplicates, "
+        f"{counts['invalid']} invalid in {elapsed:.2f}s"
+    )
+    return {
+        "total": total,
+        "created": counts["created"],
+        "duplicates": counts["duplicate"],
+        "invalid": counts["invalid"],
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else None,
+        "rows": report_rows,
+    }
@@ -20,6 +20,8 @@ echo "Vérification des fichiers essentiels :"
 echo "Variables d'environnement :"
 env
 
-# Tenter de démarrer l'application avec des informations de débogage
-echo "Démarrage de l'application Uvicorn..."
-exec uvicorn main:app --host 0.0.0.0 --port ${PORT:-8000} --log-level debug
+# Workers uvicorn gérés par gunicorn (gunicorn.conf.py) : le répertoire des
+# métriques multiprocessus est vidé au lancement et les jauges d'un worker
+# terminé, même après un crash, sont retirées
+echo "Démarrage de l'application (gunicorn, ${WEB_CONCURRENCY:-1} workers uvicorn)..."
+exec gunicorn main:app -c gunicorn.conf.py --log-level debug
@@ -0,0 +1,29 @@
+"""
+Configuration gunicorn (workers uvicorn) avec métriques Prometheus multiprocessus
+
+Utilisée par entrypoint.sh. Usage (depuis backend/) :
+    PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus gunicorn main:app -c gunicorn.conf.py
+"""
+
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def on_starting(server):
+    """Vider le répertoire des métriques avant de lancer les workers"""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Retirer les jauges "live" d'un worker terminé, y compris après un crash"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
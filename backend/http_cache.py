@@ -0,0 +1,68 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Les réponses dépendent de l'utilisateur authentifié : cache privé,
+# revalidé à chaque requête grâce à l'ETag
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Construire un ETag faible à partir des éléments de version d'une ressource"""
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()[
+        :16
+    ]
+    return f'W/"{digest}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Ramener une date en UTC (les dates naïves sont considérées UTC)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _strip_weak(tag: str) -> str:
+    """Retirer le préfixe faible pour une comparaison faible des ETags"""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    Évaluer l'en-tête conditionnel If-None-Match d'une requête GET
+
+    If-Modified-Since est ignoré (RFC 9110, section 13.1.3) : Last-Modified
+    n'a qu'une précision à la seconde, et sur PostgreSQL now() est l'heure
+    de début de la transaction, qui peut valider une date antérieure à une
+    date déjà vue par le client. Seul l'ETag, issu des versions, est sûr.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = _strip_weak(etag)
+    return any(_strip_weak(tag) == current for tag in if_none_match.split(","))
+
+
+def set_cache_headers(
+    response: Response, etag: str, last_modified: Optional[datetime]
+) -> None:
+    """Ajouter les validateurs de cache à une réponse"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = format_datetime(
+            _as_utc(last_modified), usegmt=True
+        )
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime]) -> Response:
+    """Réponse 304 sans corps"""
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, last_modified)
+    return response
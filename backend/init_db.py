@@ -4,26 +4,25 @@ Script d'initialisation de la base de données
 Crée les tables et insère des données de test
 """
 
-from database import engine
-from models import Base, UserModel, BookModel, LoanModel
-from sqlalchemy.orm import sessionmaker
+from database import SessionLocal, get_engine
+from migrations import upgrade
+from models import UserModel, BookModel, LoanModel
+from stats import rebuild_library_stats
+from passwords import password_context
 from datetime import datetime, timedelta
 import random
-import hashlib
 
 def hash_password(password: str) -> str:
-    # Simple hash pour les tests (à remplacer par bcrypt en production)
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_context.hash(password)
 
 def init_database():
     """Initialise la base de données avec les tables et données de test"""
     
-    print("🔧 Création des tables...")
-    Base.metadata.create_all(bind=engine)
-    print("✅ Tables créées avec succès")
+    print("🔧 Application des migrations...")
+    upgrade(get_engine())
+    print("✅ Schéma à jour")
     
     # Créer une session
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     db = SessionLocal()
     
     try:
@@ -110,6 +109,9 @@ def init_database():
         
         db.commit()
         
+        # Initialiser les statistiques agrégées à partir des données insérées
+        rebuild_library_stats(db)
+        
         print("✅ Données de test insérées avec succès!")
         print(f"👥 Utilisateurs créés: {len(users_data)}")
         print(f"📖 Livres ajoutés: {len(books_data)}")
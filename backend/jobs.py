@@ -0,0 +1,43 @@
+import threading
+from typing import Callable, Optional
+
+from logging_config import logger
+
+
+class PeriodicJob:
+    """
+    Tâche périodique exécutée dans un thread de l'application
+
+    Démarrée et arrêtée avec l'application ; une erreur est journalisée
+    sans interrompre les exécutions suivantes. Un intervalle nul ou
+    négatif désactive la tâche.
+    """
+
+    def __init__(self, name: str, interval: float, function: Callable[[], object]):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.function()
+            except Exception as e:
+                logger.error(f"Échec de la tâche {self.name} : {e}")
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Tâche {self.name} toutes les {self.interval:g}s")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
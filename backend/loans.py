@@ -0,0 +1,264 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import case, false, func, insert, literal, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from logging_config import logger
+from models import BookModel, LoanModel
+from stats import record_stock_change
+
+
+def _checkout_statement(dialect: str, isbn: str, user_id: int, due_date: datetime):
+    """
+    Décrémenter le stock si un exemplaire est disponible et créer l'emprunt
+
+    Sur PostgreSQL, l'UPDATE conditionnel et l'INSERT de l'emprunt forment
+    une seule requête (CTE) : la ligne du livre n'est verrouillée que le
+    temps de cette requête et aucun exemplaire ne peut être prêté deux fois.
+    """
+    books = BookModel.__table__
+    loans = LoanModel.__table__
+
+    taken = (
+        update(books)
+        .where(books.c.isbn == isbn, books.c.quantity > 0)
+        .values(quantity=books.c.quantity - 1, updated_at=func.now())
+        .returning(books.c.id)
+    )
+
+    if dialect != "postgresql":
+        return taken, None
+
+    taken = taken.cte("taken")
+    loan = (
+        insert(loans)
+        .from_select(
+            ["book_id", "user_id", "due_date", "is_returned"],
+            select(
+                taken.c.id,
+                literal(user_id),
+                literal(due_date, loans.c.due_date.type),
+                false(),
+            ),
+        )
+        .returning(*loans.c)
+    )
+    return None, loan
+
+
+def checkout_book(db: Session, isbn: str, user_id: int, due_date: datetime) -> Row:
+    """
+    Emprunter un exemplaire d'un livre de façon atomique
+
+    Aucune lecture préalable du stock : la disponibilité est vérifiée par
+    la condition quantity > 0 de l'UPDATE. Lève 404 si le livre n'existe
+    pas et 400 s'il n'a plus d'exemplaire disponible.
+    """
+    loans = LoanModel.__table__
+    update_statement, loan_statement = _checkout_statement(
+        db.get_bind().dialect.name, isbn, user_id, due_date
+    )
+
+    if loan_statement is not None:
+        loan = db.execute(loan_statement).first()
+    else:
+        # Sans UPDATE dans une CTE (SQLite) : deux requêtes dans la même transaction
+        book_id = db.execute(update_statement).scalar()
+        loan = None
+        if book_id is not None:
+            loan = db.execute(
+                insert(loans)
+                .values(
+                    book_id=book_id,
+                    user_id=user_id,
+                    due_date=due_date,
+                    is_returned=False,
+                )
+                .returning(*loans.c)
+            ).first()
+
+    if loan is None:
+        db.rollback()
+        if db.query(BookModel.id).filter(BookModel.isbn == isbn).first() is None:
+            logger.warning(f"Livre non trouvé avec l'ISBN : {isbn}")
+            raise HTTPException(status_code=404, detail="Livre non trouvé")
+        logger.warning(f"Livre indisponible : {isbn}")
+        raise HTTPException(
+            status_code=400, detail="Aucun exemplaire de ce livre n'est disponible"
+        )
+
+    record_stock_change(db, stock_delta=-1)
+    db.commit()
+    return loan
+
+
+def return_loan(db: Session, loan_id: int, user_id: int) -> Row:
+    """
+    Retourner un emprunt de façon atomique
+
+    L'UPDATE conditionnel de l'emprunt (is_returned encore faux) garantit
+    qu'un retour n'est compté qu'une fois ; le stock est incrémenté par
+    quantity = quantity + 1, sans lecture préalable, et ne peut donc pas
+    écraser un emprunt concurrent. Lève 404 si l'emprunt n'existe pas,
+    appartient à un autre utilisateur ou est déjà retourné.
+    """
+    books = BookModel.__table__
+    loans = LoanModel.__table__
+
+    loan = db.execute(
+        update(loans)
+        .where(
+            loans.c.id == loan_id,
+            loans.c.user_id == user_id,
+            loans.c.is_returned == false(),
+        )
+        .values(is_returned=True, return_date=datetime.utcnow())
+        .returning(*loans.c)
+    ).first()
+
+    if loan is None:
+        db.rollback()
+        logger.warning(f"Emprunt non trouvé ou déjà retourné : {loan_id}")
+        raise HTTPException(
+            status_code=404, detail="Emprunt non trouvé ou déjà retourné"
+        )
+
+    db.execute(
+        update(books)
+        .where(books.c.id == loan.book_id)
+        .values(quantity=books.c.quantity + 1, updated_at=func.now())
+    )
+    record_stock_change(db, stock_delta=1)
+    db.commit()
+    return loan
+
+
+def process_loan_batch(
+    db: Session,
+    borrower_id: int,
+    checkout_isbns: List[str],
+    return_ids: List[int],
+    due_date: datetime,
+    returns_owner_id: Optional[int] = None,
+) -> Dict[str, list]:
+    """
+    Traiter un lot de retours puis d'emprunts en une transaction
+
+    Le nombre de requêtes ne dépend pas de la taille du lot : un UPDATE
+    des emprunts retournés, un SELECT ... FOR UPDATE des livres concernés
+    (verrouillés par id croissant), un UPDATE des stocks, un INSERT
+    multi-lignes des emprunts. Les retours passent en premier : un
+    exemplaire rendu peut être réemprunté dans le même lot. Si
+    returns_owner_id est fourni, seuls les emprunts de cet utilisateur
+    peuvent être retournés.
+    """
+    books = BookModel.__table__
+    loans = LoanModel.__table__
+
+    # Retours : un seul UPDATE conditionnel
+    returned = {}
+    if return_ids:
+        statement = (
+            update(loans)
+            .where(loans.c.id.in_(set(return_ids)), loans.c.is_returned == false())
+            .values(is_returned=True, return_date=datetime.utcnow())
+            .returning(*loans.c)
+        )
+        if returns_owner_id is not None:
+            statement = statement.where(loans.c.user_id == returns_owner_id)
+        returned = {row.id: row for row in db.execute(statement)}
+
+    # Livres touchés par le lot, verrouillés dans un ordre stable
+    requested = Counter(checkout_isbns)
+    returned_copies = Counter(row.book_id for row in returned.values())
+    stock = {}
+    if requested or returned_copies:
+        locked = db.execute(
+            select(books.c.id, books.c.isbn, books.c.quantity)
+            .where(
+                books.c.isbn.in_(list(requested))
+                | books.c.id.in_(list(returned_copies))
+            )
+            .order_by(books.c.id)
+            .with_for_update()
+        )
+        stock = {row.isbn: row for row in locked}
+
+    granted = Counter()
+    for isbn, copies in requested.items():
+        if isbn in stock:
+            book = stock[isbn]
+            available = book.quantity + returned_copies[book.id]
+            granted[book.id] = min(copies, max(available, 0))
+
+    deltas = {
+        book_id: returned_copies[book_id] - granted[book_id]
+        for book_id in set(returned_copies) | set(granted)
+    }
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if deltas:
+        db.execute(
+            update(books)
+            .where(books.c.id.in_(list(deltas)))
+            .values(
+                quantity=books.c.quantity + case(deltas, value=books.c.id),
+                updated_at=func.now(),
+            )
+        )
+
+    # Emprunts : un INSERT multi-lignes, lignes renvoyées dans l'ordre des paramètres
+    created = []
+    new_loans = [
+        {
+            "book_id": book_id,
+            "user_id": borrower_id,
+            "due_date": due_date,
+            "is_returned": False,
+        }
+        for book_id, copies in sorted(granted.items())
+        for _ in range(copies)
+    ]
+    if new_loans:
+        created = db.execute(
+            insert(loans).returning(*loans.c, sort_by_parameter_order=True), new_loans
+        ).all()
+
+    returned_count = len(returned)
+    if returned or created:
+        record_stock_change(db, stock_delta=returned_count - len(created))
+    db.commit()
+
+    # Résultats dans l'ordre de la demande
+    return_items = []
+    for loan_id in return_ids:
+        loan = returned.pop(loan_id, None)
+        if loan is None:
+            return_items.append({"loan_id": loan_id, "status": "not_found"})
+        else:
+            return_items.append(
+                {"loan_id": loan_id, "status": "returned", "loan": loan}
+            )
+
+    loans_by_book = {}
+    for loan in created:
+        loans_by_book.setdefault(loan.book_id, []).append(loan)
+    checkout_items = []
+    for isbn in checkout_isbns:
+        if isbn not in stock:
+            checkout_items.append({"isbn": isbn, "status": "not_found"})
+        elif loans_by_book.get(stock[isbn].id):
+            loan = loans_by_book[stock[isbn].id].pop(0)
+            checkout_items.append(
+                {"isbn": isbn, "loan_id": loan.id, "status": "created", "loan": loan}
+            )
+        else:
+            checkout_items.append({"isbn": isbn, "status": "unavailable"})
+
+    logger.info(
+        f"Lot de circulation : {len(created)} emprunts, {returned_count} retours"
+    )
+    return {"checkouts": checkout_items, "returns": return_items}
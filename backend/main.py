@@ -1,30 +1,77 @@
-﻿from fastapi import FastAPI, Depends, HTTPException, status, Query
+﻿from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field, validator
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
-from database import get_db
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import or_, func, cast, literal_column, Float
+from database import get_db, get_engine, get_read_db, replica_router, ReadYourWritesMiddleware, SessionLocal
 from logging_config import logger
+import csv
+import io
+import json
 import re
-from typing import Optional, List
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, List, Literal, Tuple
 from datetime import datetime, timedelta
 
 # Importer les modèles et fonctions d'authentification
-from models import Book, UserCreate, UserResponse, Token, LoanModel, LoanCreate, LoanResponse, LoanReturnRequest
+from models import Book, BookPage, BookSuggestion, UserAccessUpdate, UserCreate, UserResponse, Token, LoanArchiveModel, LoanModel, LoanCreate, LoanResponse, LoanReturnRequest, LoanBatchRequest, LoanBatchResponse, LoanPage, OverdueSummary
 from auth import (
-    authenticate_user, 
+    authenticate_user_async, 
     create_access_token, 
     get_current_user, 
-    create_user, 
+    get_user_by_username,
+    create_user_async, 
+    update_user_access,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from models import UserModel, BookModel, Base
-from database import engine
+from models import UserModel, BookModel, BOOK_SEARCH_CONFIG, BOOK_SORT_COLUMNS
+from migrations import DB_MIGRATE_ON_STARTUP, upgrade, wait_for_database
+from async_database import ASYNC_DB_ENABLED
+from async_routes import use_async_routes
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, keyset_paginate, keyset_seek
+from suggest import (
+    DEFAULT_SUGGESTIONS,
+    MAX_SUGGESTIONS,
+    build_suggestion_index,
+    suggestion_index,
+    suggestion_index_refresher,
+)
+from bulk import ingest_books, iter_bulk_rows, read_bulk_upload
+from loans import checkout_book, process_loan_batch, return_loan
+from overdue import get_overdue_summary, open_overdue_filter, overdue_sweeper
+from partitions import ensure_loan_partitions, loan_maintenance
+from memory import TRACEMALLOC_FRAMES, memory_snapshots
+from profiling import (
+    PROFILING_ENABLED,
+    STACK_SAMPLER_BUCKET_SECONDS,
+    STACK_SAMPLER_RETENTION,
+    ProfilingMiddleware,
+    continuous_profiler,
+    profile_store,
+    stack_sampler,
+)
+from http_cache import make_etag, is_not_modified, not_modified_response, set_cache_headers
+from stats import (
+    ensure_library_stats,
+    get_catalog_version,
+    get_library_stats,
+    rebuild_library_stats,
+    record_book_created,
+    record_book_deleted,
+    record_book_updated
+)
 
 # Importer le monitoring
 from monitoring import (
     metrics, 
+    MetricsMiddleware,
     get_metrics_endpoint,
+    install_gc_callbacks,
+    mark_worker_dead,
+    uninstall_gc_callbacks,
+    system_metrics_sampler,
     increment_user_registrations,
     increment_book_created,
     increment_book_updated,
@@ -33,26 +80,131 @@ from monitoring import (
     increment_loan_returned
 )
 
-# Recreate tables (for development, remove in production)
-Base.metadata.create_all(bind=engine)
+def initialize_database():
+    """Créer le moteur et appliquer les migrations"""
+    started = time.perf_counter()
+    engine = get_engine()
+    wait_for_database(engine)
+    if DB_MIGRATE_ON_STARTUP:
+        upgrade(engine)
+    logger.info(f"Base de données prête en {time.perf_counter() - started:.3f}s")
+
+def load_suggestion_index():
+    """Construire l'index d'autocomplétion au démarrage, puis le resynchroniser périodiquement"""
+    db = SessionLocal()
+    try:
+        build_suggestion_index(db)
+    finally:
+        db.close()
+    suggestion_index_refresher.start()
+
+def initialize_library_stats():
+    """Calculer les statistiques agrégées si elles n'existent pas encore"""
+    db = SessionLocal()
+    try:
+        ensure_library_stats(db)
+    finally:
+        db.close()
+
+def start_system_metrics_sampler():
+    """Premier échantillon des métriques système, puis échantillonnage périodique"""
+    install_gc_callbacks()
+    metrics.update_system_metrics()
+    system_metrics_sampler.start()
+
+def stop_system_metrics_sampler():
+    """Arrêter l'échantillonnage des métriques système et retirer les jauges du worker"""
+    system_metrics_sampler.stop()
+    uninstall_gc_callbacks()
+    mark_worker_dead()
+
+def start_loan_maintenance():
+    """Créer les partitions des emprunts et lancer l'archivage périodique"""
+    db = SessionLocal()
+    try:
+        ensure_loan_partitions(db)
+    finally:
+        db.close()
+    loan_maintenance.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Démarrage et arrêt de l'application
+
+    Au démarrage : base de données (moteur, migrations), index
+    d'autocomplétion, statistiques, puis tâches périodiques. À l'arrêt, les
+    tâches sont arrêtées dans l'ordre inverse de leur démarrage.
+    """
+    initialize_database()
+    load_suggestion_index()
+    initialize_library_stats()
+    start_system_metrics_sampler()
+    continuous_profiler.start()
+    overdue_sweeper.start()
+    start_loan_maintenance()
+    try:
+        yield
+    finally:
+        loan_maintenance.stop()
+        overdue_sweeper.stop()
+        continuous_profiler.stop()
+        stop_system_metrics_sampler()
+        suggestion_index_refresher.stop()
 
 app = FastAPI(
     title="Library Management System",
     description="Une API de gestion de bibliothèque avec authentification",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan
 )
 
 # Ajouter le middleware de monitoring
-app.middleware("http")(metrics.middleware)
+app.add_middleware(MetricsMiddleware)
+
+# Lire ses propres écritures : après une écriture, le client lit sur le primaire
+# (seulement avec des réplicas)
+if replica_router.replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Profilage des requêtes à la demande d'un administrateur ou par échantillonnage
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Exposer les métriques Prometheus
+app.get("/metrics", include_in_schema=False)(get_metrics_endpoint)
 
 @app.post("/users/", response_model=UserResponse, tags=["Users"])
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     """Enregistrer un nouvel utilisateur"""
     logger.info(f"Tentative d'enregistrement d'un nouvel utilisateur : {user.username}")
-    return create_user(db, user)
+    return await create_user_async(db, user)
+
+@app.patch("/users/{username}", response_model=UserResponse, tags=["Users"])
+def update_user(
+    username: str,
+    access: UserAccessUpdate,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Activer / désactiver un compte ou modifier ses droits d'administrateur
+
+    Les tokens déjà émis pour ce compte sont révoqués. Nécessite des droits
+    d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative de modification des droits par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    user = get_user_by_username(db, username)
+    if user is None:
+        raise HTTPException(status_code=404, detail="Utilisateur introuvable")
+    
+    return update_user_access(db, user, is_active=access.is_active, is_admin=access.is_admin)
 
 @app.post("/token", response_model=Token, tags=["Authentication"])
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: Session = Depends(get_db)
 ):
@@ -60,7 +212,7 @@ def login_for_access_token(
     logger.info(f"Tentative de connexion : {form_data.username}")
     
     # Authentifier l'utilisateur
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     
     if not user:
         logger.warning(f"Échec de connexion pour {form_data.username}")
@@ -73,7 +225,8 @@ def login_for_access_token(
     # Créer le token d'accès
     access_token = create_access_token(
         data={"sub": user.username}, 
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        user=user
     )
     
     logger.info(f"Connexion réussie pour {form_data.username}")
@@ -112,36 +265,303 @@ def create_book(
         quantity=book.quantity
     )
     db.add(db_book)
+    record_book_created(db, book.author, book.quantity)
     db.commit()
     db.refresh(db_book)
+    suggestion_index.add(db_book)
     
     logger.info(f"Book created successfully: {book.title}")
     return book
 
-@app.get('/books')
+@app.post('/books/bulk')
+def bulk_create_books(
+    # Authentification résolue avant la lecture du corps (dépendances dans l'ordre)
+    current_user: UserModel = Depends(get_current_user),
+    upload: Tuple[str, bytes] = Depends(read_bulk_upload),
+    report: Literal["full", "errors"] = Query("full", description="Inclure les lignes créées (full) ou seulement les erreurs"),
+    db: Session = Depends(get_db)
+):
+    """
+    Importer des livres en masse (nécessite authentification)
+
+    Accepte un tableau JSON, du NDJSON ou du CSV (colonnes title, author,
+    isbn, quantity), dans le corps ou en fichier multipart. Retourne le
+    statut de chaque ligne (created, duplicate, invalid) et le débit obtenu.
+    """
+    bulk_format, data = upload
+    logger.info(f"Bulk import of books requested by {current_user.username} ({bulk_format}, {len(data)} bytes)")
+
+    return ingest_books(
+        db,
+        iter_bulk_rows(bulk_format, data),
+        include_created=(report == "full")
+    )
+
+@app.get('/books', response_model=BookPage)
 def list_books(
-    db: Session = Depends(get_db), 
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Nombre de livres par page"),
+    cursor: Optional[str] = Query(None, description="Curseur opaque renvoyé par la page précédente"),
+    sort: Literal["id", "title", "author"] = Query("id", description="Champ de tri"),
+    db: Session = Depends(get_read_db), 
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Lister tous les livres (nécessite authentification)"""
-    logger.info("Retrieving list of books")
-    books = db.query(BookModel).all()
-    logger.info(f"Retrieved {len(books)} books")
-    return books
+    """
+    Lister les livres page par page (nécessite authentification)
+
+    La pagination se fait par curseur (keyset) : le coût d'une page reste
+    constant quelle que soit la taille du catalogue. Les requêtes
+    conditionnelles (If-None-Match) reçoivent un 304
+    tant que la version du catalogue n'a pas changé.
+    """
+    logger.info(f"Retrieving list of books (sort={sort}, limit={limit})")
+
+    catalog_version, last_modified = get_catalog_version(db)
+    etag = make_etag("books", catalog_version)
+    if is_not_modified(request, etag):
+        logger.info("Book list not modified")
+        return not_modified_response(etag, last_modified)
+
+    # Ne charger que les colonnes exposées, sans hydrater d'objets ORM
+    query = db.query(
+        BookModel.id,
+        BookModel.title,
+        BookModel.author,
+        BookModel.isbn,
+        BookModel.quantity
+    )
+    rows, next_cursor = keyset_paginate(
+        query, sort, BOOK_SORT_COLUMNS[sort], BookModel.id, cursor, limit
+    )
+
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
+
+    set_cache_headers(response, etag, last_modified)
+    logger.info(f"Retrieved {len(rows)} books")
+    return {
+        "items": [dict(row._mapping) for row in rows],
+        "limit": limit,
+        "sort": sort,
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+# Colonnes exportées et taille des lots lus depuis le curseur serveur
+EXPORT_COLUMNS = ("id", "title", "author", "isbn", "quantity")
+EXPORT_BATCH_SIZE = 1000
+
+def _stream_books_export(db: Session, export_format: str):
+    """Générer l'export du catalogue lot par lot depuis un curseur serveur"""
+    try:
+        query = db.query(
+            *(getattr(BookModel, column) for column in EXPORT_COLUMNS)
+        ).order_by(BookModel.id).yield_per(EXPORT_BATCH_SIZE)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+
+        exported = 0
+        for row in query:
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(row._mapping), ensure_ascii=False))
+                buffer.write("\n")
+            exported += 1
+
+            # Envoyer un morceau par lot pour garder une mémoire constante
+            if exported % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+        logger.info(f"Exported {exported} books as {export_format}")
+    finally:
+        db.close()
+
+@app.get('/books/export')
+def export_books(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format", description="Format d'export"),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Exporter tout le catalogue en flux NDJSON ou CSV (nécessite authentification)
+
+    Les lignes sont lues par lots depuis un curseur côté serveur et envoyées
+    au fil de l'eau : la mémoire reste constante quelle que soit la taille
+    du catalogue.
+    """
+    logger.info(f"Exporting books catalogue as {export_format}")
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    extension = "csv" if export_format == "csv" else "ndjson"
+    return StreamingResponse(
+        _stream_books_export(db, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="books.{extension}"'}
+    )
+
+@app.get('/books/search', response_model=BookPage)
+def search_books(
+    request: Request,
+    query: Optional[str] = Query(None, description="Terme de recherche (titre, auteur ou ISBN)"),
+    min_quantity: Optional[int] = Query(None, ge=0, description="Quantité minimale de livres"),
+    max_quantity: Optional[int] = Query(None, ge=0, description="Quantité maximale de livres"),
+    mode: Literal["fulltext", "substring"] = Query("substring", description="Mode de recherche"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Nombre de résultats par page"),
+    cursor: Optional[str] = Query(None, description="Curseur opaque renvoyé par la page précédente"),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Rechercher des livres avec des filtres optionnels
+    
+    Paramètres :
+    - query : Terme de recherche (recherche sur titre, auteur, ISBN)
+    - min_quantity : Quantité minimale de livres en stock
+    - max_quantity : Quantité maximale de livres en stock
+    - mode : "fulltext" (tsvector, résultats classés par pertinence) ou
+      "substring" (correspondance partielle, accélérée par les index trigrammes)
+    - limit / cursor : pagination par curseur
+    """
+    logger.info(f"Recherche de livres - Terme: {query}, Mode: {mode}, Quantité min: {min_quantity}, Quantité max: {max_quantity}")
+    
+    # Requête de base
+    columns = [BookModel.id, BookModel.title, BookModel.author, BookModel.isbn, BookModel.quantity]
+    sort_key, sort_column, descending = "id", BookModel.id, False
+
+    # La recherche plein texte n'existe que sur PostgreSQL : repli sur la sous-chaîne ailleurs
+    fulltext = bool(query) and mode == "fulltext" and db.get_bind().dialect.name == "postgresql"
+
+    if fulltext:
+        ts_query = func.websearch_to_tsquery(BOOK_SEARCH_CONFIG, query)
+        search_vector = literal_column("books.search_vector")
+        rank = cast(func.ts_rank(search_vector, ts_query), Float).label("rank")
+        search_query = db.query(*columns, rank).filter(search_vector.op("@@")(ts_query))
+        sort_key, sort_column, descending = "rank", rank, True
+    else:
+        search_query = db.query(*columns)
+        # Filtrage par terme de recherche
+        if query:
+            search_query = search_query.filter(
+                or_(
+                    BookModel.title.ilike(f"%{query}%"),
+                    BookModel.author.ilike(f"%{query}%"),
+                    BookModel.isbn.ilike(f"%{query}%")
+                )
+            )
+    
+    # Filtrage par quantité
+    if min_quantity is not None:
+        search_query = search_query.filter(BookModel.quantity >= min_quantity)
+    
+    if max_quantity is not None:
+        search_query = search_query.filter(BookModel.quantity <= max_quantity)
+    
+    # Exécuter la requête
+    rows, next_cursor = keyset_paginate(
+        search_query, sort_key, sort_column, BookModel.id, cursor, limit, descending=descending
+    )
+
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
+    
+    logger.info(f"Recherche terminée - {len(rows)} résultats trouvés")
+    
+    return {
+        "items": [dict(row._mapping) for row in rows],
+        "limit": limit,
+        "sort": sort_key,
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+@app.get('/books/stats')
+def get_book_statistics(
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Obtenir des statistiques sur la collection de livres
+    
+    Retourne :
+    - Nombre total de livres
+    - Nombre de livres par auteur
+    - Nombre de livres en stock
+    """
+    logger.info("Récupération des statistiques de la bibliothèque")
+    
+    # Lecture des compteurs maintenus à chaque écriture (pas d'agrégat sur les livres)
+    stats = get_library_stats(db)
+    
+    logger.info("Statistiques récupérées avec succès")
+    return stats
+
+@app.post('/books/stats/rebuild')
+def rebuild_book_statistics(
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Recalculer les statistiques à partir des livres
+
+    Nécessite des droits d'administrateur
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative de recalcul des statistiques par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    logger.info(f"Recalcul des statistiques demandé par {current_user.username}")
+    return rebuild_library_stats(db)
+
+@app.get('/books/suggest', response_model=List[BookSuggestion])
+def suggest_books(
+    prefix: str = Query(..., min_length=1, max_length=100, description="Début du titre ou du nom d'auteur"),
+    limit: int = Query(DEFAULT_SUGGESTIONS, ge=1, le=MAX_SUGGESTIONS, description="Nombre maximum de suggestions"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Suggérer des titres et des auteurs à partir d'un préfixe (nécessite authentification)
+
+    Servi depuis l'index d'autocomplétion en mémoire, sans requête sur les livres.
+    """
+    return suggestion_index.suggest(prefix, limit)
 
 @app.get('/books/{isbn}')
 def get_book(
     isbn: str, 
-    db: Session = Depends(get_db), 
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db), 
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Obtenir un livre par son ISBN (nécessite authentification)"""
+    """
+    Obtenir un livre par son ISBN (nécessite authentification)
+
+    Répond 304 aux requêtes conditionnelles si le livre n'a pas changé.
+    """
     logger.info(f"Attempting to retrieve book with ISBN: {isbn}")
     book = db.query(BookModel).filter(BookModel.isbn == isbn).first()
     if not book:
         logger.warning(f"Book not found with ISBN: {isbn}")
         raise HTTPException(status_code=404, detail="Book not found")
     
+    etag = make_etag("book", book.id, book.updated_at, book.title, book.author, book.quantity)
+    if is_not_modified(request, etag):
+        logger.info(f"Book not modified: {isbn}")
+        return not_modified_response(etag, book.updated_at)
+    
+    set_cache_headers(response, etag, book.updated_at)
     logger.info(f"Book retrieved successfully: {book.title}")
     return book
 
@@ -166,12 +586,14 @@ def update_book(
         raise HTTPException(status_code=404, detail="Book not found")
     
     # Update book details
+    record_book_updated(db, db_book.author, db_book.quantity, book.author, book.quantity)
     db_book.title = book.title
     db_book.author = book.author
     db_book.quantity = book.quantity
     
     db.commit()
     db.refresh(db_book)
+    suggestion_index.add(db_book)
     
     logger.info(f"Book updated successfully: {book.title}")
     return book
@@ -190,96 +612,15 @@ def delete_book(
         logger.warning(f"Book not found for deletion with ISBN: {isbn}")
         raise HTTPException(status_code=404, detail="Book not found")
     
+    book_id = db_book.id
+    record_book_deleted(db, db_book.author, db_book.quantity)
     db.delete(db_book)
     db.commit()
+    suggestion_index.remove(book_id)
     
     logger.info(f"Book deleted successfully: {isbn}")
     return {"message": "Book deleted successfully"}
 
-@app.get('/books/search', response_model=List[Book])
-def search_books(
-    query: Optional[str] = Query(None, description="Terme de recherche (titre, auteur ou ISBN)"),
-    min_quantity: Optional[int] = Query(None, ge=0, description="Quantité minimale de livres"),
-    max_quantity: Optional[int] = Query(None, ge=0, description="Quantité maximale de livres"),
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)
-):
-    """
-    Rechercher des livres avec des filtres optionnels
-    
-    Paramètres :
-    - query : Terme de recherche (recherche sur titre, auteur, ISBN)
-    - min_quantity : Quantité minimale de livres en stock
-    - max_quantity : Quantité maximale de livres en stock
-    """
-    logger.info(f"Recherche de livres - Terme: {query}, Quantité min: {min_quantity}, Quantité max: {max_quantity}")
-    
-    # Requête de base
-    search_query = db.query(BookModel)
-    
-    # Filtrage par terme de recherche
-    if query:
-        search_query = search_query.filter(
-            or_(
-                BookModel.title.ilike(f"%{query}%"),
-                BookModel.author.ilike(f"%{query}%"),
-                BookModel.isbn.ilike(f"%{query}%")
-            )
-        )
-    
-    # Filtrage par quantité
-    if min_quantity is not None:
-        search_query = search_query.filter(BookModel.quantity >= min_quantity)
-    
-    if max_quantity is not None:
-        search_query = search_query.filter(BookModel.quantity <= max_quantity)
-    
-    # Exécuter la requête
-    results = search_query.all()
-    
-    logger.info(f"Recherche terminée - {len(results)} résultats trouvés")
-    
-    return results
-
-@app.get('/books/stats')
-def get_book_statistics(
-    db: Session = Depends(get_db),
-    current_user: UserModel = Depends(get_current_user)
-):
-    """
-    Obtenir des statistiques sur la collection de livres
-    
-    Retourne :
-    - Nombre total de livres
-    - Nombre de livres par auteur
-    - Nombre de livres en stock
-    """
-    logger.info("Récupération des statistiques de la bibliothèque")
-    
-    # Nombre total de livres
-    total_books = db.query(BookModel).count()
-    
-    # Nombre de livres par auteur
-    books_by_author = db.query(
-        BookModel.author, 
-        func.count(BookModel.id).label('book_count')
-    ).group_by(BookModel.author).all()
-    
-    # Total des livres en stock
-    total_books_in_stock = db.query(func.sum(BookModel.quantity)).scalar() or 0
-    
-    stats = {
-        "total_books": total_books,
-        "books_by_author": [
-            {"author": author, "count": count} 
-            for author, count in books_by_author
-        ],
-        "total_books_in_stock": total_books_in_stock
-    }
-    
-    logger.info("Statistiques récupérées avec succès")
-    return stats
-
 @app.post('/loans', response_model=LoanResponse)
 def create_loan(
     loan: LoanCreate, 
@@ -292,40 +633,19 @@ def create_loan(
     - Vérifie la disponibilité du livre
     - Crée un nouvel emprunt
     - Réduit la quantité de livres disponibles
+    
+    Les trois étapes sont une seule requête conditionnelle : des emprunts
+    concurrents du même livre ne peuvent pas dépasser le stock.
     """
     logger.info(f"Tentative d'emprunt de livre par {current_user.username}")
     
-    # Trouver le livre par ISBN
-    book = db.query(BookModel).filter(BookModel.isbn == loan.book_isbn).first()
-    if not book:
-        logger.warning(f"Livre non trouvé avec l'ISBN : {loan.book_isbn}")
-        raise HTTPException(status_code=404, detail="Livre non trouvé")
-    
-    # Vérifier la disponibilité du livre
-    if book.quantity < 1:
-        logger.warning(f"Livre indisponible : {book.title}")
-        raise HTTPException(status_code=400, detail="Aucun exemplaire de ce livre n'est disponible")
-    
     # Calculer la date de retour
     loan_duration = timedelta(days=loan.loan_duration_days)
     due_date = datetime.utcnow() + loan_duration
     
-    # Créer l'emprunt
-    new_loan = LoanModel(
-        book_id=book.id,
-        user_id=current_user.id,
-        due_date=due_date
-    )
-    
-    # Réduire la quantité de livres
-    book.quantity -= 1
-    
-    # Ajouter et committer
-    db.add(new_loan)
-    db.commit()
-    db.refresh(new_loan)
+    new_loan = checkout_book(db, loan.book_isbn, current_user.id, due_date)
     
-    logger.info(f"Emprunt créé pour {current_user.username} - Livre : {book.title}")
+    logger.info(f"Emprunt créé pour {current_user.username} - Livre : {loan.book_isbn}")
     return new_loan
 
 @app.post('/loans/return', response_model=LoanResponse)
@@ -343,50 +663,72 @@ def return_book(
     """
     logger.info(f"Tentative de retour de livre par {current_user.username}")
     
-    # Trouver l'emprunt
-    loan = db.query(LoanModel).filter(
-        LoanModel.id == return_request.loan_id,
-        LoanModel.user_id == current_user.id,
-        LoanModel.is_returned == False
-    ).first()
-    
-    if not loan:
-        logger.warning(f"Emprunt non trouvé ou déjà retourné : {return_request.loan_id}")
-        raise HTTPException(status_code=404, detail="Emprunt non trouvé ou déjà retourné")
-    
-    # Marquer comme retourné
-    loan.is_returned = True
-    loan.return_date = datetime.utcnow()
-    
-    # Récupérer le livre
-    book = db.query(BookModel).filter(BookModel.id == loan.book_id).first()
-    
-    # Augmenter la quantité de livres
-    book.quantity += 1
+    loan = return_loan(db, return_request.loan_id, current_user.id)
     
     # Vérifier les retards
     if loan.due_date < datetime.utcnow():
         logger.warning(f"Retard de retour pour l'emprunt : {loan.id}")
         # Vous pouvez ajouter une logique de pénalité ici si nécessaire
     
-    # Committer les modifications
-    db.commit()
-    db.refresh(loan)
-    
     logger.info(f"Livre retourné par {current_user.username}")
     return loan
 
-@app.get('/loans/user', response_model=List[LoanResponse])
+@app.post('/loans/batch', response_model=LoanBatchResponse)
+def process_loans_batch(
+    batch: LoanBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Traiter en une fois les emprunts et retours scannés à une banque de prêt
+
+    - Les retours sont traités avant les emprunts
+    - Chaque ISBN de la liste des emprunts correspond à un exemplaire
+    - Renvoie le résultat de chaque élément dans l'ordre de la demande
+    
+    Un administrateur peut emprunter pour un autre utilisateur (user_id) et
+    retourner n'importe quel emprunt.
+    """
+    logger.info(
+        f"Lot de circulation par {current_user.username} : "
+        f"{len(batch.checkouts)} emprunts, {len(batch.returns)} retours"
+    )
+    
+    borrower_id = current_user.id
+    if batch.user_id is not None and batch.user_id != current_user.id:
+        if not current_user.is_admin:
+            logger.warning(f"Tentative d'emprunt pour un autre utilisateur par un non-admin : {current_user.username}")
+            raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+        if db.query(UserModel.id).filter(UserModel.id == batch.user_id).first() is None:
+            raise HTTPException(status_code=404, detail="Utilisateur introuvable")
+        borrower_id = batch.user_id
+    
+    due_date = datetime.utcnow() + timedelta(days=batch.loan_duration_days)
+    return process_loan_batch(
+        db,
+        borrower_id,
+        batch.checkouts,
+        batch.returns,
+        due_date,
+        returns_owner_id=None if current_user.is_admin else current_user.id
+    )
+
+@app.get('/loans/user', response_model=LoanPage)
 def get_user_loans(
+    request: Request,
     show_returned: bool = False,
+    expand: Optional[Literal["book"]] = Query(None, description="Inclure le livre de chaque emprunt"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Nombre d'emprunts par page"),
+    cursor: Optional[str] = Query(None, description="Curseur opaque renvoyé par la page précédente"),
     db: Session = Depends(get_db), 
     current_user: UserModel = Depends(get_current_user)
 ):
     """
-    Récupérer les emprunts de l'utilisateur courant
+    Récupérer les emprunts de l'utilisateur courant, du plus récent au plus ancien
     
     Paramètres :
-    - show_returned : Inclure les livres déjà retournés
+    - show_returned : Inclure les livres déjà retournés (historique complet, archive comprise)
+    - expand=book : Inclure le livre de chaque emprunt, chargé dans la même requête
     """
     logger.info(f"Récupération des emprunts pour {current_user.username}")
     
@@ -397,21 +739,50 @@ def get_user_loans(
     if not show_returned:
         query = query.filter(LoanModel.is_returned == False)
     
+    # Livres chargés par jointure : une seule requête par page
+    if expand == "book":
+        query = query.options(joinedload(LoanModel.book))
+    
     # Récupérer les emprunts
-    loans = query.all()
+    rows = keyset_seek(query, "-id", LoanModel.id, LoanModel.id, cursor, limit, descending=True).all()
+    
+    # Historique complet : emprunts archivés inclus (ids uniques entre les deux tables)
+    if show_returned:
+        archived = db.query(LoanArchiveModel).filter(LoanArchiveModel.user_id == current_user.id)
+        if expand == "book":
+            archived = archived.options(joinedload(LoanArchiveModel.book))
+        rows += keyset_seek(
+            archived, "-id", LoanArchiveModel.id, LoanArchiveModel.id, cursor, limit, descending=True
+        ).all()
+        rows.sort(key=lambda loan: loan.id, reverse=True)
+    loans, next_cursor = keyset_page(rows, "-id", LoanModel.id, LoanModel.id, limit)
+    
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
     
     logger.info(f"Récupéré {len(loans)} emprunts")
-    return loans
+    return {
+        "items": loans,
+        "limit": limit,
+        "sort": "-id",
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
 
-@app.get('/loans/overdue', response_model=List[LoanResponse])
+@app.get('/loans/overdue', response_model=LoanPage)
 def get_overdue_loans(
-    db: Session = Depends(get_db), 
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Nombre d'emprunts par page"),
+    cursor: Optional[str] = Query(None, description="Curseur opaque renvoyé par la page précédente"),
+    db: Session = Depends(get_read_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """
-    Récupérer les emprunts en retard
+    Récupérer les emprunts en retard, du plus ancien au plus récent
     
-    Nécessite des droits d'administrateur
+    Nécessite des droits d'administrateur. Pagination par curseur sur
+    l'index partiel des emprunts en cours.
     """
     # Vérifier les droits d'administrateur
     if not current_user.is_admin:
@@ -421,10 +792,199 @@ def get_overdue_loans(
     logger.info("Récupération des emprunts en retard")
     
     # Récupérer les emprunts non retournés et en retard
-    overdue_loans = db.query(LoanModel).filter(
-        LoanModel.is_returned == False,
-        LoanModel.due_date < datetime.utcnow()
-    ).all()
+    query = db.query(LoanModel).filter(*open_overdue_filter(datetime.utcnow()))
+    overdue_loans, next_cursor = keyset_paginate(
+        query, "due_date", LoanModel.due_date, LoanModel.id, cursor, limit
+    )
+    
+    next_link = None
+    if next_cursor:
+        next_link = str(request.url.include_query_params(cursor=next_cursor))
     
     logger.info(f"Récupéré {len(overdue_loans)} emprunts en retard")
-    return overdue_loans
+    return {
+        "items": overdue_loans,
+        "limit": limit,
+        "sort": "due_date",
+        "next_cursor": next_cursor,
+        "next": next_link,
+    }
+
+@app.get('/loans/overdue/summary', response_model=OverdueSummary)
+def get_overdue_loans_summary(
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Nombre d'emprunts en retard et d'emprunteurs concernés
+
+    Lu depuis les compteurs matérialisés par le balayage périodique.
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès aux emprunts en retard par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return get_overdue_summary(db)
+
+@app.get("/admin/profiles", tags=["Admin"])
+def list_request_profiles(current_user: UserModel = Depends(get_current_user)):
+    """
+    Profils de requêtes enregistrés, du plus récent au plus ancien
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès aux profils par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return profile_store.list()
+
+@app.get("/admin/profiles/continuous", response_class=PlainTextResponse, tags=["Admin"])
+def export_continuous_profile(
+    window: int = Query(300, ge=1, le=STACK_SAMPLER_BUCKET_SECONDS * STACK_SAMPLER_RETENTION, description="Période exportée (secondes)"),
+    endpoint: Optional[str] = Query(None, description="Route, par exemple \"GET /books/{isbn}\" (toutes par défaut)"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Piles échantillonnées en continu sur la période, au format des piles repliées
+
+    Sans route, chaque pile a pour racine la route servie. Les piles sont
+    celles du worker qui répond. Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès aux profils par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    stacks = stack_sampler.export(window, endpoint=endpoint)
+    return PlainTextResponse(
+        "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items())),
+        headers={"Content-Disposition": f'attachment; filename="continuous-{window}s.folded"'}
+    )
+
+@app.get("/admin/profiles/continuous/endpoints", tags=["Admin"])
+def get_continuous_profile_endpoints(
+    window: int = Query(300, ge=1, le=STACK_SAMPLER_BUCKET_SECONDS * STACK_SAMPLER_RETENTION, description="Période (secondes)"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Échantillons par route sur la période, de la plus coûteuse à la moins coûteuse
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès aux profils par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return stack_sampler.endpoints(window)
+
+@app.get("/admin/profiles/{profile_id}", tags=["Admin"])
+def download_request_profile(profile_id: str, current_user: UserModel = Depends(get_current_user)):
+    """
+    Télécharger un profil au format des piles repliées (flamegraph.pl, speedscope)
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès aux profils par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return FileResponse(
+        profile_store.folded_path(profile_id),
+        media_type="text/plain",
+        filename=f"profile-{profile_id}.folded"
+    )
+
+@app.get("/admin/memory", tags=["Admin"])
+def get_memory_tracing_status(
+    pid: Optional[int] = Query(None, description="Worker attendu (pid des réponses précédentes) : 409 si un autre worker répond"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    État du traçage des allocations et instantanés conservés
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès au diagnostic mémoire par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    memory_snapshots.check_worker(pid)
+    return memory_snapshots.status()
+
+@app.post("/admin/memory/tracemalloc/start", tags=["Admin"])
+def start_memory_tracing(
+    frames: int = Query(TRACEMALLOC_FRAMES, ge=1, le=100, description="Frames conservées par allocation"),
+    pid: Optional[int] = Query(None, description="Worker attendu (pid des réponses précédentes) : 409 si un autre worker répond"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Démarrer le traçage des allocations (ralentit chaque allocation)
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès au diagnostic mémoire par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    memory_snapshots.check_worker(pid)
+    return memory_snapshots.start(frames)
+
+@app.post("/admin/memory/tracemalloc/stop", tags=["Admin"])
+def stop_memory_tracing(
+    pid: Optional[int] = Query(None, description="Worker attendu (pid des réponses précédentes) : 409 si un autre worker répond"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Arrêter le traçage des allocations ; les instantanés restent consultables
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès au diagnostic mémoire par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    memory_snapshots.check_worker(pid)
+    return memory_snapshots.stop()
+
+@app.post("/admin/memory/snapshots", tags=["Admin"])
+def take_memory_snapshot(
+    pid: Optional[int] = Query(None, description="Worker attendu (pid des réponses précédentes) : 409 si un autre worker répond"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Prendre un instantané des allocations tracées
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès au diagnostic mémoire par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    memory_snapshots.check_worker(pid)
+    return memory_snapshots.take()
+
+@app.get("/admin/memory/snapshots/{snapshot_id}/top", tags=["Admin"])
+def get_memory_snapshot_top(
+    snapshot_id: int,
+    compare_to: Optional[int] = Query(None, description="Instantané antérieur : trier par croissance depuis celui-ci"),
+    key_type: Literal["lineno", "filename", "traceback"] = Query("lineno", description="Regroupement des allocations"),
+    limit: int = Query(20, ge=1, le=500, description="Nombre de sites d'allocation"),
+    pid: Optional[int] = Query(None, description="Worker attendu (pid des réponses précédentes) : 409 si un autre worker répond"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Principaux sites d'allocation d'un instantané, ou leur croissance depuis compare_to
+
+    Nécessite des droits d'administrateur.
+    """
+    if not current_user.is_admin:
+        logger.warning(f"Tentative d'accès au diagnostic mémoire par un non-admin : {current_user.username}")
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    memory_snapshots.check_worker(pid)
+    return memory_snapshots.top(snapshot_id, compare_to=compare_to, key_type=key_type, limit=limit)
+
+# Chemin base de données asynchrone (AsyncSession), activé par DB_ASYNC=true
+if ASYNC_DB_ENABLED:
+    use_async_routes(app)
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from logging_config import logger
+
+# Frames conservées par allocation au démarrage du traçage (coût croissant)
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+# Instantanés gardés en mémoire (les plus anciens sont supprimés)
+TRACEMALLOC_MAX_SNAPSHOTS = int(os.getenv("TRACEMALLOC_MAX_SNAPSHOTS", "5"))
+
+# Allocations du traçage lui-même et des imports, sans intérêt pour une fuite
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _statistic(statistic, key_type: str) -> Dict[str, Any]:
+    """Site d'allocation (Statistic ou StatisticDiff) sous forme de dictionnaire"""
+    frame = statistic.traceback[0]
+    entry = {
+        "site": f"{frame.filename}:{frame.lineno}"
+        if key_type != "filename"
+        else frame.filename,
+        "size_bytes": statistic.size,
+        "count": statistic.count,
+    }
+    if isinstance(statistic, tracemalloc.StatisticDiff):
+        entry["size_diff_bytes"] = statistic.size_diff
+        entry["count_diff"] = statistic.count_diff
+    if key_type == "traceback":
+        entry["traceback"] = [
+            f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback
+        ]
+    return entry
+
+
+class MemorySnapshots:
+    """
+    Traçage des allocations (tracemalloc) piloté à chaud
+
+    Le traçage ralentit chaque allocation : il est démarré à la demande,
+    le temps de prendre deux instantanés à quelques minutes d'intervalle,
+    puis arrêté. Le traçage et les instantanés sont propres au worker qui
+    les a pris : chaque réponse porte son pid, et une requête qui précise
+    le pid attendu est refusée (409) si un autre worker la reçoit.
+    """
+
+    def __init__(self, max_snapshots: int = TRACEMALLOC_MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check_worker(pid: Optional[int]) -> None:
+        """Refuser la requête si elle vise un autre worker que celui qui répond"""
+        if pid is not None and pid != os.getpid():
+            raise HTTPException(
+                status_code=409,
+                detail=(
+                    f"Requête reçue par le worker {os.getpid()} au lieu du worker "
+                    f"{pid} : le diagnostic mémoire est propre à chaque worker"
+                ),
+            )
+
+    def _summary(self, snapshot_id: int) -> Dict[str, Any]:
+        entry = self._snapshots[snapshot_id]
+        return {
+            "id": snapshot_id,
+            "pid": os.getpid(),
+            "created_at": entry["created_at"],
+            "traced_bytes": entry["traced_bytes"],
+            "traceback_limit": entry["snapshot"].traceback_limit,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            snapshots = [self._summary(snapshot_id) for snapshot_id in self._snapshots]
+        return {
+            "pid": os.getpid(),
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": snapshots,
+        }
+
+    def start(self, frames: int = TRACEMALLOC_FRAMES) -> Dict[str, Any]:
+        if tracemalloc.is_tracing():
+            raise HTTPException(
+                status_code=409, detail="Traçage des allocations déjà démarré"
+            )
+        tracemalloc.start(frames)
+        logger.info(f"Traçage des allocations démarré ({frames} frames)")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """Arrêter le traçage (les instantanés déjà pris restent consultables)"""
+        if not tracemalloc.is_tracing():
+            raise HTTPException(
+                status_code=409, detail="Traçage des allocations non démarré"
+            )
+        tracemalloc.stop()
+        logger.info("Traçage des allocations arrêté")
+        return self.status()
+
+    def take(self) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            raise HTTPException(
+                status_code=409, detail="Traçage des allocations non démarré"
+            )
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        with self._lock:
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self._snapshots[snapshot_id] = {
+                "snapshot": snapshot,
+                "created_at": time.time(),
+                "traced_bytes": sum(trace.size for trace in snapshot.traces),
+            }
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+            return self._summary(snapshot_id)
+
+    def _get(self, snapshot_id: int):
+        with self._lock:
+            entry = self._snapshots.get(snapshot_id)
+        if entry is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Instantané non trouvé dans le worker {os.getpid()}",
+            )
+        return entry["snapshot"]
+
+    def top(
+        self,
+        snapshot_id: int,
+        compare_to: Optional[int] = None,
+        key_type: str = "lineno",
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """
+        Principaux sites d'allocation d'un instantané
+
+        Avec compare_to, les sites sont triés par croissance depuis cet
+        instantané antérieur : ceux d'une fuite arrivent en tête.
+        """
+        snapshot = self._get(snapshot_id)
+        if compare_to is None:
+            statistics = snapshot.statistics(key_type)
+            size_diff = None
+        else:
+            statistics = snapshot.compare_to(self._get(compare_to), key_type)
+            size_diff = sum(statistic.size_diff for statistic in statistics)
+        result: Dict[str, Any] = {
+            "pid": os.getpid(),
+            "snapshot": snapshot_id,
+            "compare_to": compare_to,
+            "key_type": key_type,
+            "sites": [
+                _statistic(statistic, key_type) for statistic in statistics[:limit]
+            ],
+        }
+        if size_diff is not None:
+            result["size_diff_bytes"] = size_diff
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+
+memory_snapshots = MemorySnapshots()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Migrations versionnées du schéma
+
+Chaque migration est appliquée une seule fois et enregistrée dans la table
+schema_migrations. Les migrations sont idempotentes : une base créée
+auparavant par Base.metadata.create_all est mise à niveau sans erreur.
+
+Usage (depuis backend/, sur la base de DATABASE_URL) :
+    python migrations.py
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import func
+
+from logging_config import logger
+from models import (
+    BOOK_SEARCH_DDL,
+    AuthorStatsModel,
+    BookModel,
+    LibraryStatsModel,
+    LoanArchiveModel,
+    LoanModel,
+    OverdueSummaryModel,
+    UserModel,
+)
+from partitions import LOAN_PARTITION_MONTHS_AHEAD, partition_ddl
+
+# Appliquer les migrations au démarrage de l'application
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Tentatives de connexion avant d'abandonner le démarrage (base lente à démarrer)
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+DB_CONNECT_RETRY_DELAY = float(os.getenv("DB_CONNECT_RETRY_DELAY", "2"))
+
+# Verrou consultatif PostgreSQL : un seul processus migre à la fois
+MIGRATION_LOCK_ID = 7_301_000
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", String, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+MIGRATIONS: List[Tuple[str, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: str, description: str):
+    """Enregistrer une migration (appliquées dans l'ordre de déclaration)"""
+
+    def register(function: Callable[[Connection], None]):
+        MIGRATIONS.append((version, description, function))
+        return function
+
+    return register
+
+
+def _column_names(connection: Connection, table: str) -> set:
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def _add_column(connection: Connection, column: Column) -> None:
+    """ALTER TABLE ... ADD COLUMN si la colonne n'existe pas encore"""
+    table = column.table.name
+    if column.name in _column_names(connection, table):
+        return
+    specification = connection.dialect.ddl_compiler(
+        connection.dialect, None
+    ).get_column_specification(column)
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {specification}"))
+
+
+def _create_indexes(connection: Connection, table: Table, *names: str) -> None:
+    for index in table.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+# Schéma initial, tel que créé avant la gestion par migrations
+_initial = MetaData()
+
+Table(
+    "users",
+    _initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True, nullable=False),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("is_active", Boolean),
+    Column("is_admin", Boolean),
+)
+
+Table(
+    "books",
+    _initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String, index=True),
+    Column("author", String),
+    Column("isbn", String, unique=True, index=True),
+    Column("quantity", Integer),
+)
+
+Table(
+    "loans",
+    _initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("book_id", Integer, ForeignKey("books.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("loan_date", DateTime(timezone=True), server_default=func.now()),
+    Column("due_date", DateTime(timezone=True), nullable=False),
+    Column("return_date", DateTime(timezone=True), nullable=True),
+    Column("is_returned", Boolean),
+)
+
+
+@migration("0001", "Schéma initial : utilisateurs, livres, emprunts")
+def create_initial_schema(connection: Connection) -> None:
+    _initial.create_all(connection, checkfirst=True)
+
+
+@migration("0002", "Index composites de la pagination keyset des livres")
+def create_book_sort_indexes(connection: Connection) -> None:
+    _create_indexes(
+        connection, BookModel.__table__, "ix_books_title_id", "ix_books_author_id"
+    )
+
+
+@migration("0003", "Recherche plein texte et index trigrammes des livres (PostgreSQL)")
+def create_book_search_indexes(connection: Connection) -> None:
+    if connection.dialect.name != "postgresql":
+        return
+    for statement in BOOK_SEARCH_DDL:
+        connection.execute(text(statement))
+
+
+@migration("0004", "Compteurs agrégés du catalogue")
+def create_library_stats(connection: Connection) -> None:
+    LibraryStatsModel.__table__.create(connection, checkfirst=True)
+    AuthorStatsModel.__table__.create(connection, checkfirst=True)
+
+
+@migration("0005", "Date de dernière modification des livres")
+def add_book_updated_at(connection: Connection) -> None:
+    if connection.dialect.name == "sqlite":
+        # SQLite refuse ADD COLUMN avec une valeur par défaut non constante
+        if "updated_at" not in _column_names(connection, "books"):
+            connection.execute(text("ALTER TABLE books ADD COLUMN updated_at DATETIME"))
+            connection.execute(text("UPDATE books SET updated_at = CURRENT_TIMESTAMP"))
+        return
+    _add_column(connection, BookModel.__table__.c.updated_at)
+
+
+@migration("0006", "Version des tokens des utilisateurs")
+def add_user_token_version(connection: Connection) -> None:
+    _add_column(connection, UserModel.__table__.c.token_version)
+
+
+@migration("0007", "Retards des emprunts et index des emprunts en cours")
+def create_overdue_loans(connection: Connection) -> None:
+    loans = LoanModel.__table__
+    _add_column(connection, loans.c.is_overdue)
+    _create_indexes(
+        connection, loans, "ix_loans_user_returned", "ix_loans_open_due_date"
+    )
+    OverdueSummaryModel.__table__.create(connection, checkfirst=True)
+
+
+def _partition_loans(connection: Connection) -> None:
+    """Recréer la table des emprunts partitionnée par mois et y recopier les lignes"""
+    partitioned = connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('loans')")
+    ).scalar()
+    if partitioned:
+        return
+
+    connection.execute(text("ALTER TABLE loans RENAME TO loans_unpartitioned"))
+    connection.execute(
+        text("ALTER INDEX IF EXISTS loans_pkey RENAME TO loans_unpartitioned_pkey")
+    )
+    connection.execute(
+        text(
+            "DROP INDEX IF EXISTS "
+            "ix_loans_id, ix_loans_user_returned, ix_loans_open_due_date"
+        )
+    )
+    connection.execute(
+        text("UPDATE loans_unpartitioned SET loan_date = now() WHERE loan_date IS NULL")
+    )
+
+    # Table partitionnée et index (sans partition par défaut)
+    LoanModel.__table__.create(connection)
+
+    # Une partition par mois présent dans l'historique, plus les mois à venir
+    months = (
+        connection.execute(
+            text(
+                "SELECT DISTINCT date_trunc('month', loan_date AT TIME ZONE 'UTC') "
+                "FROM loans_unpartitioned"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    today = datetime.utcnow()
+    for offset in range(LOAN_PARTITION_MONTHS_AHEAD + 1):
+        months.append(
+            datetime(
+                today.year + (today.month - 1 + offset) // 12,
+                (today.month - 1 + offset) % 12 + 1,
+                1,
+            )
+        )
+    for month in sorted(set(months)):
+        connection.execute(text(partition_ddl(month)))
+
+    columns = ", ".join(column.name for column in LoanModel.__table__.columns)
+    connection.execute(
+        text(f"INSERT INTO loans ({columns}) SELECT {columns} FROM loans_unpartitioned")
+    )
+    connection.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence('loans', 'id'), "
+            "coalesce(max(id), 0) + 1, false) FROM loans"
+        )
+    )
+    connection.execute(text("DROP TABLE loans_unpartitioned"))
+
+
+@migration("0008", "Partitionnement mensuel des emprunts et archive de l'historique")
+def partition_loans(connection: Connection) -> None:
+    if connection.dialect.name == "postgresql":
+        _partition_loans(connection)
+    LoanArchiveModel.__table__.create(connection, checkfirst=True)
+
+
+@migration("0009", "Version des titres et auteurs du catalogue")
+def add_titles_version(connection: Connection) -> None:
+    _add_column(connection, LibraryStatsModel.__table__.c.titles_version)
+
+
+def wait_for_database(
+    engine: Engine,
+    retries: int = DB_CONNECT_RETRIES,
+    delay: float = DB_CONNECT_RETRY_DELAY,
+) -> None:
+    """Attendre que la base accepte les connexions (délai croissant)"""
+    for attempt in range(retries + 1):
+        try:
+            with engine.connect():
+                return
+        except OperationalError as e:
+            if attempt == retries:
+                raise
+            logger.warning(
+                "Base de données indisponible "
+                f"(tentative {attempt + 1}/{retries + 1}) : {e}"
+            )
+            time.sleep(delay * (2**attempt))
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """
+    Appliquer les migrations manquantes, dans une transaction
+
+    Sur PostgreSQL, un verrou consultatif sérialise les processus qui
+    démarrent en même temps : les suivants trouvent les migrations déjà
+    appliquées.
+    """
+    applied = []
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(
+                text("SELECT pg_advisory_xact_lock(:lock_id)"),
+                {"lock_id": MIGRATION_LOCK_ID},
+            )
+        schema_migrations.create(connection, checkfirst=True)
+        done = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+        for version, description, function in MIGRATIONS:
+            if version in done:
+                continue
+            started = time.perf_counter()
+            function(connection)
+            connection.execute(
+                schema_migrations.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+            applied.append(version)
+            logger.info(
+                f"Migration {version} appliquée en "
+                f"{time.perf_counter() - started:.3f}s : {description}"
+            )
+
+    if not applied:
+        logger.info("Schéma de la base de données à jour")
+    return applied
+
+
+if __name__ == "__main__":
+    from database import get_engine
+
+    engine = get_engine()
+    wait_for_database(engine)
+    versions = upgrade(engine)
+    print(f"Migrations appliquées : {', '.join(versions) if versions else 'aucune'}")
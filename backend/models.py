@@ -1,9 +1,10 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, DDL, PrimaryKeyConstraint, event, false
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
+from pydantic import BaseModel, Field, EmailStr, model_validator
+from typing import List, Optional
 from datetime import datetime, timedelta
 
 # Base pour les modèles SQLAlchemy
@@ -19,6 +20,8 @@ class UserModel(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
+    # Incrémenté à chaque désactivation ou changement de droits : révoque les tokens émis avant
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relations
     loans = relationship("LoanModel", back_populates="user")
@@ -32,6 +35,67 @@ class BookModel(Base):
     author = Column(String)
     isbn = Column(String, unique=True, index=True)
     quantity = Column(Integer, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # Index composites pour la pagination keyset triée par titre / auteur
+    __table_args__ = (
+        Index("ix_books_title_id", "title", "id"),
+        Index("ix_books_author_id", "author", "id"),
+    )
+
+# Colonnes autorisées pour le tri de la liste des livres (toutes indexées)
+BOOK_SORT_COLUMNS = {
+    "id": BookModel.id,
+    "title": BookModel.title,
+    "author": BookModel.author,
+}
+
+# Configuration de recherche plein texte (sans racinisation, catalogue multilingue)
+BOOK_SEARCH_CONFIG = "simple"
+
+# Recherche plein texte (PostgreSQL uniquement) : colonne tsvector générée,
+# index GIN dessus et index trigrammes pour les recherches par sous-chaîne
+BOOK_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{BOOK_SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{BOOK_SEARCH_CONFIG}', coalesce(author, '')), 'B') ||
+            setweight(to_tsvector('{BOOK_SEARCH_CONFIG}', coalesce(isbn, '')), 'C')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_isbn_trgm ON books USING gin (isbn gin_trgm_ops)",
+]
+
+for statement in BOOK_SEARCH_DDL:
+    event.listen(
+        BookModel.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql")
+    )
+
+class LibraryStatsModel(Base):
+    """Compteurs agrégés du catalogue, répartis sur plusieurs lignes (slots)"""
+    __tablename__ = "library_stats"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    total_books = Column(Integer, nullable=False, default=0)
+    total_books_in_stock = Column(Integer, nullable=False, default=0)
+    # Version du catalogue (somme des slots) et date de la dernière modification
+    catalog_version = Column(Integer, nullable=False, default=0)
+    # Version des titres et auteurs seuls (index d'autocomplétion) : les emprunts
+    # et retours ne la changent pas
+    titles_version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AuthorStatsModel(Base):
+    """Nombre de livres par auteur, tenu à jour à chaque écriture"""
+    __tablename__ = "author_stats"
+
+    author = Column(String, primary_key=True)
+    book_count = Column(Integer, nullable=False, default=0)
 
 # Modèles Pydantic pour la validation
 class UserCreate(BaseModel):
@@ -64,6 +128,13 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     """Modèle pour les données du token"""
     username: str | None = None
+    user_id: int | None = None
+    token_version: int = 0
+
+class UserAccessUpdate(BaseModel):
+    """Modèle pour la modification des droits d'un utilisateur"""
+    is_active: Optional[bool] = None
+    is_admin: Optional[bool] = None
 
 # Modèle Pydantic pour les livres
 class Book(BaseModel):
@@ -76,6 +147,31 @@ class Book(BaseModel):
     class Config:
         from_attributes = True
 
+class BookResponse(BaseModel):
+    """Modèle de réponse pour un livre (avec identifiant)"""
+    id: int
+    title: str
+    author: str
+    isbn: str
+    quantity: int
+
+    class Config:
+        from_attributes = True
+
+class BookPage(BaseModel):
+    """Page de livres paginée par curseur"""
+    items: List[BookResponse]
+    limit: int
+    sort: str
+    next_cursor: Optional[str] = None
+    next: Optional[str] = None
+
+class BookSuggestion(BaseModel):
+    """Suggestion d'autocomplétion (titre ou auteur)"""
+    text: str
+    field: str
+    isbn: str
+
 # Modèle SQLAlchemy pour les emprunts
 class LoanModel(Base):
     """Modèle de base de données pour les emprunts de livres"""
@@ -84,15 +180,79 @@ class LoanModel(Base):
     id = Column(Integer, primary_key=True, index=True)
     book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    loan_date = Column(DateTime(timezone=True), server_default=func.now())
+    # Clé de partitionnement sur PostgreSQL (une partition par mois)
+    loan_date = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     due_date = Column(DateTime(timezone=True), nullable=False)
     return_date = Column(DateTime(timezone=True), nullable=True)
     is_returned = Column(Boolean, default=False)
+    # Retard constaté par le balayage périodique (voir overdue.py)
+    is_overdue = Column(Boolean, nullable=False, default=False, server_default=false())
 
     # Relations
     book = relationship("BookModel", back_populates="loans")
     user = relationship("UserModel", back_populates="loans")
 
+    __table_args__ = (
+        # Emprunts d'un utilisateur (en cours ou historique complet), pagination par id
+        Index("ix_loans_user_returned", "user_id", "is_returned", "id"),
+        # Index partiel : seuls les emprunts en cours, une petite fraction de l'historique
+        Index(
+            "ix_loans_open_due_date", "due_date", "id",
+            postgresql_where=(is_returned == false()),
+            sqlite_where=(is_returned == false())
+        ),
+        {
+            "postgresql_partition_by": "RANGE (loan_date)",
+            "info": {"partition_key": "loan_date"},
+        },
+    )
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _compile_partitioned_primary_key(constraint, compiler, **kw):
+    """
+    Clé primaire d'une table partitionnée
+
+    PostgreSQL exige que la clé primaire contienne la clé de partitionnement :
+    (id, loan_date) pour les emprunts. Le modèle garde id comme clé primaire
+    côté ORM et sur les autres bases.
+    """
+    table = constraint.table
+    partition_key = table.info.get("partition_key") if table is not None else None
+    if not partition_key or partition_key in constraint.columns:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return "PRIMARY KEY (%s)" % ", ".join(compiler.preparer.quote(column) for column in columns)
+
+class LoanArchiveModel(Base):
+    """Emprunts rendus depuis longtemps, déplacés hors de la table des emprunts"""
+    __tablename__ = "loans_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    book_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    loan_date = Column(DateTime(timezone=True), nullable=False)
+    due_date = Column(DateTime(timezone=True), nullable=False)
+    return_date = Column(DateTime(timezone=True), nullable=True)
+    is_returned = Column(Boolean, nullable=False, default=True)
+    is_overdue = Column(Boolean, nullable=False, default=False)
+    archived_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    # Livre de l'emprunt archivé (sans clé étrangère : l'archive survit au livre)
+    book = relationship(
+        "BookModel",
+        primaryjoin="foreign(LoanArchiveModel.book_id) == BookModel.id",
+        viewonly=True
+    )
+
+class OverdueSummaryModel(Base):
+    """Compteurs des retards matérialisés par le balayage périodique (une seule ligne)"""
+    __tablename__ = "overdue_summary"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    overdue_loans = Column(Integer, nullable=False, default=0)
+    overdue_borrowers = Column(Integer, nullable=False, default=0)
+    swept_at = Column(DateTime(timezone=True), nullable=True)
+
 # Mettre à jour les modèles existants avec les relations
 UserModel.loans = relationship("LoanModel", back_populates="user")
 BookModel.loans = relationship("LoanModel", back_populates="book")
@@ -112,10 +272,58 @@ class LoanResponse(BaseModel):
     due_date: datetime
     return_date: Optional[datetime] = None
     is_returned: bool
+    is_overdue: bool = False
+    # Présent uniquement si le livre a été chargé avec l'emprunt (expand=book)
+    book: Optional[BookResponse] = None
 
     class Config:
         from_attributes = True
 
+    @model_validator(mode="before")
+    @classmethod
+    def skip_unloaded_book(cls, data):
+        """Ne jamais déclencher le chargement paresseux du livre (requête 1+N)"""
+        state = getattr(data, "_sa_instance_state", None)
+        if state is not None and "book" in state.unloaded:
+            return {name: getattr(data, name) for name in cls.model_fields if name != "book"}
+        return data
+
+class LoanPage(BaseModel):
+    """Page d'emprunts paginée par curseur"""
+    items: List[LoanResponse]
+    limit: int
+    sort: str
+    next_cursor: Optional[str] = None
+    next: Optional[str] = None
+
+class OverdueSummary(BaseModel):
+    """Compteurs des retards au dernier balayage"""
+    overdue_loans: int
+    overdue_borrowers: int
+    swept_at: Optional[datetime] = None
+
 class LoanReturnRequest(BaseModel):
     """Modèle pour le retour d'un livre"""
     loan_id: int
+
+# Nombre maximal d'emprunts et de retours dans un lot
+MAX_LOAN_BATCH = 200
+
+class LoanBatchRequest(BaseModel):
+    """Modèle pour un lot d'emprunts et de retours (scanner de banque de prêt)"""
+    checkouts: List[str] = Field(default_factory=list, max_length=MAX_LOAN_BATCH, description="ISBN à emprunter, un par exemplaire")
+    returns: List[int] = Field(default_factory=list, max_length=MAX_LOAN_BATCH, description="Identifiants des emprunts à retourner")
+    loan_duration_days: int = Field(default=14, ge=1, le=30, description="Durée des emprunts en jours")
+    user_id: Optional[int] = Field(default=None, description="Emprunteur, si différent de l'utilisateur courant (administrateurs)")
+
+class LoanBatchItem(BaseModel):
+    """Résultat d'un élément d'un lot"""
+    isbn: Optional[str] = None
+    loan_id: Optional[int] = None
+    status: str
+    loan: Optional[LoanResponse] = None
+
+class LoanBatchResponse(BaseModel):
+    """Modèle de réponse pour un lot d'emprunts et de retours"""
+    checkouts: List[LoanBatchItem]
+    returns: List[LoanBatchItem]
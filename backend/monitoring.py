@@ -1,14 +1,40 @@
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from fastapi import Request, Response
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, Gauge, generate_latest, multiprocess, CONTENT_TYPE_LATEST
 from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+import gc
+import re
+import threading
 import time
 import psutil
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
 
+from jobs import PeriodicJob
+
 logger = logging.getLogger(__name__)
 
+# Intervalle d'échantillonnage des métriques système (secondes, 0 pour désactiver)
+SYSTEM_METRICS_INTERVAL = float(os.getenv("SYSTEM_METRICS_INTERVAL", "15"))
+
+# Requêtes SQL plus lentes que ce seuil journalisées (millisecondes, 0 pour désactiver)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+# Au plus un message par requête lente identique sur cet intervalle (secondes)
+SLOW_QUERY_LOG_INTERVAL = float(os.getenv("SLOW_QUERY_LOG_INTERVAL", "60"))
+# Nombre maximal d'empreintes de requêtes distinctes dans les métriques
+SQL_FINGERPRINT_LIMIT = int(os.getenv("SQL_FINGERPRINT_LIMIT", "500"))
+
+# Mode multiprocessus de prometheus_client (plusieurs workers) : chaque worker
+# écrit ses valeurs dans ce répertoire, /metrics agrège les fichiers de tous
+# les workers. La variable doit être définie avant le lancement des workers.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
 # Métriques personnalisées
 REQUEST_COUNT = Counter(
     'http_requests_total',
@@ -24,7 +50,8 @@ REQUEST_DURATION = Histogram(
 
 ACTIVE_CONNECTIONS = Gauge(
     'active_connections',
-    'Number of active connections'
+    'Number of active connections',
+    multiprocess_mode='livesum'
 )
 
 DATABASE_OPERATIONS = Counter(
@@ -52,18 +79,172 @@ LOAN_OPERATIONS = Counter(
 
 SYSTEM_MEMORY_USAGE = Gauge(
     'system_memory_usage_bytes',
-    'System memory usage in bytes'
+    'System memory usage in bytes',
+    multiprocess_mode='livemostrecent'
 )
 
 SYSTEM_CPU_USAGE = Gauge(
     'system_cpu_usage_percent',
-    'System CPU usage percentage'
+    'System CPU usage percentage',
+    multiprocess_mode='livemostrecent'
+)
+
+PROCESS_CPU_USAGE = Gauge(
+    'app_process_cpu_usage_percent',
+    'Application process CPU usage percentage since the previous sample',
+    multiprocess_mode='livesum'
+)
+
+PROCESS_RESIDENT_MEMORY = Gauge(
+    'app_process_resident_memory_bytes',
+    'Application process resident memory in bytes',
+    multiprocess_mode='livesum'
+)
+
+PROCESS_OPEN_FDS = Gauge(
+    'app_process_open_fds',
+    'Application process open file descriptors',
+    multiprocess_mode='livesum'
+)
+
+PROCESS_THREADS = Gauge(
+    'app_process_threads',
+    'Application process thread count',
+    multiprocess_mode='livesum'
+)
+
+GC_TRACKED_OBJECTS = Gauge(
+    'app_gc_tracked_objects',
+    'Objects tracked by the garbage collector, per generation',
+    ['generation'],
+    multiprocess_mode='livesum'
+)
+
+GC_COLLECTIONS = Gauge(
+    'app_gc_collections',
+    'Garbage collections run since startup, per generation',
+    ['generation'],
+    multiprocess_mode='livesum'
+)
+
+GC_PAUSE = Histogram(
+    'app_gc_pause_seconds',
+    'Garbage collection pause duration, per generation',
+    ['generation'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+GC_COLLECTED = Counter(
+    'app_gc_collected_objects_total',
+    'Unreachable objects freed by the garbage collector, per generation',
+    ['generation']
+)
+
+GC_UNCOLLECTABLE = Counter(
+    'app_gc_uncollectable_objects_total',
+    'Unreachable objects the garbage collector could not free, per generation',
+    ['generation']
+)
+
+DB_POOL_SIZE = Gauge(
+    'db_pool_size',
+    'Configured number of persistent connections in the pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Connections currently checked out from the pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKED_IN = Gauge(
+    'db_pool_checked_in_connections',
+    'Idle connections currently held in the pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow_connections',
+    'Connections opened beyond pool_size (negative while the pool is not full)',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting to check a connection out of the pool',
+    ['pool'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total',
+    'Checkouts that gave up after pool_timeout',
+    ['pool']
+)
+
+PASSWORD_HASH_QUEUE = Gauge(
+    'password_hash_queue_depth',
+    'Password hashing requests by state in the hashing pool',
+    ['state'],
+    multiprocess_mode='livesum'
+)
+
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds',
+    'Time spent hashing or verifying a password',
+    ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+PASSWORD_HASH_REJECTED = Counter(
+    'password_hash_rejected_total',
+    'Password hashing requests rejected because the queue was full',
+    ['operation']
+)
+
+DB_REPLICA_HEALTHY = Gauge(
+    'db_replica_healthy',
+    'Whether a read replica is in rotation (1) or not (0)',
+    ['replica'],
+    multiprocess_mode='livemin'
+)
+
+DB_ROUTED_SESSIONS = Counter(
+    'db_routed_sessions_total',
+    'Read-only sessions by routing target',
+    ['target']
+)
+
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds',
+    'SQL statement execution time by statement fingerprint',
+    ['statement'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request',
+    'SQL statements executed while serving one HTTP request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+
+DB_SLOW_QUERIES = Counter(
+    'db_slow_queries_total',
+    'SQL statements slower than SLOW_QUERY_THRESHOLD_MS',
+    ['endpoint']
 )
 
 APPLICATION_INFO = Gauge(
     'application_info',
     'Application information',
-    ['version', 'python_version']
+    ['version', 'python_version'],
+    multiprocess_mode='livemax'
 )
 
 
@@ -72,6 +253,9 @@ class PrometheusMetrics:
     
     def __init__(self):
         self.start_time = time.time()
+        self._process = psutil.Process()
+        # Dernier échantillon des métriques système (voir update_system_metrics)
+        self.system_sample: Dict[str, Any] = {}
         self._setup_application_info()
     
     def _setup_application_info(self):
@@ -82,65 +266,6 @@ class PrometheusMetrics:
             python_version=f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
         ).set(1)
     
-    async def middleware(self, request: Request, call_next):
-        """Middleware pour collecter les métriques HTTP"""
-        start_time = time.time()
-        
-        # Incrémenter les connexions actives
-        ACTIVE_CONNECTIONS.inc()
-        
-        try:
-            response = await call_next(request)
-            
-            # Calculer la durée de la requête
-            duration = time.time() - start_time
-            
-            # Extraire les informations de la requête
-            method = request.method
-            endpoint = self._get_endpoint_path(request)
-            status_code = str(response.status_code)
-            
-            # Enregistrer les métriques
-            REQUEST_COUNT.labels(
-                method=method,
-                endpoint=endpoint,
-                status_code=status_code
-            ).inc()
-            
-            REQUEST_DURATION.labels(
-                method=method,
-                endpoint=endpoint
-            ).observe(duration)
-            
-            return response
-        
-        except Exception as e:
-            # Enregistrer les erreurs
-            REQUEST_COUNT.labels(
-                method=request.method,
-                endpoint=self._get_endpoint_path(request),
-                status_code="500"
-            ).inc()
-            raise
-        
-        finally:
-            # Décrémenter les connexions actives
-            ACTIVE_CONNECTIONS.dec()
-    
-    def _get_endpoint_path(self, request: Request) -> str:
-        """Extraire le chemin de l'endpoint"""
-        if hasattr(request, 'url') and hasattr(request.url, 'path'):
-            path = request.url.path
-            # Normaliser les chemins avec des IDs
-            if '/books/' in path and path.split('/books/')[-1].isdigit():
-                return '/books/{id}'
-            elif '/loans/' in path and '/return' in path:
-                return '/loans/{id}/return'
-            elif '/loans/' in path and path.split('/loans/')[-1].isdigit():
-                return '/loans/{id}'
-            return path
-        return "unknown"
-    
     def record_user_registration(self):
         """Enregistrer une inscription utilisateur"""
         USER_REGISTRATIONS.inc()
@@ -158,27 +283,53 @@ class PrometheusMetrics:
         DATABASE_OPERATIONS.labels(operation=operation, table=table).inc()
     
     def update_system_metrics(self):
-        """Mettre à jour les métriques système"""
+        """
+        Échantillonner les métriques système
+
+        Appelé périodiquement par system_metrics_sampler, jamais pendant un
+        scrape : les pourcentages CPU sont calculés depuis l'échantillon
+        précédent, sans attente.
+        """
         try:
-            # Utilisation mémoire
-            memory_info = psutil.virtual_memory()
-            SYSTEM_MEMORY_USAGE.set(memory_info.used)
-            
-            # Utilisation CPU
-            cpu_percent = psutil.cpu_percent(interval=1)
-            SYSTEM_CPU_USAGE.set(cpu_percent)
-            
+            with self._process.oneshot():
+                sample = {
+                    "memory_used": psutil.virtual_memory().used,
+                    "cpu_percent": psutil.cpu_percent(interval=None),
+                    "process_cpu_percent": self._process.cpu_percent(interval=None),
+                    "process_rss": self._process.memory_info().rss,
+                    "process_threads": self._process.num_threads(),
+                }
+                if hasattr(self._process, "num_fds"):
+                    sample["process_open_fds"] = self._process.num_fds()
         except Exception as e:
             logger.error(f"Erreur lors de la mise à jour des métriques système: {e}")
+            return
+        
+        SYSTEM_MEMORY_USAGE.set(sample["memory_used"])
+        SYSTEM_CPU_USAGE.set(sample["cpu_percent"])
+        PROCESS_CPU_USAGE.set(sample["process_cpu_percent"])
+        PROCESS_RESIDENT_MEMORY.set(sample["process_rss"])
+        PROCESS_THREADS.set(sample["process_threads"])
+        if "process_open_fds" in sample:
+            PROCESS_OPEN_FDS.set(sample["process_open_fds"])
+        
+        for generation, (count, stats) in enumerate(zip(gc.get_count(), gc.get_stats())):
+            GC_TRACKED_OBJECTS.labels(generation=str(generation)).set(count)
+            GC_COLLECTIONS.labels(generation=str(generation)).set(stats["collections"])
+        
+        publish_gc_metrics()
+        publish_pool_metrics()
+        
+        self.system_sample = sample
     
     def get_metrics_summary(self) -> Dict[str, Any]:
-        """Obtenir un résumé des métriques"""
+        """Obtenir un résumé des métriques (valeurs système du dernier échantillon)"""
         return {
             "uptime_seconds": time.time() - self.start_time,
             "active_connections": ACTIVE_CONNECTIONS._value._value,
             "total_requests": sum(REQUEST_COUNT._metrics.values()),
-            "memory_usage_mb": psutil.virtual_memory().used / (1024 * 1024),
-            "cpu_usage_percent": psutil.cpu_percent(),
+            "memory_usage_mb": self.system_sample.get("memory_used", 0) / (1024 * 1024),
+            "cpu_usage_percent": self.system_sample.get("cpu_percent", 0.0),
         }
 
 
@@ -186,18 +337,332 @@ class PrometheusMetrics:
 metrics = PrometheusMetrics()
 
 
+# Étiquette des requêtes qui ne correspondent à aucune route (404, scans...)
+UNMATCHED_ROUTE = "unmatched"
+
+
+def route_template(scope) -> str:
+    """Modèle de la route atteinte (/books/{isbn}), renseigné par le routeur FastAPI"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class RequestDbStats:
+    """Requêtes SQL exécutées pour la requête HTTP en cours"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.scope['method']} {route_template(self.scope)}"
+
+
+# Renseigné par MetricsMiddleware ; suit la requête dans le pool de threads
+current_request_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("current_request_db_stats", default=None)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI collectant les métriques HTTP
+
+    Middleware ASGI pur (sans BaseHTTPMiddleware) : la réponse, y compris
+    en streaming, est transmise message par message sans être mise en
+    mémoire, et la durée couvre l'envoi complet du corps. Les requêtes
+    sont étiquetées par le modèle de la route, lu dans scope["route"]
+    après le routage : une série par route et non une par ISBN.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 500 si l'application échoue avant d'envoyer une réponse
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        ACTIVE_CONNECTIONS.inc()
+        db_stats = RequestDbStats(scope)
+        token = current_request_db_stats.set(db_stats)
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start_time
+            current_request_db_stats.reset(token)
+            ACTIVE_CONNECTIONS.dec()
+            method = scope["method"]
+            endpoint = route_template(scope)
+            REQUEST_COUNT.labels(method=method, endpoint=endpoint, status_code=str(status_code)).inc()
+            REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
+            DB_QUERIES_PER_REQUEST.labels(endpoint=endpoint).observe(db_stats.queries)
+
+
+# Échantillonnage en arrière-plan des métriques système
+system_metrics_sampler = PeriodicJob("system-metrics", SYSTEM_METRICS_INTERVAL, metrics.update_system_metrics)
+
+
+def _metrics_registry():
+    """Registre à exporter : celui du processus, ou l'agrégat de tous les workers"""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
 def get_metrics_endpoint():
     """Endpoint pour exposer les métriques Prometheus"""
-    # Mettre à jour les métriques système avant de les exposer
-    metrics.update_system_metrics()
-    
-    # Générer les métriques au format Prometheus
+    # Sérialiser uniquement : les métriques système sont échantillonnées
+    # par system_metrics_sampler
+    publish_gc_metrics()
     return PlainTextResponse(
-        generate_latest(),
+        generate_latest(_metrics_registry()),
         media_type=CONTENT_TYPE_LATEST
     )
 
 
+def mark_worker_dead(pid: int = None) -> None:
+    """
+    Retirer les jauges "live" d'un worker arrêté (mode multiprocessus)
+
+    Appelé à l'arrêt de chaque worker, et par le processus maître pour un
+    worker qui s'est terminé sans s'arrêter proprement.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid(), PROMETHEUS_MULTIPROC_DIR)
+
+
+# Pauses du ramasse-miettes, mesurées par gc.callbacks. Le callback
+# s'exécute au milieu d'une allocation quelconque, éventuellement sous le
+# verrou d'une autre métrique (verrou global en mode multiprocessus) : il ne
+# fait qu'ajouter une mesure à une file, publiée ensuite hors du callback.
+_gc_collections: deque = deque(maxlen=10000)
+_gc_started = [0.0]
+
+
+def _gc_callback(phase: str, info: Dict[str, int]) -> None:
+    if phase == "start":
+        _gc_started[0] = time.perf_counter()
+    else:
+        _gc_collections.append((
+            info["generation"], time.perf_counter() - _gc_started[0], info["collected"], info["uncollectable"]
+        ))
+
+
+def install_gc_callbacks() -> None:
+    """Mesurer les collectes du ramasse-miettes (sans effet si déjà installé)"""
+    if _gc_callback not in gc.callbacks:
+        gc.callbacks.append(_gc_callback)
+
+
+def uninstall_gc_callbacks() -> None:
+    if _gc_callback in gc.callbacks:
+        gc.callbacks.remove(_gc_callback)
+    publish_gc_metrics()
+
+
+def publish_gc_metrics() -> None:
+    """Publier les collectes mesurées depuis le dernier appel"""
+    while True:
+        try:
+            generation, pause, collected, uncollectable = _gc_collections.popleft()
+        except IndexError:
+            return
+        GC_PAUSE.labels(generation=str(generation)).observe(pause)
+        if collected:
+            GC_COLLECTED.labels(generation=str(generation)).inc(collected)
+        if uncollectable:
+            GC_UNCOLLECTABLE.labels(generation=str(generation)).inc(uncollectable)
+
+
+# Instrumentation du pool de connexions SQLAlchemy
+class _CheckoutWaitMixin:
+    """Mesurer l'attente lors de l'emprunt d'une connexion au pool"""
+
+    def _do_get(self):
+        label = self.logging_name or "default"
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(pool=label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(pool=label).observe(time.perf_counter() - start_time)
+
+
+class InstrumentedQueuePool(_CheckoutWaitMixin, QueuePool):
+    """QueuePool exportant le temps d'attente des emprunts de connexion"""
+
+
+class InstrumentedAsyncQueuePool(_CheckoutWaitMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool exportant le temps d'attente des emprunts de connexion"""
+
+
+def _pool_stat(engine, method: str) -> float:
+    """Lire une statistique du pool courant (0 si le pool ne la fournit pas)"""
+    stat = getattr(engine.pool, method, None)
+    return stat() if callable(stat) else 0
+
+
+_POOL_GAUGES = {
+    "size": DB_POOL_SIZE,
+    "checkedout": DB_POOL_CHECKED_OUT,
+    "checkedin": DB_POOL_CHECKED_IN,
+    "overflow": DB_POOL_OVERFLOW,
+}
+
+# Moteurs dont l'état du pool est publié par l'échantillonneur (mode multiprocessus)
+_instrumented_engines: Dict[str, Any] = {}
+
+
+def instrument_connection_pool(engine, name: str) -> None:
+    """
+    Exposer l'état du pool d'un moteur
+
+    En mode simple processus, le pool est lu à chaque scrape. En mode
+    multiprocessus, seules les valeurs écrites dans les fichiers partagés
+    sont exportées : l'état est publié à chaque échantillonnage.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        _instrumented_engines[name] = engine
+        publish_pool_metrics()
+        return
+    for method, gauge in _POOL_GAUGES.items():
+        gauge.labels(pool=name).set_function(lambda method=method: _pool_stat(engine, method))
+
+
+def publish_pool_metrics() -> None:
+    """Écrire l'état courant des pools instrumentés (mode multiprocessus)"""
+    for name, engine in list(_instrumented_engines.items()):
+        for method, gauge in _POOL_GAUGES.items():
+            gauge.labels(pool=name).set(_pool_stat(engine, method))
+
+
+def set_password_hash_queue(queued: int, running: int) -> None:
+    """Publier l'état de la file de hachage des mots de passe"""
+    PASSWORD_HASH_QUEUE.labels(state="queued").set(queued)
+    PASSWORD_HASH_QUEUE.labels(state="running").set(running)
+
+
+def record_password_hash(operation: str, duration: float = 0.0, rejected: bool = False) -> None:
+    """Enregistrer un hachage (ou son refus faute de place dans la file)"""
+    if rejected:
+        PASSWORD_HASH_REJECTED.labels(operation=operation).inc()
+    else:
+        PASSWORD_HASH_DURATION.labels(operation=operation).observe(duration)
+
+
+def set_replica_health(name: str, healthy: bool) -> None:
+    """Publier l'état de santé d'un réplica"""
+    DB_REPLICA_HEALTHY.labels(replica=name).set(1 if healthy else 0)
+
+
+def record_db_route(target: str) -> None:
+    """Compter une session en lecture selon sa cible (primary / replica)"""
+    DB_ROUTED_SESSIONS.labels(target=target).inc()
+
+
+# Instrumentation des requêtes SQL (tous les moteurs, synchrones et asynchrones)
+_SQL_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%\([^)]+\)s|\$\d+|:\w+|\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"(\(\?\))(?:\s*,\s*\(\?\))+"), r"\1"),
+    (re.compile(r"\s+"), " "),
+]
+_SQL_OPERATION = re.compile(r"^\s*(?:WITH\b.*?\)\s*)?(\w+)", re.S | re.I)
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.I)
+
+_fingerprints = set()
+_fingerprints_lock = threading.Lock()
+_slow_query_log: Dict[str, list] = {}
+
+
+@lru_cache(maxsize=2048)
+def sql_fingerprint(statement: str) -> str:
+    """
+    Empreinte d'une requête SQL : littéraux et paramètres remplacés par ?,
+    listes IN et VALUES multi-lignes réduites à un élément
+    """
+    for pattern, replacement in _SQL_LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()[:200]
+
+
+@lru_cache(maxsize=2048)
+def _sql_operation_table(statement: str):
+    operation = _SQL_OPERATION.match(statement)
+    table = _SQL_TABLE.search(statement)
+    return (
+        operation.group(1).upper() if operation else "UNKNOWN",
+        table.group(1).lower() if table else "none",
+    )
+
+
+def _fingerprint_label(fingerprint: str) -> str:
+    """Borne le nombre de séries : au-delà de SQL_FINGERPRINT_LIMIT, "other" """
+    if fingerprint in _fingerprints:
+        return fingerprint
+    with _fingerprints_lock:
+        if len(_fingerprints) >= SQL_FINGERPRINT_LIMIT:
+            return "other"
+        _fingerprints.add(fingerprint)
+    return fingerprint
+
+
+def _log_slow_query(fingerprint: str, duration: float, stats: Optional[RequestDbStats]) -> None:
+    """Journaliser une requête lente, au plus une fois par empreinte et par intervalle"""
+    endpoint = stats.endpoint if stats is not None else "background"
+    DB_SLOW_QUERIES.labels(endpoint=endpoint).inc()
+    now = time.monotonic()
+    with _fingerprints_lock:
+        last_logged, suppressed = _slow_query_log.get(fingerprint, (0.0, 0))
+        if now - last_logged < SLOW_QUERY_LOG_INTERVAL:
+            _slow_query_log[fingerprint] = (last_logged, suppressed + 1)
+            return
+        _slow_query_log[fingerprint] = (now, 0)
+    repeated = f" (+{suppressed} depuis le dernier message)" if suppressed else ""
+    logger.warning(f"Requête SQL lente ({duration * 1000:.0f} ms) pour {endpoint}{repeated} : {fingerprint}")
+
+
+# Début de la requête porté par son contexte d'exécution : une requête en
+# échec (doublon, timeout) n'a pas d'after_cursor_execute et ne laisse rien
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_start", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    fingerprint = sql_fingerprint(statement)
+    DB_QUERY_DURATION.labels(statement=_fingerprint_label(fingerprint)).observe(duration)
+    operation, table = _sql_operation_table(statement)
+    metrics.record_database_operation(operation, table)
+
+    stats = current_request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+    if SLOW_QUERY_THRESHOLD_MS and duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        _log_slow_query(fingerprint, duration, stats)
+
+
 # Décorateurs pour instrumenter les fonctions
 def track_database_operation(operation: str, table: str):
     """Décorateur pour tracker les opérations de base de données"""
@@ -0,0 +1,142 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import false, func, select, text, true, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, dialect_insert
+from jobs import PeriodicJob
+from logging_config import logger
+from models import LoanModel, OverdueSummaryModel
+
+# Intervalle entre deux balayages (secondes, 0 pour désactiver)
+OVERDUE_SWEEP_INTERVAL = float(os.getenv("OVERDUE_SWEEP_INTERVAL", "300"))
+# Nombre d'emprunts lus et mis à jour par lot
+OVERDUE_SWEEP_CHUNK_SIZE = int(os.getenv("OVERDUE_SWEEP_CHUNK_SIZE", "1000"))
+
+# Verrou consultatif PostgreSQL : un seul processus balaie à la fois
+OVERDUE_SWEEP_LOCK_ID = 7_301_001
+
+
+def open_overdue_filter(now: datetime):
+    """
+    Emprunts en cours dont la date de retour est dépassée
+
+    La condition is_returned = false correspond au prédicat de l'index
+    partiel ix_loans_open_due_date : l'historique des emprunts rendus
+    n'est jamais parcouru.
+    """
+    return (LoanModel.is_returned == false(), LoanModel.due_date < now)
+
+
+def _try_sweep_lock(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return True
+    return db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:lock_id)"),
+        {"lock_id": OVERDUE_SWEEP_LOCK_ID},
+    ).scalar()
+
+
+def _chunks(rows: List[Any], size: int) -> Iterator[List[Any]]:
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def sweep_overdue_loans(
+    chunk_size: int = OVERDUE_SWEEP_CHUNK_SIZE,
+    now: Optional[datetime] = None,
+    session_factory=SessionLocal,
+) -> Optional[Dict[str, Any]]:
+    """
+    Marquer les nouveaux retards et recalculer les compteurs de retards
+
+    Les identifiants sont lus en flux (yield_per, curseur serveur sur
+    PostgreSQL) dans une session dédiée et mis à jour par lots dans une
+    autre, chaque lot étant validé séparément : aucune transaction ne
+    porte sur des millions de lignes. Retourne None si un autre processus
+    est déjà en train de balayer.
+    """
+    now = now or datetime.utcnow()
+    marked = 0
+
+    with session_factory() as reader, session_factory() as writer:
+        if not _try_sweep_lock(reader):
+            logger.info("Balayage des retards déjà en cours dans un autre processus")
+            return None
+
+        overdue_ids = reader.execute(
+            select(LoanModel.id)
+            .where(*open_overdue_filter(now), LoanModel.is_overdue == false())
+            .execution_options(yield_per=chunk_size)
+        )
+        if reader.get_bind().dialect.name == "postgresql":
+            chunks = overdue_ids.partitions()
+        else:
+            # SQLite : une lecture en cours bloquerait la validation des lots
+            chunks = _chunks(overdue_ids.all(), chunk_size)
+
+        for chunk in chunks:
+            ids = [loan_id for (loan_id,) in chunk]
+            writer.execute(
+                update(LoanModel)
+                .where(LoanModel.id.in_(ids))
+                .values(is_overdue=true()),
+                execution_options={"synchronize_session": False},
+            )
+            writer.commit()
+            marked += len(ids)
+
+        overdue_loans, overdue_borrowers = writer.execute(
+            select(
+                func.count(LoanModel.id), func.count(LoanModel.user_id.distinct())
+            ).where(*open_overdue_filter(now))
+        ).one()
+
+        statement = dialect_insert(writer, OverdueSummaryModel).values(
+            id=1,
+            overdue_loans=overdue_loans,
+            overdue_borrowers=overdue_borrowers,
+            swept_at=now,
+        )
+        writer.execute(
+            statement.on_conflict_do_update(
+                index_elements=[OverdueSummaryModel.id],
+                set_={
+                    "overdue_loans": statement.excluded.overdue_loans,
+                    "overdue_borrowers": statement.excluded.overdue_borrowers,
+                    "swept_at": statement.excluded.swept_at,
+                },
+            )
+        )
+        writer.commit()
+        reader.rollback()
+
+    logger.info(
+        f"Balayage des retards : {marked} nouveaux retards, "
+        f"{overdue_loans} emprunts en retard"
+    )
+    return {
+        "marked": marked,
+        "overdue_loans": overdue_loans,
+        "overdue_borrowers": overdue_borrowers,
+        "swept_at": now,
+    }
+
+
+def get_overdue_summary(db: Session) -> Dict[str, Any]:
+    """Compteurs des retards au dernier balayage"""
+    summary = db.get(OverdueSummaryModel, 1)
+    if summary is None:
+        return {"overdue_loans": 0, "overdue_borrowers": 0, "swept_at": None}
+    return {
+        "overdue_loans": summary.overdue_loans,
+        "overdue_borrowers": summary.overdue_borrowers,
+        "swept_at": summary.swept_at,
+    }
+
+
+overdue_sweeper = PeriodicJob(
+    "overdue-sweeper", OVERDUE_SWEEP_INTERVAL, sweep_overdue_loans
+)
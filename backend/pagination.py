@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+# Taille de page par défaut et maximale pour les listes paginées
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _encode_value(value: Any) -> Any:
+    """Rendre une valeur de tri sérialisable en JSON"""
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    """Restaurer une valeur de tri depuis sa forme JSON"""
+    if isinstance(value, dict) and "$dt" in value:
+        return datetime.fromisoformat(value["$dt"])
+    return value
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Encoder une position de pagination en curseur opaque"""
+    payload = {key: _encode_value(value) for key, value in position.items()}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Décoder un curseur opaque (400 si le curseur est invalide)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not isinstance(payload, dict) or "id" not in payload:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {key: _decode_value(value) for key, value in payload.items()}
+
+
+def keyset_seek(
+    query,
+    sort_key: str,
+    sort_column,
+    id_column,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False,
+):
+    """
+    Appliquer la condition de reprise, le tri et la limite d'une page keyset
+
+    Fonctionne aussi bien sur une Query ORM que sur un select() (utilisé
+    par les endpoints asynchrones). La limite demande une ligne de plus
+    pour savoir s'il existe une page suivante.
+    """
+    sort_by_id = sort_column is id_column
+
+    if cursor:
+        position = decode_cursor(cursor)
+        if position.get("sort") != sort_key:
+            raise HTTPException(
+                status_code=400, detail="Cursor does not match sort order"
+            )
+
+        if sort_by_id:
+            seek_key, seek_position = id_column, position["id"]
+        else:
+            seek_key = tuple_(sort_column, id_column)
+            seek_position = tuple_(position.get("value"), position["id"])
+        query = query.filter(
+            seek_key < seek_position if descending else seek_key > seek_position
+        )
+
+    order_by = [id_column] if sort_by_id else [sort_column, id_column]
+    if descending:
+        order_by = [column.desc() for column in order_by]
+
+    return query.order_by(*order_by).limit(limit + 1)
+
+
+def keyset_page(
+    rows: List[Any], sort_key: str, sort_column, id_column, limit: int
+) -> Tuple[List[Any], Optional[str]]:
+    """Découper les lignes lues par keyset_seek en page + curseur suivant"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        position = {"sort": sort_key, "id": getattr(last, id_column.key)}
+        if sort_column is not id_column:
+            position["value"] = getattr(last, sort_column.key)
+        next_cursor = encode_cursor(position)
+
+    return rows, next_cursor
+
+
+def keyset_paginate(
+    query,
+    sort_key: str,
+    sort_column,
+    id_column,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Appliquer une pagination keyset (seek) à une requête
+
+    La requête est triée sur (sort_column, id_column) et reprend strictement
+    après la dernière ligne de la page précédente, ce qui permet à la base
+    d'utiliser un index au lieu d'un OFFSET qui grossit avec la page.
+
+    sort_column peut être une expression calculée (ex. un score de
+    pertinence) : elle doit alors porter un label pour être relue sur les
+    lignes retournées.
+
+    Retourne les lignes de la page et le curseur de la page suivante
+    (None si c'est la dernière page).
+    """
+    rows = keyset_seek(
+        query, sort_key, sort_column, id_column, cursor, limit, descending
+    ).all()
+    return keyset_page(rows, sort_key, sort_column, id_column, limit)
@@ -0,0 +1,260 @@
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, insert, select, text, true
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from jobs import PeriodicJob
+from logging_config import logger
+from models import LoanArchiveModel, LoanModel
+
+# Nombre de partitions mensuelles créées à l'avance
+LOAN_PARTITION_MONTHS_AHEAD = int(os.getenv("LOAN_PARTITION_MONTHS_AHEAD", "3"))
+# Âge (en jours, depuis la date d'emprunt) à partir duquel un emprunt rendu est archivé
+LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", "730"))
+# Nombre d'emprunts déplacés par transaction
+LOAN_ARCHIVE_CHUNK_SIZE = int(os.getenv("LOAN_ARCHIVE_CHUNK_SIZE", "5000"))
+# Intervalle entre deux maintenances des partitions (secondes, 0 pour désactiver)
+LOAN_MAINTENANCE_INTERVAL = float(os.getenv("LOAN_MAINTENANCE_INTERVAL", "3600"))
+
+# Verrou consultatif PostgreSQL : une seule maintenance à la fois
+LOAN_MAINTENANCE_LOCK_ID = 7_301_002
+# Verrou consultatif PostgreSQL : création des partitions, un worker à la fois
+LOAN_PARTITION_LOCK_ID = 7_301_003
+
+PARTITION_NAME = re.compile(r"^loans_p(\d{4})(\d{2})$")
+
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"loans_p{month:%Y%m}"
+
+
+def _partition_bounds(month: datetime) -> str:
+    upper = _next_month(month)
+    return (
+        f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') "
+        f"TO ('{upper:%Y-%m-%d} 00:00:00+00')"
+    )
+
+
+def partition_ddl(month: datetime) -> str:
+    """CREATE TABLE de la partition mensuelle contenant month"""
+    month = _month_start(month)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} "
+        f"PARTITION OF loans {_partition_bounds(month)}"
+    )
+
+
+def ensure_loan_partitions(
+    db: Session,
+    months_ahead: int = LOAN_PARTITION_MONTHS_AHEAD,
+    now: Optional[datetime] = None,
+) -> List[str]:
+    """
+    Créer les partitions mensuelles du mois courant et des mois à venir
+
+    Sans effet hors PostgreSQL. La table des emprunts n'a pas de partition
+    par défaut (incompatible avec DETACH PARTITION CONCURRENTLY) : un
+    emprunt d'un mois sans partition serait refusé, d'où les mois créés à
+    l'avance. Chaque mois est créé dans sa propre transaction, sous un
+    verrou consultatif : les workers qui démarrent ensemble ne se gênent
+    pas, et un échec n'annule pas les autres mois.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return []
+
+    month = _month_start(now or datetime.utcnow())
+    created = []
+    for _ in range(months_ahead + 1):
+        try:
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:lock_id)"),
+                {"lock_id": LOAN_PARTITION_LOCK_ID},
+            )
+            db.execute(text(partition_ddl(month)))
+            db.commit()
+            created.append(_partition_name(month))
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(
+                f"Impossible de créer la partition {_partition_name(month)} "
+                f"des emprunts : {e}"
+            )
+        month = _next_month(month)
+    return created
+
+
+def _archive_chunk(db: Session, cutoff: datetime, chunk_size: int) -> int:
+    """Déplacer un lot d'emprunts rendus vers loans_archive (une transaction)"""
+    loans = LoanModel.__table__
+    archive = LoanArchiveModel.__table__
+    columns = [
+        "id",
+        "book_id",
+        "user_id",
+        "loan_date",
+        "due_date",
+        "return_date",
+        "is_returned",
+        "is_overdue",
+    ]
+
+    candidates = (
+        select(loans.c.id)
+        .where(loans.c.is_returned == true(), loans.c.loan_date < cutoff)
+        .limit(chunk_size)
+    )
+    moved = (
+        delete(loans)
+        .where(loans.c.id.in_(candidates.scalar_subquery()), loans.c.loan_date < cutoff)
+        .returning(*(loans.c[column] for column in columns))
+    )
+
+    if db.get_bind().dialect.name == "postgresql":
+        # DELETE ... RETURNING et INSERT dans une seule requête
+        moved = moved.cte("moved")
+        count = db.execute(
+            insert(archive)
+            .from_select(columns, select(*(moved.c[column] for column in columns)))
+            .returning(archive.c.id)
+        ).all()
+        db.commit()
+        return len(count)
+
+    rows = [dict(row._mapping) for row in db.execute(moved)]
+    if rows:
+        db.execute(insert(archive), rows)
+    db.commit()
+    return len(rows)
+
+
+def _drop_empty_partitions(db: Session, cutoff: datetime) -> List[str]:
+    """
+    Supprimer les partitions mensuelles entièrement antérieures à cutoff et vides
+
+    La partition est détachée avec DETACH PARTITION CONCURRENTLY (hors
+    transaction) : la table des emprunts n'est pas verrouillée en
+    exclusivité et la circulation continue. Un détachement interrompu
+    (inhdetachpending) est terminé par FINALIZE au passage suivant.
+    """
+    partitions = db.execute(
+        text(
+            "SELECT child.relname, pg_inherits.inhdetachpending FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'loans'"
+        )
+    ).all()
+    db.rollback()
+
+    dropped = []
+    with db.get_bind().connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        for name, detach_pending in partitions:
+            match = PARTITION_NAME.match(name)
+            if match is None:
+                continue
+            month = datetime(int(match.group(1)), int(match.group(2)), 1)
+            if _next_month(month) > cutoff:
+                continue
+            if connection.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            ).scalar():
+                # Emprunts jamais rendus : la partition reste en place
+                continue
+            if detach_pending:
+                connection.execute(
+                    text(f"ALTER TABLE loans DETACH PARTITION {name} FINALIZE")
+                )
+            else:
+                connection.execute(
+                    text(f"ALTER TABLE loans DETACH PARTITION {name} CONCURRENTLY")
+                )
+            if connection.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            ).scalar():
+                # Ligne arrivée entre la vérification et le détachement
+                connection.execute(
+                    text(
+                        f"ALTER TABLE loans ATTACH PARTITION {name} "
+                        f"{_partition_bounds(month)}"
+                    )
+                )
+                continue
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def archive_returned_loans(
+    older_than_days: int = LOAN_ARCHIVE_AFTER_DAYS,
+    chunk_size: int = LOAN_ARCHIVE_CHUNK_SIZE,
+    now: Optional[datetime] = None,
+    session_factory=SessionLocal,
+) -> Dict[str, Any]:
+    """
+    Archiver les emprunts rendus anciens
+
+    Les emprunts rendus dont la date d'emprunt précède la limite sont
+    déplacés par lots vers loans_archive ; sur PostgreSQL, les partitions
+    mensuelles devenues vides sont ensuite supprimées. Les requêtes sur
+    les emprunts en cours ne parcourent plus que les partitions récentes.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    archived = 0
+    dropped = []
+
+    with session_factory() as db:
+        while True:
+            moved = _archive_chunk(db, cutoff, chunk_size)
+            archived += moved
+            if moved < chunk_size:
+                break
+        if db.get_bind().dialect.name == "postgresql":
+            dropped = _drop_empty_partitions(db, cutoff)
+
+    logger.info(
+        f"Archivage des emprunts : {archived} emprunts archivés, "
+        f"{len(dropped)} partitions supprimées"
+    )
+    return {"archived": archived, "dropped_partitions": dropped, "cutoff": cutoff}
+
+
+def run_loan_maintenance(session_factory=SessionLocal) -> Optional[Dict[str, Any]]:
+    """Créer les partitions à venir puis archiver l'historique ancien"""
+    with session_factory() as lock, session_factory() as db:
+        # Verrou tenu par la transaction de la session lock jusqu'à la fin
+        if (
+            lock.get_bind().dialect.name == "postgresql"
+            and not lock.execute(
+                text("SELECT pg_try_advisory_xact_lock(:lock_id)"),
+                {"lock_id": LOAN_MAINTENANCE_LOCK_ID},
+            ).scalar()
+        ):
+            logger.info(
+                "Maintenance des emprunts déjà en cours dans un autre processus"
+            )
+            return None
+        ensure_loan_partitions(db)
+        result = archive_returned_loans(session_factory=session_factory)
+        lock.rollback()
+    return result
+
+
+loan_maintenance = PeriodicJob(
+    "loan-maintenance", LOAN_MAINTENANCE_INTERVAL, run_loan_maintenance
+)
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import bcrypt
+from fastapi import HTTPException, status
+
+from logging_config import logger
+from monitoring import record_password_hash, set_password_hash_queue
+
+# Algorithme utilisé pour les nouveaux hachages (bcrypt, argon2)
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "bcrypt")
+# Coût bcrypt (chaque incrément double le temps de calcul)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Pool dédié au hachage : une rafale de connexions occupe ces threads-là
+# et non ceux qui servent le catalogue
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+# Nombre maximal de hachages en attente ou en cours avant de répondre 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
+
+class PasswordHasher:
+    """Algorithme de hachage des mots de passe"""
+
+    scheme = ""
+
+    def hash(self, password: str) -> str:
+        raise NotImplementedError
+
+    def verify(self, password: str, hashed: str) -> bool:
+        raise NotImplementedError
+
+    def identify(self, hashed: str) -> bool:
+        """Le hash a-t-il été produit par cet algorithme ?"""
+        raise NotImplementedError
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Le hash a-t-il été produit avec d'autres paramètres que les actuels ?"""
+        return False
+
+
+class Sha256Hasher(PasswordHasher):
+    """SHA-256 sans sel : format historique, vérifié mais plus jamais produit"""
+
+    scheme = "sha256"
+    _pattern = re.compile(r"^[0-9a-f]{64}$")
+
+    def hash(self, password: str) -> str:
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return hmac.compare_digest(self.hash(password), hashed)
+
+    def identify(self, hashed: str) -> bool:
+        return bool(self._pattern.match(hashed))
+
+
+class BcryptHasher(PasswordHasher):
+    """bcrypt (seuls les 72 premiers octets du mot de passe sont pris en compte)"""
+
+    scheme = "bcrypt"
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS):
+        self.rounds = rounds
+
+    @staticmethod
+    def _secret(password: str) -> bytes:
+        return password.encode()[:72]
+
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(
+            self._secret(password), bcrypt.gensalt(self.rounds)
+        ).decode()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        try:
+            return bcrypt.checkpw(self._secret(password), hashed.encode())
+        except ValueError:
+            return False
+
+    def identify(self, hashed: str) -> bool:
+        return hashed.startswith(("$2a$", "$2b$", "$2y$"))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return int(hashed.split("$")[2]) != self.rounds
+
+
+class Argon2Hasher(PasswordHasher):
+    """Argon2id (nécessite argon2-cffi)"""
+
+    scheme = "argon2"
+
+    def __init__(self):
+        from argon2 import PasswordHasher as Argon2PasswordHasher
+        from argon2.exceptions import InvalidHashError, VerificationError
+
+        self._hasher = Argon2PasswordHasher()
+        self._errors = (InvalidHashError, VerificationError)
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        try:
+            return self._hasher.verify(hashed, password)
+        except self._errors:
+            return False
+
+    def identify(self, hashed: str) -> bool:
+        return hashed.startswith("$argon2")
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return self._hasher.check_needs_rehash(hashed)
+
+
+HASHERS = {
+    "bcrypt": BcryptHasher,
+    "argon2": Argon2Hasher,
+}
+
+
+class PasswordContext:
+    """
+    Hachage avec l'algorithme courant, vérification avec tous les algorithmes connus
+
+    Un mot de passe vérifié contre un hash d'un autre algorithme (ou d'un
+    autre coût) est re-haché avec l'algorithme courant.
+    """
+
+    def __init__(self, default: PasswordHasher, legacy: List[PasswordHasher]):
+        self.default = default
+        self.hashers = [default] + legacy
+
+    def _hasher_for(self, hashed: str) -> Optional[PasswordHasher]:
+        for hasher in self.hashers:
+            if hasher.identify(hashed):
+                return hasher
+        return None
+
+    def hash(self, password: str) -> str:
+        return self.default.hash(password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        hasher = self._hasher_for(hashed or "")
+        return hasher is not None and hasher.verify(password, hashed)
+
+    def verify_and_update(
+        self, password: str, hashed: str
+    ) -> Tuple[bool, Optional[str]]:
+        """Vérifier un mot de passe ; renvoie aussi le nouveau hash s'il a changé"""
+        hasher = self._hasher_for(hashed or "")
+        if hasher is None or not hasher.verify(password, hashed):
+            return False, None
+        if hasher is not self.default or hasher.needs_rehash(hashed):
+            return True, self.default.hash(password)
+        return True, None
+
+
+def _create_context() -> PasswordContext:
+    if PASSWORD_HASHER not in HASHERS:
+        raise ValueError(f"Unknown password hasher: {PASSWORD_HASHER}")
+    default = HASHERS[PASSWORD_HASHER]()
+    legacy = []
+    for scheme, hasher in HASHERS.items():
+        if scheme == PASSWORD_HASHER:
+            continue
+        try:
+            legacy.append(hasher())
+        except ImportError:
+            # Algorithme dont la dépendance optionnelle n'est pas installée
+            continue
+    return PasswordContext(default, legacy + [Sha256Hasher()])
+
+
+password_context = _create_context()
+
+
+class HashingPool:
+    """
+    Pool borné de threads pour le hachage
+
+    bcrypt et argon2 libèrent le GIL pendant le calcul : les threads du pool
+    hachent en parallèle sans bloquer la boucle d'événements. Au-delà de
+    PASSWORD_HASH_QUEUE_LIMIT demandes en attente, les nouvelles sont
+    refusées plutôt que mises en file indéfiniment.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT,
+    ):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        self._pending = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _publish(self) -> None:
+        set_password_hash_queue(
+            queued=self._pending - self._running, running=self._running
+        )
+
+    def _call(self, operation: str, function, *args):
+        with self._lock:
+            self._running += 1
+            self._publish()
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            record_password_hash(operation, time.perf_counter() - started)
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._publish()
+
+    async def run(self, operation: str, function, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                record_password_hash(operation, rejected=True)
+                logger.warning(f"Password hashing queue full, rejecting {operation}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Trop de demandes d'authentification, réessayez plus tard",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+            self._publish()
+        future = self._executor.submit(self._call, operation, function, *args)
+        return await asyncio.wrap_future(future)
+
+
+hashing_pool = HashingPool()
+
+
+async def hash_password_async(password: str) -> str:
+    """Hacher un mot de passe sur le pool dédié"""
+    return await hashing_pool.run("hash", password_context.hash, password)
+
+
+async def verify_password_async(
+    password: str, hashed: str
+) -> Tuple[bool, Optional[str]]:
+    """Vérifier un mot de passe sur le pool dédié (avec le nouveau hash éventuel)"""
+    return await hashing_pool.run(
+        "verify", password_context.verify_and_update, password, hashed
+    )
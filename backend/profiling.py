@@ -0,0 +1,506 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
+
+from auth import authenticate_token
+from database import SessionLocal
+from logging_config import logger
+from jobs import PeriodicJob
+from monitoring import MetricsMiddleware, current_request_db_stats, route_template
+
+# Activer le middleware de profilage (sinon aucun coût par requête)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Profiler une requête sur N, tirée au hasard (0 : à la demande d'un administrateur)
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Intervalle entre deux échantillons de pile (millisecondes)
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "1"))
+# Répertoire et nombre maximal de profils conservés (les plus anciens sont supprimés)
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "library_profiles")
+)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# Échantillonnage continu : intervalle entre deux échantillons (ms, 0 : désactivé).
+# ~0,2 ms par échantillon, soit ~0,5 % à 50 ms (benchmarks/stack_sampler.py)
+STACK_SAMPLER_INTERVAL_MS = float(os.getenv("STACK_SAMPLER_INTERVAL_MS", "50"))
+# Durée d'une tranche d'agrégation et nombre de tranches conservées (1 h par défaut)
+STACK_SAMPLER_BUCKET_SECONDS = int(os.getenv("STACK_SAMPLER_BUCKET_SECONDS", "60"))
+STACK_SAMPLER_RETENTION = int(os.getenv("STACK_SAMPLER_RETENTION", "60"))
+# Piles distinctes par tranche au-delà desquelles les nouvelles piles sont regroupées
+STACK_SAMPLER_MAX_STACKS = int(os.getenv("STACK_SAMPLER_MAX_STACKS", "5000"))
+
+# Demande de profilage : en-tête "X-Profile: 1" ou paramètre "?profile=1"
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = re.compile(rb"(?:^|&)profile=(?:1|true)(?:&|$)")
+
+PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+
+def new_profile_id() -> str:
+    """Identifiant horodaté : l'ordre alphabétique est l'ordre chronologique"""
+    return f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+
+
+@functools.lru_cache(maxsize=8192)
+def _code_label(code) -> str:
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    location = (
+        "/".join(path[-2:])
+        if len(path) > 1 and "site-packages" not in path[-2]
+        else path[-1]
+    )
+    return f"{code.co_name} ({location}:{code.co_firstlineno})".replace(";", ",")
+
+
+def frame_label(frame) -> str:
+    """Nom d'une frame au format des piles repliées : fonction (paquet/fichier:ligne)"""
+    return _code_label(frame.f_code)
+
+
+def fold_stack(frames: List[Any]) -> str:
+    """Pile repliée (racine en premier, frames séparées par des points-virgules)"""
+    return ";".join(
+        frame if isinstance(frame, str) else frame_label(frame) for frame in frames
+    )
+
+
+def frames_to_root(frame, stop=None) -> List[Any]:
+    """Frames de la racine vers la feuille, en s'arrêtant (exclue) à stop"""
+    frames = []
+    while frame is not None and frame is not stop:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class ProfileStore:
+    """
+    Tampon circulaire de profils sur disque
+
+    Chaque profil est un fichier au format des piles repliées (flamegraph.pl,
+    speedscope, inferno) accompagné de ses métadonnées en JSON. Au-delà de
+    max_files profils, les plus anciens sont supprimés.
+    """
+
+    def __init__(
+        self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES
+    ):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        if not PROFILE_ID.match(profile_id):
+            raise HTTPException(status_code=404, detail="Profil non trouvé")
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(
+        self,
+        stacks: Dict[str, int],
+        metadata: Dict[str, Any],
+        profile_id: Optional[str] = None,
+    ) -> str:
+        profile_id = profile_id or new_profile_id()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            with open(self._path(profile_id, "folded"), "w") as folded:
+                for stack, count in sorted(stacks.items()):
+                    folded.write(f"{stack} {count}\n")
+            with open(self._path(profile_id, "json"), "w") as meta:
+                json.dump({"id": profile_id, **metadata}, meta)
+            for old_id in self._ids()[: -self.max_files]:
+                for extension in ("folded", "json"):
+                    try:
+                        os.remove(self._path(old_id, extension))
+                    except FileNotFoundError:
+                        pass
+        return profile_id
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[: -len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        )
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Métadonnées des profils conservés, du plus récent au plus ancien"""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, "json")) as meta:
+                    profiles.append(json.load(meta))
+            except (FileNotFoundError, ValueError):
+                continue
+        return profiles
+
+    def folded_path(self, profile_id: str) -> str:
+        """Chemin du fichier de piles repliées (404 s'il n'existe plus)"""
+        path = self._path(profile_id, "folded")
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Profil non trouvé")
+        return path
+
+
+profile_store = ProfileStore()
+
+
+def _callable_code(function) -> Optional[Any]:
+    while isinstance(function, functools.partial):
+        function = function.func
+    return getattr(getattr(function, "__func__", function), "__code__", None)
+
+
+def worker_context(frame) -> Optional[Any]:
+    """
+    Frame du pool de threads exécutant un contexte (contextvars), s'il y en a une
+
+    Les endpoints synchrones s'exécutent via context.run(func) dans la
+    frame run du pool d'anyio. Le thread ne sert la requête que pendant
+    l'appel de func : en attente du travail suivant ou en renvoyant le
+    résultat, il garde le contexte précédent, qui n'est alors pas compté.
+    """
+    callee = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "run" and "context" in code.co_varnames:
+            variables = frame.f_locals
+            if isinstance(variables.get("context"), contextvars.Context):
+                if callee is None or callee.f_code is not _callable_code(
+                    variables.get("func")
+                ):
+                    return None
+                return frame
+        callee = frame
+        frame = frame.f_back
+    return None
+
+
+# Profil de la requête en cours (hérité par les threads du pool qui la servent)
+_current_profile: contextvars.ContextVar[
+    Optional["RequestProfile"]
+] = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Profil statistique d'une requête
+
+    Un thread échantillonne sys._current_frames() à intervalle régulier et
+    ne garde que les piles qui servent cette requête : sur la boucle
+    d'événements, celles qui passent par la frame du middleware ; dans le
+    pool de threads, celles dont le contexte (contextvars) porte ce profil.
+    """
+
+    def __init__(self, marker, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.marker = marker
+        self.loop_thread = threading.get_ident()
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="request-profiler", daemon=True
+        )
+
+    def _served_by_worker(self, frame) -> Optional[Any]:
+        """Frame du pool de threads exécutant le contexte de cette requête, s'il y a"""
+        root = worker_context(frame)
+        if root is not None and root.f_locals["context"].get(_current_profile) is self:
+            return root
+        return None
+
+    def _sample(self) -> None:
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            if thread_id == self.loop_thread:
+                frames = frames_to_root(frame)
+                start = next(
+                    (index for index, item in enumerate(frames) if item is self.marker),
+                    None,
+                )
+                if start is None:
+                    continue
+                stack = frames[start:]
+            else:
+                root = self._served_by_worker(frame)
+                if root is None:
+                    continue
+                stack = frames_to_root(frame, stop=root)
+                if not stack:
+                    continue
+                stack = ["[threadpool]"] + stack
+            key = fold_stack(stack)
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _profile_requested(scope) -> Optional[str]:
+    """Token Bearer d'une requête qui demande un profil, s'il y en a un"""
+    headers = dict(scope.get("headers") or [])
+    if headers.get(PROFILE_HEADER) not in (b"1", b"true") and not PROFILE_QUERY.search(
+        scope.get("query_string", b"")
+    ):
+        return None
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token
+
+
+def _is_admin_token(token: str, session_factory) -> bool:
+    """
+    Le token est-il celui d'un administrateur ?
+
+    Mêmes vérifications que get_current_user (version du token, compte
+    actif) : un token révoqué ou d'un administrateur rétrogradé ne
+    déclenche pas de profil.
+    """
+    try:
+        return bool(authenticate_token(token, session_factory).is_admin)
+    except HTTPException:
+        return False
+    except SQLAlchemyError as e:
+        logger.error(f"Impossible de vérifier les droits de profilage : {e}")
+        return False
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI de profilage à la demande ou par échantillonnage
+
+    Une requête est profilée si un administrateur le demande (en-tête
+    X-Profile: 1 ou paramètre profile=1) ou, avec PROFILE_SAMPLE_RATE = N,
+    pour une requête sur N. Le profil est enregistré dans profile_store et
+    son identifiant renvoyé dans l'en-tête X-Profile-Id.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: int = PROFILE_SAMPLE_RATE,
+        store: ProfileStore = None,
+        session_factory=SessionLocal,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.store = store or profile_store
+        self.session_factory = session_factory
+
+    async def _should_profile(self, scope) -> Optional[str]:
+        token = _profile_requested(scope)
+        if token is not None and await run_in_threadpool(
+            _is_admin_token, token, self.session_factory
+        ):
+            return "admin"
+        if self.sample_rate > 0 and random.randrange(self.sample_rate) == 0:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = await self._should_profile(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(sys._getframe())
+        profile_id = new_profile_id()
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-id", profile_id.encode()),
+                    ],
+                }
+            await send(message)
+
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            duration = time.perf_counter() - started
+            _current_profile.reset(token)
+            metadata = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "endpoint": route_template(scope),
+                "status_code": status_code,
+                "trigger": trigger,
+                "duration_ms": round(duration * 1000, 3),
+                "samples": profile.samples,
+                "created_at": time.time(),
+            }
+            try:
+                self.store.save(profile.stacks, metadata, profile_id=profile_id)
+            except OSError as e:
+                logger.error(f"Impossible d'enregistrer le profil {profile_id} : {e}")
+
+
+class StackSampler:
+    """
+    Échantillonneur de piles continu, agrégé par route
+
+    À chaque échantillon, les threads qui servent une requête (boucle
+    d'événements sous MetricsMiddleware, ou pool de threads dont le
+    contexte porte la requête) sont rattachés à leur route, sous la forme
+    "GET /books/{isbn}". Les piles repliées sont comptées par tranches de
+    bucket_seconds ; seules les retention dernières tranches sont gardées.
+    Chaque worker échantillonne ses propres threads.
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int = STACK_SAMPLER_BUCKET_SECONDS,
+        retention: int = STACK_SAMPLER_RETENTION,
+        max_stacks: int = STACK_SAMPLER_MAX_STACKS,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention
+        self.max_stacks = max_stacks
+        self.samples = 0
+        # Début de tranche -> {(route, pile repliée): échantillons}
+        self._buckets: Dict[int, Dict[Any, int]] = {}
+        self._lock = threading.Lock()
+        self._middleware_code = MetricsMiddleware.__call__.__code__
+
+    def _request_stack(self, frame):
+        """(route, frames servant la requête) pour la pile d'un thread, ou None"""
+        frames = frames_to_root(frame)
+        for index, item in enumerate(frames):
+            if item.f_code is self._middleware_code:
+                scope = item.f_locals.get("scope")
+                if scope is None or scope.get("type") != "http":
+                    return None
+                return f"{scope['method']} {route_template(scope)}", frames[index + 1 :]
+
+        root = worker_context(frame)
+        if root is None:
+            return None
+        stats = root.f_locals["context"].get(current_request_db_stats)
+        if stats is None:
+            return None
+        return stats.endpoint, ["[threadpool]"] + frames_to_root(frame, stop=root)
+
+    def sample(self, now: Optional[float] = None) -> int:
+        """Échantillonner tous les threads ; renvoie le nombre de piles retenues"""
+        own_thread = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            request = self._request_stack(frame)
+            if request is not None and request[1]:
+                stacks.append((request[0], fold_stack(request[1])))
+        if not stacks:
+            return 0
+
+        bucket_start = (
+            int(now if now is not None else time.time())
+            // self.bucket_seconds
+            * self.bucket_seconds
+        )
+        with self._lock:
+            bucket = self._buckets.get(bucket_start)
+            if bucket is None:
+                bucket = self._buckets[bucket_start] = {}
+                for old_start in sorted(self._buckets)[: -self.retention]:
+                    del self._buckets[old_start]
+            for key in stacks:
+                if key not in bucket and len(bucket) >= self.max_stacks:
+                    key = (key[0], "[truncated]")
+                bucket[key] = bucket.get(key, 0) + 1
+            self.samples += len(stacks)
+        return len(stacks)
+
+    def export(
+        self, window: float, endpoint: Optional[str] = None, now: Optional[float] = None
+    ) -> Dict[str, int]:
+        """
+        Piles repliées des window dernières secondes
+
+        Sans endpoint, la route est la racine de chaque pile : le flamegraph
+        présente une branche par route.
+        """
+        since = (now if now is not None else time.time()) - window
+        stacks: Dict[str, int] = {}
+        with self._lock:
+            buckets = [
+                bucket
+                for start, bucket in self._buckets.items()
+                if start + self.bucket_seconds > since
+            ]
+            for bucket in buckets:
+                for (route, stack), count in bucket.items():
+                    if endpoint is not None:
+                        if route != endpoint:
+                            continue
+                        key = stack
+                    else:
+                        key = f"{route.replace(';', ',')};{stack}"
+                    stacks[key] = stacks.get(key, 0) + count
+        return stacks
+
+    def endpoints(self, window: float, now: Optional[float] = None) -> Dict[str, int]:
+        """Échantillons par route sur les window dernières secondes"""
+        counts: Dict[str, int] = {}
+        for stack, count in self.export(window, now=now).items():
+            route = stack.split(";", 1)[0]
+            counts[route] = counts.get(route, 0) + count
+        return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self.samples = 0
+
+
+stack_sampler = StackSampler()
+continuous_profiler = PeriodicJob(
+    "stack-sampler", STACK_SAMPLER_INTERVAL_MS / 1000, stack_sampler.sample
+)
@@ -0,0 +1,218 @@
+import random
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from database import dialect_insert
+from logging_config import logger
+from models import AuthorStatsModel, BookModel, LibraryStatsModel
+
+# Nombre de lignes sur lesquelles les compteurs globaux sont répartis :
+# deux transactions concurrentes touchent rarement le même slot, ce qui
+# évite qu'un seul compteur ne sérialise tous les emprunts.
+STATS_SLOTS = 16
+
+
+def _author_key(author: Optional[str]) -> str:
+    """Clé de l'auteur dans la table de statistiques"""
+    return author or ""
+
+
+def record_stock_change(
+    db: Session,
+    stock_delta: int = 0,
+    books_delta: int = 0,
+    titles_changed: bool = False,
+) -> None:
+    """
+    Appliquer une variation aux compteurs globaux
+
+    Chaque appel correspond à une modification du catalogue et incrémente
+    sa version ; titles_changed incrémente aussi la version des titres et
+    auteurs (ajout, modification, suppression de livres). La mise à jour est
+    exécutée dans la transaction de la session : elle est validée ou annulée
+    avec l'écriture qui l'a provoquée.
+    """
+    titles_delta = 1 if titles_changed else 0
+    statement = dialect_insert(db, LibraryStatsModel).values(
+        slot=random.randrange(STATS_SLOTS),
+        total_books=books_delta,
+        total_books_in_stock=stock_delta,
+        catalog_version=1,
+        titles_version=titles_delta,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[LibraryStatsModel.slot],
+        set_={
+            "total_books": LibraryStatsModel.total_books + books_delta,
+            "total_books_in_stock": LibraryStatsModel.total_books_in_stock
+            + stock_delta,
+            "catalog_version": LibraryStatsModel.catalog_version + 1,
+            "titles_version": LibraryStatsModel.titles_version + titles_delta,
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(statement)
+
+
+def record_author_changes(db: Session, deltas: Dict[Optional[str], int]) -> None:
+    """Appliquer en une requête les variations du nombre de livres par auteur"""
+    changes = {}
+    for author, delta in deltas.items():
+        key = _author_key(author)
+        changes[key] = changes.get(key, 0) + delta
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+
+    statement = dialect_insert(db, AuthorStatsModel).values(
+        [{"author": key, "book_count": delta} for key, delta in changes.items()]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[AuthorStatsModel.author],
+        set_={
+            "book_count": AuthorStatsModel.book_count + statement.excluded.book_count
+        },
+    )
+    db.execute(statement)
+
+    removed = [key for key, delta in changes.items() if delta < 0]
+    if removed:
+        db.query(AuthorStatsModel).filter(
+            AuthorStatsModel.author.in_(removed), AuthorStatsModel.book_count <= 0
+        ).delete(synchronize_session=False)
+
+
+def record_author_change(db: Session, author: Optional[str], delta: int) -> None:
+    """Appliquer une variation au nombre de livres d'un auteur"""
+    record_author_changes(db, {author: delta})
+
+
+def record_book_created(db: Session, author: Optional[str], quantity: int) -> None:
+    """Mettre à jour les statistiques après l'ajout d'un livre"""
+    record_stock_change(
+        db, stock_delta=quantity or 0, books_delta=1, titles_changed=True
+    )
+    record_author_change(db, author, 1)
+
+
+def record_book_updated(
+    db: Session,
+    old_author: Optional[str],
+    old_quantity: int,
+    new_author: Optional[str],
+    new_quantity: int,
+) -> None:
+    """Mettre à jour les statistiques après la modification d'un livre"""
+    record_stock_change(
+        db,
+        stock_delta=(new_quantity or 0) - (old_quantity or 0),
+        titles_changed=True,
+    )
+    if _author_key(old_author) != _author_key(new_author):
+        record_author_changes(db, {old_author: -1, new_author: 1})
+
+
+def record_book_deleted(db: Session, author: Optional[str], quantity: int) -> None:
+    """Mettre à jour les statistiques après la suppression d'un livre"""
+    record_stock_change(
+        db, stock_delta=-(quantity or 0), books_delta=-1, titles_changed=True
+    )
+    record_author_change(db, author, -1)
+
+
+def get_catalog_version(db: Session) -> Tuple[int, Optional[datetime]]:
+    """Version courante du catalogue et date de sa dernière modification"""
+    version, updated_at = db.query(
+        func.coalesce(func.sum(LibraryStatsModel.catalog_version), 0),
+        func.max(LibraryStatsModel.updated_at),
+    ).one()
+    return version, updated_at
+
+
+def get_titles_version(db: Session) -> int:
+    """Version des titres et auteurs du catalogue"""
+    return db.query(
+        func.coalesce(func.sum(LibraryStatsModel.titles_version), 0)
+    ).scalar()
+
+
+def get_library_stats(db: Session) -> Dict[str, Any]:
+    """Lire les statistiques depuis les compteurs agrégés"""
+    total_books, total_books_in_stock = db.query(
+        func.coalesce(func.sum(LibraryStatsModel.total_books), 0),
+        func.coalesce(func.sum(LibraryStatsModel.total_books_in_stock), 0),
+    ).one()
+
+    books_by_author = (
+        db.query(AuthorStatsModel.author, AuthorStatsModel.book_count)
+        .order_by(AuthorStatsModel.author)
+        .all()
+    )
+
+    return {
+        "total_books": total_books,
+        "books_by_author": [
+            {"author": author, "count": count} for author, count in books_by_author
+        ],
+        "total_books_in_stock": total_books_in_stock,
+    }
+
+
+def rebuild_library_stats(db: Session) -> Dict[str, Any]:
+    """
+    Recalculer entièrement les statistiques depuis la table des livres
+
+    Sert à corriger une dérive des compteurs. Sur PostgreSQL, les écritures
+    sur les livres et les compteurs sont bloquées le temps du recalcul pour
+    que les compteurs repartent d'un état cohérent.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE books IN SHARE MODE"))
+        db.execute(text("LOCK TABLE library_stats, author_stats IN EXCLUSIVE MODE"))
+
+    # Les versions doivent continuer de croître après le recalcul
+    catalog_version, _ = get_catalog_version(db)
+    titles_version = get_titles_version(db)
+
+    total_books = db.query(func.count(BookModel.id)).scalar() or 0
+    total_books_in_stock = db.query(
+        func.coalesce(func.sum(BookModel.quantity), 0)
+    ).scalar()
+    books_by_author = (
+        db.query(func.coalesce(BookModel.author, ""), func.count(BookModel.id))
+        .group_by(func.coalesce(BookModel.author, ""))
+        .all()
+    )
+
+    db.query(LibraryStatsModel).delete(synchronize_session=False)
+    db.query(AuthorStatsModel).delete(synchronize_session=False)
+
+    db.add(
+        LibraryStatsModel(
+            slot=0,
+            total_books=total_books,
+            total_books_in_stock=total_books_in_stock,
+            catalog_version=catalog_version + 1,
+            titles_version=titles_version,
+        )
+    )
+    db.add_all(
+        AuthorStatsModel(author=author, book_count=count)
+        for author, count in books_by_author
+    )
+    db.commit()
+
+    logger.info(
+        f"Library statistics rebuilt: {total_books} books, "
+        f"{len(books_by_author)} authors"
+    )
+    return get_library_stats(db)
+
+
+def ensure_library_stats(db: Session) -> None:
+    """Initialiser les compteurs s'ils n'ont jamais été calculés"""
+    if db.query(LibraryStatsModel.slot).first() is None:
+        rebuild_library_stats(db)
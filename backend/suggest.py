@@ -0,0 +1,227 @@
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+
+from database import SessionLocal
+from jobs import PeriodicJob
+from logging_config import logger
+from models import BookModel
+from stats import get_titles_version
+
+# Nombre de suggestions par défaut et maximal
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+
+# Intervalle de vérification de la version des titres (secondes, 0 pour désactiver) :
+# les livres modifiés par les autres workers sont pris en compte à ce rythme
+SUGGEST_REFRESH_INTERVAL = float(os.getenv("SUGGEST_REFRESH_INTERVAL", "30"))
+
+# Champs indexés pour l'autocomplétion
+SUGGEST_FIELDS = ("title", "author")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Découper un texte en mots normalisés (minuscules, sans accents)"""
+    if not text:
+        return []
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(char for char in normalized if not unicodedata.combining(char))
+    return _TOKEN_RE.findall(stripped)
+
+
+class SuggestionIndex:
+    """
+    Index de préfixes en mémoire pour l'autocomplétion des livres
+
+    Les mots des titres et des auteurs sont conservés dans une liste triée
+    de tuples (mot, book_id, champ) : une recherche par préfixe est une
+    dichotomie suivie d'un parcours des entrées contiguës, sans requête SQL.
+    L'index est propre au processus : les endpoints qui modifient les
+    livres le tiennent à jour immédiatement, et il est reconstruit
+    périodiquement quand la version des titres et auteurs a changé, pour
+    les écritures faites par les autres workers (les emprunts et retours ne
+    la changent pas).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: List[Tuple[str, int, str]] = []
+        self._books: Dict[int, Dict[str, object]] = {}
+        # Version des titres lue avant la dernière reconstruction
+        self.titles_version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._books)
+
+    def build(self, books) -> None:
+        """Reconstruire entièrement l'index à partir d'une liste de livres"""
+        entries = []
+        documents = {}
+        for book in books:
+            document = self._document(book)
+            documents[book.id] = document
+            entries.extend(self._entries_for(book.id, document))
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._books = documents
+
+    def add(self, book) -> None:
+        """Ajouter (ou remplacer) un livre dans l'index"""
+        document = self._document(book)
+        with self._lock:
+            self._remove_locked(book.id)
+            self._books[book.id] = document
+            for entry in self._entries_for(book.id, document):
+                insort(self._entries, entry)
+
+    def add_many(self, books) -> None:
+        """
+        Ajouter un ensemble de livres en une seule fusion
+
+        Plus efficace que des ajouts unitaires pour les imports en masse :
+        la liste est triée une seule fois (deux séquences déjà triées).
+        """
+        documents = {book.id: self._document(book) for book in books}
+        if not documents:
+            return
+        entries = sorted(
+            entry
+            for book_id, document in documents.items()
+            for entry in self._entries_for(book_id, document)
+        )
+        with self._lock:
+            for book_id in documents:
+                self._remove_locked(book_id)
+            self._books.update(documents)
+            self._entries.extend(entries)
+            self._entries.sort()
+
+    def remove(self, book_id: int) -> None:
+        """Retirer un livre de l'index"""
+        with self._lock:
+            self._remove_locked(book_id)
+
+    def suggest(
+        self, prefix: str, limit: int = DEFAULT_SUGGESTIONS
+    ) -> List[Dict[str, str]]:
+        """
+        Retourner au plus `limit` suggestions pour un préfixe
+
+        Le dernier mot saisi est traité comme un préfixe, les mots précédents
+        doivent apparaître en entier dans le même champ.
+        """
+        terms = tokenize(prefix)
+        if not terms:
+            return []
+        *complete_terms, partial = terms
+
+        suggestions = []
+        seen = set()
+        with self._lock:
+            if complete_terms:
+                # Parcourir les occurrences exactes du mot complet le plus rare
+                start, end = min(
+                    (self._token_range(term) for term in complete_terms),
+                    key=lambda bounds: bounds[1] - bounds[0],
+                )
+            else:
+                start, end = bisect_left(self._entries, (partial,)), len(self._entries)
+
+            for position in range(start, end):
+                if len(suggestions) >= limit:
+                    break
+                token, book_id, field = self._entries[position]
+                if not complete_terms and not token.startswith(partial):
+                    break
+
+                document = self._books[book_id]
+                field_tokens = document["tokens"][field]
+                if complete_terms and not (
+                    all(term in field_tokens for term in complete_terms)
+                    and any(candidate.startswith(partial) for candidate in field_tokens)
+                ):
+                    continue
+
+                text = document[field]
+                if (field, text) in seen:
+                    continue
+                seen.add((field, text))
+                suggestions.append(
+                    {"text": text, "field": field, "isbn": document["isbn"]}
+                )
+
+        return suggestions
+
+    def _token_range(self, token: str) -> Tuple[int, int]:
+        """Bornes des entrées correspondant exactement à un mot"""
+        start = bisect_left(self._entries, (token,))
+        end = bisect_left(self._entries, (token + "\0",), start)
+        return start, end
+
+    @staticmethod
+    def _document(book) -> Dict[str, object]:
+        """Extraire d'un livre les données conservées par l'index"""
+        return {
+            "title": book.title or "",
+            "author": book.author or "",
+            "isbn": book.isbn,
+            "tokens": {
+                field: set(tokenize(getattr(book, field))) for field in SUGGEST_FIELDS
+            },
+        }
+
+    @staticmethod
+    def _entries_for(book_id: int, document: Dict[str, object]):
+        """Générer les entrées triables d'un livre"""
+        tokens: Dict[str, Set[str]] = document["tokens"]
+        for field in SUGGEST_FIELDS:
+            for token in tokens[field]:
+                yield (token, book_id, field)
+
+    def _remove_locked(self, book_id: int) -> None:
+        """Retirer les entrées d'un livre (le verrou doit être détenu)"""
+        document = self._books.pop(book_id, None)
+        if document is None:
+            return
+        for entry in self._entries_for(book_id, document):
+            position = bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+
+# Instance globale
+suggestion_index = SuggestionIndex()
+
+
+def build_suggestion_index(db) -> None:
+    """Charger l'index d'autocomplétion depuis la base de données"""
+    # Version lue avant les livres : une écriture concurrente déclenchera
+    # la reconstruction suivante
+    titles_version = get_titles_version(db)
+    books = db.query(
+        BookModel.id, BookModel.title, BookModel.author, BookModel.isbn
+    ).yield_per(1000)
+    suggestion_index.build(books)
+    suggestion_index.titles_version = titles_version
+    logger.info(f"Suggestion index built with {len(suggestion_index)} books")
+
+
+def refresh_suggestion_index(session_factory=SessionLocal) -> bool:
+    """Reconstruire l'index si des titres ou auteurs ont changé depuis la dernière"""
+    with session_factory() as db:
+        if get_titles_version(db) == suggestion_index.titles_version:
+            return False
+        build_suggestion_index(db)
+    return True
+
+
+suggestion_index_refresher = PeriodicJob(
+    "suggestion-index", SUGGEST_REFRESH_INTERVAL, refresh_suggestion_index
+)
@@ -4,7 +4,8 @@ Test de connexion à PostgreSQL
 """
 
 try:
-    from database import engine
+    from database import get_engine
+    engine = get_engine()
     print(f"✅ Connexion PostgreSQL réussie: {engine.url}")
     
     # Test de connexion réelle
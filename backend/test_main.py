@@ -1,23 +1,65 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+# Coût bcrypt minimal pour des tests rapides
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, false, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, StaticPool
 
-from main import app, Base
-from database import get_db, BookModel
+from main import app
+from database import (
+    get_db,
+    BookModel,
+    ReadYourWritesMiddleware,
+    Replica,
+    ReplicaRouter,
+    replica_router,
+)
+from async_database import get_async_db, to_async_url
+from async_routes import use_async_routes
+from auth import (
+    create_access_token,
+    decode_access_token,
+    update_user_access,
+    user_cache,
+)
+from models import Base, UserModel
+from stats import rebuild_library_stats
+from suggest import suggestion_index
+from passwords import HashingPool
+from loans import checkout_book, return_loan
+from overdue import sweep_overdue_loans
+from partitions import archive_returned_loans
+from migrations import MIGRATIONS, upgrade
+from models import LoanArchiveModel, LoanModel
 
 # Configuration de la base de données de test
 TEST_DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(
-    TEST_DATABASE_URL, 
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool
+    TEST_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Créer les tables de test
 Base.metadata.create_all(bind=engine)
 
+
 # Remplacer la dépendance de base de données par une session de test
 def override_get_db():
     try:
@@ -26,28 +68,47 @@ def override_get_db():
     finally:
         db.close()
 
+
 app.dependency_overrides[get_db] = override_get_db
 
 # Créer un client de test
 client = TestClient(app)
 
+
+def get_auth_headers(username: str = "testuser"):
+    """Créer un utilisateur de test et retourner les en-têtes d'authentification"""
+    password = "testpassword123"
+    client.post(
+        "/users/",
+        json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": password,
+        },
+    )
+    response = client.post("/token", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
 def test_create_book():
     """Test de création d'un nouveau livre"""
     # Supprimer tous les livres existants avant le test
     with TestingSessionLocal() as db:
         db.query(BookModel).delete()
         db.commit()
+    headers = get_auth_headers()
 
     # Données de test pour un nouveau livre
     book_data = {
         "title": "Test Book",
         "author": "Test Author",
         "isbn": "1234567890",
-        "quantity": 5
+        "quantity": 5,
     }
 
     # Tester la création du livre
-    response = client.post("/books", json=book_data)
+    response = client.post("/books", json=book_data, headers=headers)
     assert response.status_code == 200
     data = response.json()
     assert data["title"] == book_data["title"]
@@ -55,79 +116,75 @@ def test_create_book():
     assert data["isbn"] == book_data["isbn"]
     assert data["quantity"] == book_data["quantity"]
 
+
 def test_create_duplicate_book():
     """Test de création d'un livre avec un ISBN existant"""
     # Supprimer tous les livres existants avant le test
     with TestingSessionLocal() as db:
         db.query(BookModel).delete()
         db.commit()
+    headers = get_auth_headers()
 
     # Données de test pour un nouveau livre
     book_data = {
         "title": "Test Book",
         "author": "Test Author",
         "isbn": "1234567890",
-        "quantity": 5
+        "quantity": 5,
     }
 
     # Créer un premier livre
-    response = client.post("/books", json=book_data)
+    response = client.post("/books", json=book_data, headers=headers)
     assert response.status_code == 200
 
     # Essayer de créer un livre avec le même ISBN
-    response = client.post("/books", json=book_data)
+    response = client.post("/books", json=book_data, headers=headers)
     assert response.status_code == 400
     assert "already exists" in response.json()["detail"]
 
+
 def test_get_books():
     """Test de récupération de la liste des livres"""
     # Supprimer tous les livres existants avant le test
     with TestingSessionLocal() as db:
         db.query(BookModel).delete()
         db.commit()
+    headers = get_auth_headers()
 
     # Créer quelques livres de test
     books_data = [
-        {
-            "title": "Book 1",
-            "author": "Author 1",
-            "isbn": "1111111111",
-            "quantity": 3
-        },
-        {
-            "title": "Book 2",
-            "author": "Author 2",
-            "isbn": "2222222222",
-            "quantity": 5
-        }
+        {"title": "Book 1", "author": "Author 1", "isbn": "1111111111", "quantity": 3},
+        {"title": "Book 2", "author": "Author 2", "isbn": "2222222222", "quantity": 5},
     ]
 
     # Ajouter les livres
     for book_data in books_data:
-        response = client.post("/books", json=book_data)
+        response = client.post("/books", json=book_data, headers=headers)
         assert response.status_code == 200
 
     # Récupérer la liste des livres
-    response = client.get("/books")
+    response = client.get("/books", headers=headers)
     assert response.status_code == 200
-    books = response.json()
+    books = response.json()["items"]
     assert len(books) >= 2
 
+
 def test_update_book():
     """Test de mise à jour d'un livre"""
     # Supprimer tous les livres existants avant le test
     with TestingSessionLocal() as db:
         db.query(BookModel).delete()
         db.commit()
+    headers = get_auth_headers()
 
     # Créer un livre initial
     initial_book = {
         "title": "Original Book",
         "author": "Original Author",
         "isbn": "1234567890",
-        "quantity": 5
+        "quantity": 5,
     }
-    response = client.post("/books", json=initial_book)
+    response = client.post("/books", json=initial_book, headers=headers)
     assert response.status_code == 200
 
     # Données de mise à jour
@@ -135,39 +192,1694 @@ def test_update_book():
         "title": "Updated Book",
         "author": "Updated Author",
         "isbn": "1234567890",
-        "quantity": 10
+        "quantity": 10,
     }
 
     # Mettre à jour le livre
-    response = client.put("/books/1234567890", json=updated_book)
+    response = client.put("/books/1234567890", json=updated_book, headers=headers)
     assert response.status_code == 200
     data = response.json()
     assert data["title"] == updated_book["title"]
     assert data["author"] == updated_book["author"]
     assert data["quantity"] == updated_book["quantity"]
 
+
 def test_delete_book():
     """Test de suppression d'un livre"""
     # Supprimer tous les livres existants avant le test
     with TestingSessionLocal() as db:
         db.query(BookModel).delete()
         db.commit()
+    headers = get_auth_headers()
 
     # Créer un livre à supprimer
     book_data = {
         "title": "Book to Delete",
         "author": "Delete Author",
         "isbn": "9876543210",
-        "quantity": 3
+        "quantity": 3,
     }
-    response = client.post("/books", json=book_data)
+    response = client.post("/books", json=book_data, headers=headers)
     assert response.status_code == 200
 
     # Supprimer le livre
-    response = client.delete("/books/9876543210")
+    response = client.delete("/books/9876543210", headers=headers)
     assert response.status_code == 200
     assert response.json()["message"] == "Book deleted successfully"
 
     # Vérifier que le livre n'existe plus
-    response = client.get("/books/9876543210")
+    response = client.get("/books/9876543210", headers=headers)
     assert response.status_code == 404
+
+
+def test_list_books_pagination():
+    """Test de la pagination par curseur de la liste des livres"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+
+    headers = get_auth_headers()
+    for i in range(5):
+        book_data = {
+            "title": f"Paged Book {4 - i}",
+            "author": "Page Author",
+            "isbn": f"555000000{i}",
+            "quantity": 1,
+        }
+        response = client.post("/books", json=book_data, headers=headers)
+        assert response.status_code == 200
+
+    # Parcourir toutes les pages triées par titre
+    titles = []
+    response = client.get(
+        "/books", params={"limit": 2, "sort": "title"}, headers=headers
+    )
+    while True:
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 2
+        titles.extend(book["title"] for book in page["items"])
+        if not page["next_cursor"]:
+            assert page["next"] is None
+            break
+        response = client.get(page["next"], headers=headers)
+
+    assert titles == [f"Paged Book {i}" for i in range(5)]
+
+    # Un curseur invalide est rejeté
+    response = client.get("/books", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_export_books():
+    """Test de l'export du catalogue en NDJSON et CSV"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+
+    headers = get_auth_headers()
+    for i in range(3):
+        book_data = {
+            "title": f"Export Book {i}",
+            "author": "Export Author",
+            "isbn": f"777000000{i}",
+            "quantity": i,
+        }
+        response = client.post("/books", json=book_data, headers=headers)
+        assert response.status_code == 200
+
+    # Export NDJSON : un objet JSON par ligne
+    response = client.get("/books/export", params={"format": "ndjson"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.strip().split("\n")
+    assert len(lines) == 3
+    assert json.loads(lines[0])["title"] == "Export Book 0"
+
+    # Export CSV : en-tête puis une ligne par livre
+    response = client.get("/books/export", params={"format": "csv"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "title", "author", "isbn", "quantity"]
+    assert [row[3] for row in rows[1:]] == ["7770000000", "7770000001", "7770000002"]
+
+
+def test_search_books():
+    """Test de la recherche de livres avec filtres et pagination"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+
+    headers = get_auth_headers()
+    books_data = [
+        {
+            "title": "Python Basics",
+            "author": "Alice Martin",
+            "isbn": "3330000001",
+            "quantity": 1,
+        },
+        {
+            "title": "Advanced Python",
+            "author": "Bob Durand",
+            "isbn": "3330000002",
+            "quantity": 5,
+        },
+        {
+            "title": "Rust in Action",
+            "author": "Carl Python",
+            "isbn": "3330000003",
+            "quantity": 8,
+        },
+        {
+            "title": "Go Programming",
+            "author": "Dana Smith",
+            "isbn": "3330000004",
+            "quantity": 2,
+        },
+    ]
+    for book_data in books_data:
+        response = client.post("/books", json=book_data, headers=headers)
+        assert response.status_code == 200
+
+    # La route de recherche n'est plus masquée par /books/{isbn}
+    response = client.get(
+        "/books/search", params={"query": "python", "limit": 2}, headers=headers
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["items"]) == 2
+    assert page["next_cursor"] is not None
+
+    response = client.get(page["next"], headers=headers)
+    assert response.status_code == 200
+    assert [book["isbn"] for book in response.json()["items"]] == ["3330000003"]
+
+    # Les filtres de quantité s'appliquent toujours
+    response = client.get(
+        "/books/search",
+        params={"query": "python", "min_quantity": 2, "max_quantity": 6},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert [book["title"] for book in response.json()["items"]] == ["Advanced Python"]
+
+
+def test_suggest_books():
+    """Test de l'autocomplétion sur les titres et les auteurs"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+    suggestion_index.build([])
+
+    headers = get_auth_headers()
+    books_data = [
+        {
+            "title": "Clean Code",
+            "author": "Robert Martin",
+            "isbn": "4440000001",
+            "quantity": 1,
+        },
+        {
+            "title": "Clean Architecture",
+            "author": "Robert Martin",
+            "isbn": "4440000002",
+            "quantity": 1,
+        },
+        {
+            "title": "Refactoring",
+            "author": "Martin Fowler",
+            "isbn": "4440000003",
+            "quantity": 1,
+        },
+    ]
+    for book_data in books_data:
+        response = client.post("/books", json=book_data, headers=headers)
+        assert response.status_code == 200
+
+    response = client.get("/books/suggest", params={"prefix": "cle"}, headers=headers)
+    assert response.status_code == 200
+    assert sorted(item["text"] for item in response.json()) == [
+        "Clean Architecture",
+        "Clean Code",
+    ]
+
+    # Plusieurs mots : les premiers doivent être complets
+    response = client.get(
+        "/books/suggest", params={"prefix": "clean co"}, headers=headers
+    )
+    assert [item["text"] for item in response.json()] == ["Clean Code"]
+
+    # Les auteurs sont suggérés une seule fois
+    response = client.get("/books/suggest", params={"prefix": "mart"}, headers=headers)
+    assert sorted((item["field"], item["text"]) for item in response.json()) == [
+        ("author", "Martin Fowler"),
+        ("author", "Robert Martin"),
+    ]
+
+    # L'index suit les mises à jour et les suppressions
+    updated = dict(books_data[0], title="Dirty Code")
+    assert (
+        client.put("/books/4440000001", json=updated, headers=headers).status_code
+        == 200
+    )
+    assert client.delete("/books/4440000002", headers=headers).status_code == 200
+    response = client.get("/books/suggest", params={"prefix": "cle"}, headers=headers)
+    assert response.json() == []
+
+    # Livre ajouté par un autre worker : pris en compte au changement de version
+    from stats import record_book_created, record_stock_change
+    from suggest import refresh_suggestion_index
+
+    assert refresh_suggestion_index(TestingSessionLocal) is True
+    assert refresh_suggestion_index(TestingSessionLocal) is False
+    # Emprunts et retours : titres inchangés, pas de reconstruction
+    with TestingSessionLocal() as db:
+        record_stock_change(db, stock_delta=-1)
+        record_stock_change(db, stock_delta=1)
+        db.commit()
+    assert refresh_suggestion_index(TestingSessionLocal) is False
+    with TestingSessionLocal() as db:
+        db.add(
+            BookModel(
+                title="Clean Agile",
+                author="Robert Martin",
+                isbn="4440000004",
+                quantity=1,
+            )
+        )
+        record_book_created(db, "Robert Martin", 1)
+        db.commit()
+    assert (
+        client.get("/books/suggest", params={"prefix": "cle"}, headers=headers).json()
+        == []
+    )
+    assert refresh_suggestion_index(TestingSessionLocal) is True
+    response = client.get("/books/suggest", params={"prefix": "cle"}, headers=headers)
+    assert [item["text"] for item in response.json()] == ["Clean Agile"]
+
+
+def test_book_statistics():
+    """Test des statistiques maintenues lors des écritures et de leur recalcul"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+        rebuild_library_stats(db)
+
+    headers = get_auth_headers("statsadmin")
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "statsadmin").update(
+            {"is_admin": True}
+        )
+        db.commit()
+
+    books_data = [
+        {
+            "title": "Stats Book 1",
+            "author": "Stats Author",
+            "isbn": "6660000001",
+            "quantity": 2,
+        },
+        {
+            "title": "Stats Book 2",
+            "author": "Stats Author",
+            "isbn": "6660000002",
+            "quantity": 3,
+        },
+        {
+            "title": "Stats Book 3",
+            "author": "Other Author",
+            "isbn": "6660000003",
+            "quantity": 4,
+        },
+    ]
+    for book_data in books_data:
+        response = client.post("/books", json=book_data, headers=headers)
+        assert response.status_code == 200
+
+    # Changement d'auteur et de quantité, puis suppression
+    updated = dict(books_data[1], author="Other Author", quantity=1)
+    assert (
+        client.put("/books/6660000002", json=updated, headers=headers).status_code
+        == 200
+    )
+    assert client.delete("/books/6660000001", headers=headers).status_code == 200
+
+    expected = {
+        "total_books": 2,
+        "books_by_author": [{"author": "Other Author", "count": 2}],
+        "total_books_in_stock": 5,
+    }
+    response = client.get("/books/stats", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == expected
+
+    # Le recalcul complet donne le même résultat
+    response = client.post("/books/stats/rebuild", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_conditional_get_books():
+    """Test des requêtes conditionnelles (ETag / Last-Modified) sur les livres"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+
+    headers = get_auth_headers()
+    book_data = {
+        "title": "Cached Book",
+        "author": "Cache Author",
+        "isbn": "8880000001",
+        "quantity": 2,
+    }
+    assert client.post("/books", json=book_data, headers=headers).status_code == 200
+
+    # Liste : 304 tant que le catalogue n'a pas changé
+    response = client.get("/books", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get("/books", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # Livre : 304 avec l'ETag seulement
+    response = client.get("/books/8880000001", headers=headers)
+    assert response.status_code == 200
+    book_etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    response = client.get(
+        "/books/8880000001", headers={**headers, "If-None-Match": book_etag}
+    )
+    assert response.status_code == 304
+    # If-Modified-Since ignoré : une écriture dans la même seconde serait masquée
+    response = client.get(
+        "/books/8880000001", headers={**headers, "If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 200
+
+    # Une modification invalide l'ETag
+    updated = dict(book_data, quantity=7)
+    assert (
+        client.put("/books/8880000001", json=updated, headers=headers).status_code
+        == 200
+    )
+    response = client.get("/books", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    response = client.get(
+        "/books/8880000001", headers={**headers, "If-None-Match": book_etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 7
+
+
+def test_bulk_create_books():
+    """Test de l'import en masse en JSON, NDJSON et CSV"""
+    with TestingSessionLocal() as db:
+        db.query(BookModel).delete()
+        db.commit()
+        rebuild_library_stats(db)
+
+    headers = get_auth_headers()
+    existing = {
+        "title": "Existing Book",
+        "author": "Bulk Author",
+        "isbn": "9990000000",
+        "quantity": 1,
+    }
+    assert client.post("/books", json=existing, headers=headers).status_code == 200
+
+    # Tableau JSON : création, doublon en base, doublon interne, ligne invalide
+    rows = [
+        {
+            "title": "Bulk Book 1",
+            "author": "Bulk Author",
+            "isbn": "9990000001",
+            "quantity": 2,
+        },
+        {
+            "title": "Existing Again",
+            "author": "Bulk Author",
+            "isbn": "9990000000",
+            "quantity": 1,
+        },
+        {
+            "title": "Bulk Book 1 Copy",
+            "author": "Bulk Author",
+            "isbn": "9990000001",
+            "quantity": 1,
+        },
+        {"title": "", "author": "Bulk Author", "isbn": "9990000002", "quantity": -1},
+    ]
+    response = client.post("/books/bulk", json=rows, headers=headers)
+    assert response.status_code == 200
+    report = response.json()
+    assert (
+        report["total"],
+        report["created"],
+        report["duplicates"],
+        report["invalid"],
+    ) == (4, 1, 2, 1)
+    assert [row["status"] for row in report["rows"]] == [
+        "created",
+        "duplicate",
+        "duplicate",
+        "invalid",
+    ]
+    assert report["rows"][3]["errors"]
+
+    # NDJSON
+    ndjson = "\n".join(
+        json.dumps(
+            {"title": f"Line {i}", "author": "Nd Author", "isbn": f"99900001{i}"}
+        )
+        for i in range(3)
+    )
+    response = client.post(
+        "/books/bulk",
+        content=ndjson + "\nnot json\n",
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert (response.json()["created"], response.json()["invalid"]) == (3, 1)
+
+    # CSV en fichier multipart, rapport limité aux erreurs
+    csv_data = (
+        "title,author,isbn,quantity\n"
+        "Csv Book,Csv Author,9990000200,4\n"
+        "Csv Book 2,Csv Author,9990000201,\n"
+    )
+    response = client.post(
+        "/books/bulk",
+        params={"report": "errors"},
+        files={"file": ("books.csv", csv_data, "text/csv")},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["created"] == 2
+    assert response.json()["rows"] == []
+
+    # Import qui n'est pas en UTF-8 : refusé en entier, sans ligne insérée
+    for content_type in ("text/csv", "application/x-ndjson", "application/json"):
+        latin1 = (
+            "title,author,isbn,quantity\nCafé,Auteur,9990000300,1\n"
+            if content_type == "text/csv"
+            else '{"title": "Café", "author": "Auteur", "isbn": "9990000300"}\n'
+        ).encode("latin-1")
+        response = client.post(
+            "/books/bulk",
+            content=latin1,
+            headers={**headers, "Content-Type": content_type},
+        )
+        assert response.status_code == 400
+
+    # Les statistiques suivent l'import
+    stats = client.get("/books/stats", headers=headers).json()
+    assert stats["total_books"] == 7
+    assert stats["total_books_in_stock"] == 7
+
+
+def test_bulk_upload_limits(monkeypatch):
+    """Test de l'import en masse : authentification d'abord, taille du corps bornée"""
+    import bulk
+
+    monkeypatch.setattr(bulk, "BULK_UPLOAD_MAX_BYTES", 64)
+    rows = [
+        {"title": f"Big Book {i}", "author": "Big Author", "isbn": f"99100000{i:02d}"}
+        for i in range(5)
+    ]
+
+    # Sans authentification, la requête est refusée avant la lecture du corps
+    assert client.post("/books/bulk", json=rows).status_code == 401
+
+    headers = get_auth_headers()
+    response = client.post("/books/bulk", json=rows, headers=headers)
+    assert response.status_code == 413
+
+    # Corps sans Content-Length : la lecture s'arrête à la limite
+    ndjson = "\n".join(json.dumps(row) for row in rows).encode()
+    response = client.post(
+        "/books/bulk",
+        content=iter([ndjson[:50], ndjson[50:]]),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 413
+
+    response = client.post(
+        "/books/bulk",
+        files={"file": ("books.json", json.dumps(rows), "application/json")},
+        headers=headers,
+    )
+    assert response.status_code == 413
+
+    with TestingSessionLocal() as db:
+        assert db.query(BookModel).filter(BookModel.author == "Big Author").count() == 0
+
+
+def test_async_routes(tmp_path):
+    """Test des endpoints asynchrones (AsyncSession) livres et emprunts"""
+    db_url = f"sqlite:///{tmp_path / 'async.db'}"
+    sync_engine = create_engine(db_url)
+    Base.metadata.create_all(bind=sync_engine)
+    with sessionmaker(bind=sync_engine)() as db:
+        async_user = UserModel(
+            username="asyncuser", email="async@example.com", hashed_password="x"
+        )
+        db.add(async_user)
+        db.commit()
+        db.refresh(async_user)
+
+    async_engine = create_async_engine(to_async_url(db_url), poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    # Une route synchrone existante est remplacée par sa version asynchrone
+    async_app = FastAPI()
+
+    @async_app.get("/books")
+    def legacy_list_books():
+        return []
+
+    use_async_routes(async_app)
+    async_app.dependency_overrides[get_async_db] = override_get_async_db
+    async_client = TestClient(async_app)
+    token = create_access_token({"sub": "asyncuser"}, user=async_user)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    book_data = {
+        "title": "Async Book",
+        "author": "Async Author",
+        "isbn": "1010101010",
+        "quantity": 1,
+    }
+    assert (
+        async_client.post("/books", json=book_data, headers=headers).status_code == 200
+    )
+
+    response = async_client.get("/books", headers=headers)
+    assert response.status_code == 200
+    assert [book["isbn"] for book in response.json()["items"]] == ["1010101010"]
+
+    response = async_client.post(
+        "/loans", json={"book_isbn": "1010101010"}, headers=headers
+    )
+    assert response.status_code == 200
+    loan_id = response.json()["id"]
+    response = async_client.post(
+        "/loans", json={"book_isbn": "1010101010"}, headers=headers
+    )
+    assert response.status_code == 400
+
+    response = async_client.get(
+        "/loans/user", params={"expand": "book"}, headers=headers
+    )
+    assert [loan["id"] for loan in response.json()["items"]] == [loan_id]
+    assert response.json()["items"][0]["book"]["isbn"] == "1010101010"
+
+    response = async_client.post(
+        "/loans/return", json={"loan_id": loan_id}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["is_returned"] is True
+
+    response = async_client.get("/books/1010101010", headers=headers)
+    assert response.json()["quantity"] == 1
+    response = async_client.get("/books/stats", headers=headers)
+    assert response.json()["total_books"] == 1
+
+
+def test_read_replica_routing(tmp_path):
+    """Test du routage des lectures vers les réplicas"""
+    replica_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=replica_engine)
+    with sessionmaker(bind=replica_engine)() as db:
+        db.add(
+            BookModel(
+                title="Replica Book",
+                author="Replica Author",
+                isbn="2020202020",
+                quantity=1,
+            )
+        )
+        db.commit()
+    down_engine = create_engine(f"sqlite:///{tmp_path / 'missing' / 'down.db'}")
+
+    # Round-robin entre les réplicas disponibles, le réplica en panne est écarté
+    router = ReplicaRouter(
+        [
+            Replica("replica-0", "", replica_engine),
+            Replica("replica-1", "", down_engine),
+        ],
+        check_interval=0,
+    )
+    assert [router.choose().name for _ in range(3)] == [
+        "replica-0",
+        "replica-0",
+        "replica-0",
+    ]
+    assert router.replicas[1].healthy is False
+    assert (
+        ReplicaRouter(
+            [Replica("replica-1", "", down_engine)], check_interval=0
+        ).choose()
+        is None
+    )
+
+    headers = get_auth_headers("replicauser")
+    # Middleware installé au démarrage uniquement si des réplicas sont configurés
+    replica_client = TestClient(ReadYourWritesMiddleware(app))
+    replica_router.replicas = [Replica("replica-0", "", replica_engine)]
+    try:
+        response = replica_client.get("/books", headers=headers)
+        assert [book["isbn"] for book in response.json()["items"]] == ["2020202020"]
+
+        # Après une écriture, le client lit ses propres écritures sur le primaire
+        book_data = {
+            "title": "Primary Book",
+            "author": "Primary Author",
+            "isbn": "3030303030",
+            "quantity": 1,
+        }
+        response = replica_client.post("/books", json=book_data, headers=headers)
+        assert "db_primary_until" in response.cookies
+        response = replica_client.get("/books/3030303030", headers=headers)
+        assert response.status_code == 200
+        replica_client.cookies.clear()
+        response = replica_client.get("/books/3030303030", headers=headers)
+        assert response.status_code == 404
+        response = replica_client.get(
+            "/books/3030303030", headers={**headers, "X-Read-Consistency": "primary"}
+        )
+        assert response.status_code == 200
+    finally:
+        replica_router.replicas = []
+        replica_client.cookies.clear()
+
+
+def test_token_claims_and_revocation():
+    """Test de l'authentification sans requête et de la révocation des tokens"""
+    headers = get_auth_headers("claimsuser")
+    token_data = decode_access_token(headers["Authorization"].split()[1])
+    assert token_data.user_id is not None
+    from jose import jwt
+
+    claims = jwt.get_unverified_claims(headers["Authorization"].split()[1])
+    # Pas de droits dans le token : ils sont lus après la vérification de token_version
+    assert "is_admin" not in claims and "is_active" not in claims
+
+    admin_headers = get_auth_headers("claimsadmin")
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "claimsadmin").update(
+            {"is_admin": True}
+        )
+        db.commit()
+    user_cache.clear()
+    # Jeton antérieur aux droits : relu depuis la base à l'expiration du cache
+    assert client.get("/loans/overdue", headers=admin_headers).status_code == 200
+
+    # Utilisateur en cache : aucune requête sur la table des utilisateurs
+    assert client.get("/loans/user", headers=headers).status_code == 200
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert client.get("/loans/user", headers=headers).status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not [statement for statement in statements if "FROM users" in statement]
+
+    # La désactivation révoque les tokens déjà émis
+    response = client.patch(
+        "/users/claimsuser", json={"is_active": False}, headers=headers
+    )
+    assert response.status_code == 403
+    response = client.patch(
+        "/users/claimsuser", json={"is_active": False}, headers=admin_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["is_active"] is False
+    assert client.get("/loans/user", headers=headers).status_code == 401
+
+    response = client.post(
+        "/token", data={"username": "claimsuser", "password": "testpassword123"}
+    )
+    new_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/loans/user", headers=new_headers).status_code == 403
+
+    # Droits retirés par un autre worker (cache local intact) : l'administrateur
+    # est relu en base à chaque requête
+    assert client.get("/loans/overdue", headers=admin_headers).status_code == 200
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "claimsadmin").update(
+            {"is_admin": False, "token_version": UserModel.token_version + 1}
+        )
+        db.commit()
+    assert client.get("/loans/overdue", headers=admin_headers).status_code == 401
+
+    # Nom supprimé puis réenregistré : les tokens de l'ancien compte sont refusés
+    old_headers = get_auth_headers("reuseduser")
+    assert client.get("/loans/user", headers=old_headers).status_code == 200
+    # Compte créé ensuite : SQLite ne réutilise pas l'identifiant supprimé
+    get_auth_headers("reusedfiller")
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "reuseduser").delete()
+        db.commit()
+    new_headers = get_auth_headers("reuseduser")
+    assert client.get("/loans/user", headers=new_headers).status_code == 200
+    assert client.get("/loans/user", headers=old_headers).status_code == 401
+
+
+def test_legacy_password_rehash():
+    """Test du re-hachage transparent des mots de passe SHA-256 historiques"""
+    with TestingSessionLocal() as db:
+        db.add(
+            UserModel(
+                username="legacyuser",
+                email="legacy@example.com",
+                hashed_password=hashlib.sha256(b"legacypassword").hexdigest(),
+            )
+        )
+        db.commit()
+
+    response = client.post(
+        "/token", data={"username": "legacyuser", "password": "wrongpassword"}
+    )
+    assert response.status_code == 401
+    response = client.post(
+        "/token", data={"username": "legacyuser", "password": "legacypassword"}
+    )
+    assert response.status_code == 200
+
+    with TestingSessionLocal() as db:
+        user = db.query(UserModel).filter(UserModel.username == "legacyuser").one()
+        assert user.hashed_password.startswith("$2b$04$")
+
+    response = client.post(
+        "/token", data={"username": "legacyuser", "password": "legacypassword"}
+    )
+    assert response.status_code == 200
+
+
+def test_hashing_pool_queue_limit():
+    """Test du refus des hachages au-delà de la file autorisée"""
+    pool = HashingPool(workers=1, queue_limit=0)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(pool.run("hash", len, "password"))
+    assert error.value.status_code == 503
+    assert (
+        asyncio.run(HashingPool(workers=1, queue_limit=1).run("hash", len, "password"))
+        == 8
+    )
+
+
+def test_concurrent_checkout(tmp_path):
+    """Test des emprunts concurrents : jamais plus d'emprunts que d'exemplaires"""
+    checkout_engine = create_engine(
+        f"sqlite:///{tmp_path / 'checkout.db'}", connect_args={"timeout": 30}
+    )
+    Base.metadata.create_all(bind=checkout_engine)
+    CheckoutSession = sessionmaker(bind=checkout_engine)
+    with CheckoutSession() as db:
+        db.add(
+            BookModel(
+                title="Popular Book",
+                author="Popular Author",
+                isbn="4040404040",
+                quantity=5,
+            )
+        )
+        db.add(
+            UserModel(
+                username="borrower", email="borrower@example.com", hashed_password="x"
+            )
+        )
+        db.commit()
+        user_id = (
+            db.query(UserModel.id).filter(UserModel.username == "borrower").scalar()
+        )
+
+    def borrow(_):
+        with CheckoutSession() as db:
+            try:
+                checkout_book(
+                    db, "4040404040", user_id, datetime.utcnow() + timedelta(days=14)
+                )
+                return 200
+            except HTTPException as error:
+                return error.status_code
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(borrow, range(20)))
+    assert results.count(200) == 5
+    assert results.count(400) == 15
+
+    with CheckoutSession() as db:
+        assert (
+            db.query(BookModel.quantity).filter(BookModel.isbn == "4040404040").scalar()
+            == 0
+        )
+        with pytest.raises(HTTPException) as error:
+            checkout_book(db, "0000000000", user_id, datetime.utcnow())
+        assert error.value.status_code == 404
+        loan_ids = [
+            loan.id
+            for loan in db.query(LoanModel.id).filter(LoanModel.user_id == user_id)
+        ]
+
+    # Retours (tentés deux fois) et emprunts concurrents : aucun exemplaire perdu
+    def give_back(loan_id):
+        with CheckoutSession() as db:
+            try:
+                return_loan(db, loan_id, user_id)
+                return 200
+            except HTTPException as error:
+                return error.status_code
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        returns = executor.map(give_back, loan_ids * 2)
+        checkouts = executor.map(borrow, range(10))
+        returns, checkouts = list(returns), list(checkouts)
+    assert returns.count(200) == 5 and returns.count(404) == 5
+    with CheckoutSession() as db:
+        open_loans = (
+            db.query(LoanModel)
+            .filter(LoanModel.user_id == user_id, LoanModel.is_returned == false())
+            .count()
+        )
+        quantity = (
+            db.query(BookModel.quantity).filter(BookModel.isbn == "4040404040").scalar()
+        )
+    assert open_loans == checkouts.count(200) and quantity + open_loans == 5
+    with CheckoutSession() as db:
+        with pytest.raises(HTTPException) as error:
+            return_loan(db, loan_ids[0], user_id + 1)
+        assert error.value.status_code == 404
+
+
+def test_loan_batch():
+    """Test du lot d'emprunts et de retours en une requête"""
+    headers = get_auth_headers("deskuser")
+    with TestingSessionLocal() as db:
+        db.add(
+            BookModel(
+                title="Desk Book", author="Desk Author", isbn="5050505050", quantity=2
+            )
+        )
+        db.add(
+            BookModel(
+                title="Other Desk Book",
+                author="Desk Author",
+                isbn="6060606060",
+                quantity=1,
+            )
+        )
+        db.commit()
+
+    response = client.post(
+        "/loans/batch",
+        json={
+            "checkouts": [
+                "5050505050",
+                "5050505050",
+                "5050505050",
+                "6060606060",
+                "0000000000",
+            ]
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    checkouts = response.json()["checkouts"]
+    assert [item["status"] for item in checkouts] == [
+        "created",
+        "created",
+        "unavailable",
+        "created",
+        "not_found",
+    ]
+    loan_ids = [item["loan_id"] for item in checkouts if item["status"] == "created"]
+
+    # Un exemplaire rendu peut être réemprunté dans le même lot
+    response = client.post(
+        "/loans/batch",
+        json={
+            "returns": [loan_ids[0], loan_ids[0], 999999],
+            "checkouts": ["5050505050"],
+        },
+        headers=headers,
+    )
+    data = response.json()
+    assert [item["status"] for item in data["returns"]] == [
+        "returned",
+        "not_found",
+        "not_found",
+    ]
+    assert data["returns"][0]["loan"]["is_returned"] is True
+    assert [item["status"] for item in data["checkouts"]] == ["created"]
+
+    # Les emprunts d'un autre utilisateur ne peuvent pas être retournés
+    other_headers = get_auth_headers("otherdeskuser")
+    response = client.post(
+        "/loans/batch", json={"returns": [loan_ids[1]]}, headers=other_headers
+    )
+    assert response.json()["returns"][0]["status"] == "not_found"
+    response = client.post(
+        "/loans/batch",
+        json={"checkouts": ["6060606060"], "user_id": 1},
+        headers=other_headers,
+    )
+    assert response.status_code == 403
+
+    with TestingSessionLocal() as db:
+        quantities = dict(
+            db.query(BookModel.isbn, BookModel.quantity).filter(
+                BookModel.author == "Desk Author"
+            )
+        )
+    assert quantities == {"5050505050": 0, "6060606060": 0}
+
+
+def test_overdue_loans_pagination_and_sweep():
+    """Test de la pagination des retards et du balayage périodique"""
+    admin_headers = get_auth_headers("overdueadmin")
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "overdueadmin").update(
+            {"is_admin": True}
+        )
+        admin_id = (
+            db.query(UserModel.id).filter(UserModel.username == "overdueadmin").scalar()
+        )
+        db.query(LoanModel).delete()
+        book = BookModel(
+            title="Overdue Book", author="Late Author", isbn="7070707070", quantity=10
+        )
+        db.add(book)
+        db.flush()
+        now = datetime.utcnow()
+        db.add_all(
+            LoanModel(
+                book_id=book.id,
+                user_id=admin_id,
+                due_date=now - timedelta(days=days),
+                is_returned=False,
+            )
+            for days in (1, 2, 3, 4, 5)
+        )
+        db.add(
+            LoanModel(
+                book_id=book.id,
+                user_id=admin_id,
+                due_date=now - timedelta(days=6),
+                is_returned=True,
+            )
+        )
+        db.add(
+            LoanModel(
+                book_id=book.id,
+                user_id=admin_id,
+                due_date=now + timedelta(days=6),
+                is_returned=False,
+            )
+        )
+        db.commit()
+    user_cache.clear()
+
+    response = client.get("/loans/overdue", params={"limit": 3}, headers=admin_headers)
+    page = response.json()
+    assert len(page["items"]) == 3 and page["next_cursor"]
+    response = client.get(
+        "/loans/overdue",
+        params={"limit": 3, "cursor": page["next_cursor"]},
+        headers=admin_headers,
+    )
+    second = response.json()
+    assert len(second["items"]) == 2 and second["next_cursor"] is None
+    due_dates = [loan["due_date"] for loan in page["items"] + second["items"]]
+    assert due_dates == sorted(due_dates)
+
+    assert (
+        client.get("/loans/overdue/summary", headers=admin_headers).json()[
+            "overdue_loans"
+        ]
+        == 0
+    )
+    result = sweep_overdue_loans(chunk_size=2, session_factory=TestingSessionLocal)
+    assert result["marked"] == 5
+    assert (
+        sweep_overdue_loans(chunk_size=2, session_factory=TestingSessionLocal)["marked"]
+        == 0
+    )
+    summary = client.get("/loans/overdue/summary", headers=admin_headers).json()
+    assert summary["overdue_loans"] == 5 and summary["overdue_borrowers"] == 1
+    assert all(
+        loan["is_overdue"]
+        for loan in client.get("/loans/overdue", headers=admin_headers).json()["items"]
+    )
+
+    # La requête des retards passe par l'index partiel des emprunts en cours
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT id FROM loans "
+            "WHERE is_returned = 0 AND due_date < ? ORDER BY due_date, id",
+            (datetime.utcnow(),),
+        ).all()
+    assert "ix_loans_open_due_date" in str(plan)
+
+
+def test_user_loans_expand_book():
+    """Test de l'historique des emprunts avec les livres chargés en une requête"""
+    headers = get_auth_headers("historyuser")
+    with TestingSessionLocal() as db:
+        user_id = (
+            db.query(UserModel.id).filter(UserModel.username == "historyuser").scalar()
+        )
+        books = [
+            BookModel(
+                title=f"History Book {index}",
+                author="History Author",
+                isbn=f"80808080{index:02d}",
+                quantity=1,
+            )
+            for index in range(5)
+        ]
+        db.add_all(books)
+        db.flush()
+        db.add_all(
+            LoanModel(
+                book_id=book.id,
+                user_id=user_id,
+                due_date=datetime.utcnow() + timedelta(days=7),
+                is_returned=index % 2 == 0,
+            )
+            for index, book in enumerate(books)
+        )
+        db.commit()
+        book_ids = [book.id for book in books]
+
+    response = client.get("/loans/user", headers=headers)
+    assert len(response.json()["items"]) == 2
+    assert response.json()["items"][0]["book"] is None
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(
+            "/loans/user",
+            params={"show_returned": True, "expand": "book", "limit": 3},
+            headers=headers,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    page = response.json()
+    assert len(page["items"]) == 3
+    assert [loan["book"]["title"] for loan in page["items"]] == [
+        "History Book 4",
+        "History Book 3",
+        "History Book 2",
+    ]
+    # Une requête par table : emprunts en cours et archive
+    assert (
+        len([statement for statement in statements if "FROM loans " in statement]) == 1
+    )
+    assert (
+        len(
+            [
+                statement
+                for statement in statements
+                if "FROM loans_archive " in statement
+            ]
+        )
+        == 1
+    )
+    assert not [
+        statement for statement in statements if statement.startswith("SELECT books")
+    ]
+
+    response = client.get(
+        "/loans/user",
+        params={"show_returned": True, "cursor": page["next_cursor"]},
+        headers=headers,
+    )
+    assert [loan["book_id"] for loan in response.json()["items"]] == [
+        book_ids[1],
+        book_ids[0],
+    ]
+
+
+def test_archive_returned_loans():
+    """Test de l'archivage par lots des emprunts rendus anciens"""
+    headers = get_auth_headers("archiveuser")
+    with TestingSessionLocal() as db:
+        db.query(LoanModel).delete()
+        user = db.query(UserModel).filter(UserModel.username == "archiveuser").one()
+        book = BookModel(
+            title="Archive Book",
+            author="Archive Author",
+            isbn="9090909090",
+            quantity=10,
+        )
+        db.add(book)
+        db.flush()
+        now = datetime.utcnow()
+        old = now - timedelta(days=800)
+        db.add_all(
+            LoanModel(
+                book_id=book.id,
+                user_id=user.id,
+                loan_date=old,
+                due_date=old,
+                return_date=old,
+                is_returned=True,
+            )
+            for _ in range(5)
+        )
+        # Emprunt ancien jamais rendu et emprunt rendu récent : conservés
+        db.add(
+            LoanModel(
+                book_id=book.id,
+                user_id=user.id,
+                loan_date=old,
+                due_date=old,
+                is_returned=False,
+            )
+        )
+        db.add(
+            LoanModel(
+                book_id=book.id,
+                user_id=user.id,
+                loan_date=now,
+                due_date=now,
+                return_date=now,
+                is_returned=True,
+            )
+        )
+        db.commit()
+        book_id = book.id
+
+    result = archive_returned_loans(
+        older_than_days=730, chunk_size=2, session_factory=TestingSessionLocal
+    )
+    assert result["archived"] == 5
+    assert (
+        archive_returned_loans(
+            older_than_days=730, chunk_size=2, session_factory=TestingSessionLocal
+        )["archived"]
+        == 0
+    )
+
+    with TestingSessionLocal() as db:
+        assert db.query(LoanModel).count() == 2
+        archived = db.query(LoanArchiveModel).all()
+        assert len(archived) == 5
+        assert all(loan.is_returned and loan.book_id == book_id for loan in archived)
+        loan_ids = sorted(
+            [loan.id for loan in db.query(LoanModel.id)]
+            + [loan.id for loan in archived],
+            reverse=True,
+        )
+
+    # L'historique complet inclut les emprunts archivés, dans l'ordre des ids
+    items, params = [], {"show_returned": True, "expand": "book", "limit": 3}
+    while True:
+        page = client.get("/loans/user", params=params, headers=headers).json()
+        items += page["items"]
+        if not page["next_cursor"]:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert [item["id"] for item in items] == loan_ids
+    assert all(item["book"]["isbn"] == "9090909090" for item in items)
+    assert len(client.get("/loans/user", headers=headers).json()["items"]) == 1
+
+
+def test_lifespan_order(monkeypatch):
+    """Test du cycle de vie : démarrage dans l'ordre, arrêt dans l'ordre inverse"""
+    import main
+
+    calls = []
+    for name in (
+        "initialize_database",
+        "load_suggestion_index",
+        "initialize_library_stats",
+        "start_system_metrics_sampler",
+        "start_loan_maintenance",
+        "stop_system_metrics_sampler",
+    ):
+        monkeypatch.setattr(main, name, lambda name=name: calls.append(name))
+    for name in (
+        "continuous_profiler",
+        "overdue_sweeper",
+        "loan_maintenance",
+        "suggestion_index_refresher",
+    ):
+        job = getattr(main, name)
+        monkeypatch.setattr(
+            job, "start", lambda name=name: calls.append(f"{name}.start")
+        )
+        monkeypatch.setattr(job, "stop", lambda name=name: calls.append(f"{name}.stop"))
+
+    with TestClient(app):
+        assert calls == [
+            "initialize_database",
+            "load_suggestion_index",
+            "initialize_library_stats",
+            "start_system_metrics_sampler",
+            "continuous_profiler.start",
+            "overdue_sweeper.start",
+            "start_loan_maintenance",
+        ]
+        del calls[:]
+    assert calls == [
+        "loan_maintenance.stop",
+        "overdue_sweeper.stop",
+        "continuous_profiler.stop",
+        "stop_system_metrics_sampler",
+        "suggestion_index_refresher.stop",
+    ]
+
+
+def test_migrations(tmp_path):
+    """Test des migrations : base vide, base existante, idempotence"""
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert upgrade(fresh) == [version for version, _, _ in MIGRATIONS]
+    assert upgrade(fresh) == []
+    columns = {
+        table: {column["name"] for column in inspect(fresh).get_columns(table)}
+        for table in Base.metadata.tables
+    }
+    assert columns == {
+        name: set(table.columns.keys()) for name, table in Base.metadata.tables.items()
+    }
+    assert "ix_loans_open_due_date" in {
+        index["name"] for index in inspect(fresh).get_indexes("loans")
+    }
+
+    # Base créée avant les migrations : les migrations s'appliquent sans erreur
+    existing = create_engine(f"sqlite:///{tmp_path / 'existing.db'}")
+    Base.metadata.create_all(bind=existing)
+    assert len(upgrade(existing)) == len(MIGRATIONS)
+
+
+def test_import_does_not_connect():
+    """L'import de l'application n'ouvre aucune connexion à la base"""
+    script = (
+        "from sqlalchemy import event; from sqlalchemy.pool import Pool; "
+        "connections = []; "
+        "event.listen(Pool, 'connect', lambda *args: connections.append(1)); "
+        "import main, database; assert not connections and database._engine is None"
+    )
+    environment = dict(os.environ, DATABASE_URL="postgresql://nobody@127.0.0.1:1/none")
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_metrics_endpoint():
+    """Test de /metrics : sérialisation des métriques échantillonnées, sans attente"""
+    from monitoring import metrics
+
+    metrics.update_system_metrics()
+    assert metrics.system_sample["process_rss"] > 0
+
+    started = time.perf_counter()
+    response = client.get("/metrics")
+    assert time.perf_counter() - started < 0.5
+    assert response.status_code == 200
+    assert "app_process_resident_memory_bytes" in response.text
+    assert 'app_gc_collections{generation="0"}' in response.text
+
+
+def test_multiprocess_metrics(tmp_path):
+    """Test du mode multiprocessus : métriques agrégées sur tous les workers"""
+    backend = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    worker = (
+        "import monitoring; "
+        "monitoring.REQUEST_COUNT.labels("
+        "method='GET', endpoint='/books', status_code='200').inc(); "
+        "monitoring.ACTIVE_CONNECTIONS.inc(); "
+        "monitoring.metrics.update_system_metrics()"
+    )
+    workers = [
+        subprocess.Popen([sys.executable, "-c", worker], cwd=backend, env=environment)
+        for _ in range(2)
+    ]
+    pids = [process.pid for process in workers]
+    assert all(process.wait() == 0 for process in workers)
+
+    scrape = "import monitoring; print(monitoring.get_metrics_endpoint().body.decode())"
+
+    def metrics_text():
+        result = subprocess.run(
+            [sys.executable, "-c", scrape],
+            cwd=backend,
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        return result.stdout
+
+    output = metrics_text()
+    assert (
+        'http_requests_total{endpoint="/books",method="GET",status_code="200"} 2.0'
+        in output
+    )
+    assert "active_connections 2.0" in output
+
+    # Les jauges "live" d'un worker arrêté disparaissent, les compteurs restent
+    mark_dead = (
+        f"import monitoring; [monitoring.mark_worker_dead(pid) for pid in {pids}]"
+    )
+    subprocess.run(
+        [sys.executable, "-c", mark_dead], cwd=backend, env=environment, check=True
+    )
+    output = metrics_text()
+    assert "active_connections 2.0" not in output
+    assert (
+        'http_requests_total{endpoint="/books",method="GET",status_code="200"} 2.0'
+        in output
+    )
+
+
+def test_metrics_route_template_labels():
+    """Test des métriques HTTP étiquetées par modèle de route"""
+    headers = get_auth_headers("metricsuser")
+    client.get("/books/0000000001", headers=headers)
+    client.get("/books/0000000002", headers=headers)
+    client.get("/no-such-page")
+
+    output = client.get("/metrics").text
+    assert (
+        'http_requests_total{endpoint="/books/{isbn}",method="GET",status_code="404"}'
+        in output
+    )
+    assert "/books/0000000001" not in output
+    assert 'endpoint="unmatched"' in output
+    assert "/no-such-page" not in output
+
+
+def test_query_instrumentation(monkeypatch, caplog):
+    """Test des métriques SQL : requêtes par requête HTTP et requêtes lentes"""
+    import monitoring
+    from prometheus_client import REGISTRY
+
+    headers = get_auth_headers("queryuser")
+
+    def queries_observed():
+        return (
+            REGISTRY.get_sample_value(
+                "db_queries_per_request_sum", {"endpoint": "/loans/user"}
+            )
+            or 0
+        )
+
+    before = queries_observed()
+    client.get("/loans/user", params={"expand": "book"}, headers=headers)
+    assert queries_observed() - before >= 1
+
+    monkeypatch.setattr(monitoring, "SLOW_QUERY_THRESHOLD_MS", 1e-6)
+    monkeypatch.setattr(monitoring, "_slow_query_log", {})
+    with caplog.at_level("WARNING", logger="monitoring"):
+        client.get("/loans/user", headers=headers)
+        client.get("/loans/user", headers=headers)
+    slow = [
+        record.getMessage()
+        for record in caplog.records
+        if "Requête SQL lente" in record.getMessage()
+    ]
+    assert slow and all("GET /loans/user" in message for message in slow)
+    # Une seule ligne par empreinte sur l'intervalle
+    assert len(slow) == len(set(message.split(" : ", 1)[1] for message in slow))
+    assert REGISTRY.get_sample_value(
+        "db_slow_queries_total", {"endpoint": "GET /loans/user"}
+    ) >= len(slow)
+
+    assert (
+        monitoring.sql_fingerprint(
+            "SELECT * FROM books WHERE id IN (1, 2, 3) AND title = 'x'"
+        )
+        == "SELECT * FROM books WHERE id IN (?) AND title = ?"
+    )
+
+
+def test_query_timing_after_failed_statement():
+    """Test des durées SQL : une requête en échec ne laisse rien sur la connexion"""
+    import monitoring
+    from sqlalchemy import text
+    from sqlalchemy.exc import IntegrityError
+    from prometheus_client import REGISTRY
+
+    def observations(statement):
+        label = monitoring.sql_fingerprint(statement)
+        return (
+            REGISTRY.get_sample_value(
+                "db_query_duration_seconds_count", {"statement": label}
+            )
+            or 0
+        )
+
+    duplicate = (
+        "INSERT INTO books (title, author, isbn, quantity) "
+        "VALUES ('Dup', 'Dup', '7171717171', 1)"
+    )
+    probe = "SELECT 42"
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM books WHERE isbn = '7171717171'"))
+        conn.execute(text(duplicate))
+
+        def info():
+            return {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in conn.info.items()
+            }
+
+        info_before = info()
+        failed_before, probe_before = observations(duplicate), observations(probe)
+        for _ in range(20):
+            with pytest.raises(IntegrityError):
+                conn.execute(text(duplicate))
+        assert info() == info_before
+        assert observations(duplicate) == failed_before
+
+        assert conn.execute(text(probe)).scalar() == 42
+        assert observations(probe) == probe_before + 1
+        conn.rollback()
+
+
+def test_request_profiling(tmp_path, monkeypatch):
+    """Test du profilage d'une requête à la demande d'un administrateur"""
+    import main
+    from profiling import ProfileStore, ProfilingMiddleware
+
+    store = ProfileStore(str(tmp_path), max_files=2)
+    monkeypatch.setattr(main, "profile_store", store)
+    profiled = TestClient(
+        ProfilingMiddleware(
+            app, sample_rate=0, store=store, session_factory=TestingSessionLocal
+        )
+    )
+
+    # Demande ignorée sans droits d'administrateur
+    headers = get_auth_headers("profileadmin")
+    response = profiled.get("/books", headers={**headers, "X-Profile": "1"})
+    assert response.status_code == 200 and "x-profile-id" not in response.headers
+    assert client.get("/admin/profiles", headers=headers).status_code == 403
+
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "profileadmin").update(
+            {"is_admin": True}
+        )
+        db.commit()
+    user_cache.clear()
+    headers = get_auth_headers("profileadmin")
+
+    assert "x-profile-id" not in profiled.get("/books", headers=headers).headers
+    profile_ids = [
+        profiled.get("/books", params={"profile": "1"}, headers=headers).headers[
+            "x-profile-id"
+        ]
+        for _ in range(3)
+    ]
+
+    # Seuls les max_files profils les plus récents sont conservés
+    profiles = client.get("/admin/profiles", headers=headers).json()
+    assert [profile["id"] for profile in profiles] == profile_ids[:0:-1]
+    assert profiles[0]["endpoint"] == "/books" and profiles[0]["trigger"] == "admin"
+    assert (
+        client.get(f"/admin/profiles/{profile_ids[0]}", headers=headers).status_code
+        == 404
+    )
+
+    response = client.get(f"/admin/profiles/{profile_ids[-1]}", headers=headers)
+    assert response.status_code == 200
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack and int(count) > 0
+    assert client.get("/admin/profiles/..%2Fsecret", headers=headers).status_code == 404
+
+    # Un administrateur rétrogradé ne déclenche plus de profil avec son ancien token
+    with TestingSessionLocal() as db:
+        update_user_access(
+            db,
+            db.query(UserModel).filter(UserModel.username == "profileadmin").one(),
+            is_admin=False,
+        )
+    response = profiled.get("/books", params={"profile": "1"}, headers=headers)
+    assert response.status_code == 401 and "x-profile-id" not in response.headers
+
+
+def test_continuous_stack_sampler():
+    """Test de l'échantillonnage continu des piles, agrégées par route"""
+    import threading
+    from profiling import StackSampler
+
+    sampler = StackSampler(bucket_seconds=60, retention=2)
+    headers = get_auth_headers("sampleruser")
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            sampler.sample()
+            time.sleep(0.0005)
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    try:
+        deadline = time.time() + 10
+        while "GET /loans/user" not in sampler.endpoints(60) and time.time() < deadline:
+            client.get("/loans/user", params={"expand": "book"}, headers=headers)
+    finally:
+        stop.set()
+        thread.join()
+
+    stacks = sampler.export(60, endpoint="GET /loans/user")
+    assert stacks and all(count > 0 for count in stacks.values())
+    assert all(
+        stack.split(";", 1)[0] in sampler.endpoints(60) for stack in sampler.export(60)
+    )
+    assert sampler.export(60, endpoint="GET /unknown") == {}
+
+    # Seules les tranches les plus récentes sont conservées
+    sampler.clear()
+    sampler._request_stack = lambda frame: ("GET /books", ["main"])
+    now = time.time()
+    for age in (180, 120, 60, 0):
+        sampler.sample(now=now - age)
+    threads = len(sys._current_frames()) - 1
+    assert sampler.export(3600, now=now) == {"GET /books;main": 2 * threads}
+    assert sampler.export(1, now=now) == {"GET /books;main": threads}
+
+    headers = get_auth_headers("sampleradmin")
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "sampleradmin").update(
+            {"is_admin": True}
+        )
+        db.commit()
+    user_cache.clear()
+    response = client.get(
+        "/admin/profiles/continuous", params={"window": 60}, headers=headers
+    )
+    assert response.status_code == 200 and response.headers["content-type"].startswith(
+        "text/plain"
+    )
+    assert (
+        client.get("/admin/profiles/continuous/endpoints", headers=headers).status_code
+        == 200
+    )
+    assert (
+        client.get(
+            "/admin/profiles/continuous", params={"window": 0}, headers=headers
+        ).status_code
+        == 422
+    )
+
+
+def test_memory_diagnostics():
+    """Test du traçage des allocations et des métriques du ramasse-miettes"""
+    import gc
+    import monitoring
+    from prometheus_client import REGISTRY
+
+    headers = get_auth_headers("memoryadmin")
+    assert client.post("/admin/memory/snapshots", headers=headers).status_code == 403
+    with TestingSessionLocal() as db:
+        db.query(UserModel).filter(UserModel.username == "memoryadmin").update(
+            {"is_admin": True}
+        )
+        db.commit()
+    user_cache.clear()
+
+    assert client.post("/admin/memory/snapshots", headers=headers).status_code == 409
+    response = client.post(
+        "/admin/memory/tracemalloc/start", params={"frames": 5}, headers=headers
+    )
+    assert response.status_code == 200 and response.json()["tracing"] is True
+    try:
+        before = client.post("/admin/memory/snapshots", headers=headers).json()["id"]
+        leaked = [bytearray(1024) for _ in range(2000)]
+        after = client.post("/admin/memory/snapshots", headers=headers).json()["id"]
+    finally:
+        response = client.post("/admin/memory/tracemalloc/stop", headers=headers)
+    assert response.status_code == 200 and response.json()["tracing"] is False
+    assert (
+        client.post("/admin/memory/tracemalloc/stop", headers=headers).status_code
+        == 409
+    )
+
+    # Diagnostic propre au worker : pid renvoyé, autre worker refusé
+    status = client.get("/admin/memory", headers=headers).json()
+    assert status["pid"] == os.getpid()
+    assert [snapshot["pid"] for snapshot in status["snapshots"]][-2:] == [
+        os.getpid()
+    ] * 2
+    other = client.get(
+        f"/admin/memory/snapshots/{after}/top",
+        params={"pid": os.getpid() + 1},
+        headers=headers,
+    )
+    assert other.status_code == 409 and str(os.getpid()) in other.json()["detail"]
+
+    # La fuite arrive en tête de la croissance entre les deux instantanés
+    response = client.get(
+        f"/admin/memory/snapshots/{after}/top",
+        params={"compare_to": before, "limit": 5, "pid": os.getpid()},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    top = response.json()["sites"][0]
+    assert top["site"].rsplit(":", 1)[0] == __file__
+    assert top["size_diff_bytes"] >= 2000 * 1024 and top["count_diff"] >= 2000
+    assert len(leaked) == 2000
+    assert client.get(
+        f"/admin/memory/snapshots/{after}/top",
+        params={"key_type": "traceback"},
+        headers=headers,
+    ).json()["sites"]
+    assert (
+        client.get("/admin/memory/snapshots/999/top", headers=headers).status_code
+        == 404
+    )
+
+    monitoring.install_gc_callbacks()
+    try:
+
+        def collections():
+            return (
+                REGISTRY.get_sample_value(
+                    "app_gc_pause_seconds_count", {"generation": "2"}
+                )
+                or 0
+            )
+
+        count = collections()
+        cycle = []
+        cycle.append(cycle)
+        del cycle
+        gc.collect()
+        monitoring.publish_gc_metrics()
+        # Une collecte automatique peut s'ajouter depuis un autre thread
+        assert collections() >= count + 1
+        assert (
+            REGISTRY.get_sample_value(
+                "app_gc_collected_objects_total", {"generation": "2"}
+            )
+            >= 1
+        )
+    finally:
+        monitoring.uninstall_gc_callbacks()
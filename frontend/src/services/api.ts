@@ -2,14 +2,17 @@ import axios, { AxiosInstance, AxiosResponse } from 'axios';
 import { 
   User, 
   Book, 
+  BookPage,
   BookCreate, 
   BookUpdate, 
   Loan, 
+  LoanPage,
   LoanCreate, 
   LoginCredentials, 
   RegisterData, 
   Token, 
   SearchParams,
+  PaginationParams,
   LibraryStats
 } from '../types';
 
@@ -76,8 +79,8 @@ class ApiService {
 
   // Gestion des livres
   async getBooks(params?: SearchParams): Promise<Book[]> {
-    const response: AxiosResponse<Book[]> = await this.api.get('/books', { params });
-    return response.data;
+    const response: AxiosResponse<BookPage> = await this.api.get('/books', { params });
+    return response.data.items;
   }
 
   async getBook(id: number): Promise<Book> {
@@ -112,9 +115,12 @@ class ApiService {
     return response.data;
   }
 
-  async getUserLoans(params?: SearchParams): Promise<Loan[]> {
-    const response: AxiosResponse<Loan[]> = await this.api.get('/loans/my-loans', { params });
-    return response.data;
+  async getUserLoans(params?: PaginationParams): Promise<Loan[]> {
+    // Livres inclus dans la même requête : pas d'appel /books par emprunt
+    const response: AxiosResponse<LoanPage> = await this.api.get('/loans/user', {
+      params: { expand: 'book', ...params }
+    });
+    return response.data.items;
   }
 
   async createLoan(loan: LoanCreate): Promise<Loan> {
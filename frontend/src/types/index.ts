@@ -15,6 +15,14 @@ export interface Book {
   created_at: string;
 }
 
+export interface BookPage {
+  items: Book[];
+  limit: number;
+  sort: string;
+  next_cursor: string | null;
+  next: string | null;
+}
+
 export interface BookCreate {
   title: string;
   author: string;
@@ -39,6 +47,14 @@ export interface Loan {
   user: User;
 }
 
+export interface LoanPage {
+  items: Loan[];
+  limit: number;
+  sort: string;
+  next_cursor: string | null;
+  next: string | null;
+}
+
 export interface LoanCreate {
   book_id: number;
 }
@@ -65,8 +81,9 @@ export interface ApiResponse<T> {
 }
 
 export interface PaginationParams {
-  skip?: number;
   limit?: number;
+  cursor?: string;
+  sort?: 'id' | 'title' | 'author';
 }
 
 export interface SearchParams extends PaginationParams {